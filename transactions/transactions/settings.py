@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'transactionsApp.profiling.ProfilingMiddleware', # does nothing unless PROFILING['ENABLED']
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -98,6 +99,76 @@ DATABASES = {
     }
 }
 
+# Read replica: with DATABASE_REPLICA_HOST set, the read-only endpoints read from it (see transactionsApp/db_routing.py).
+# Locally, two SQLite files can stand in for the primary and the replica.
+if(os.environ.get('DATABASE_REPLICA_HOST')):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get('DATABASE_REPLICA_HOST'),
+        'PORT': os.environ.get('DATABASE_REPLICA_PORT' , DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+'''DATABASES = { # local primary and replica, copy db.sqlite3 to replica.sqlite3 to "replicate"
+    'default': {'ENGINE': 'django.db.backends.sqlite3' , 'NAME': BASE_DIR / 'db.sqlite3'},
+    'replica': {'ENGINE': 'django.db.backends.sqlite3' , 'NAME': BASE_DIR / 'replica.sqlite3' , 'TEST': {'MIRROR': 'default'}},
+}'''
+REPLICA_DATABASE = 'replica'
+REPLICA_PIN_SECONDS = 5 # reads of a user stay on the primary this long after a write, to hide the replication lag
+DATABASE_ROUTERS = ['transactionsApp.db_routing.ReplicaRouter']
+
+
+# analytics results, keyed on the request and the user's data version (see transactionsApp/caching.py). locmem is
+# per process, expires entries after TIMEOUT seconds and culls the least recently used beyond MAX_ENTRIES. With
+# several processes point it to a shared backend, e.g.
+#     'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analytics': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'analytics',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+ANALYTICS_CACHE = 'analytics'
+
+# analytics reports computed in the background (POST /users/<id>/analytics/?async=true, see transactionsApp/jobs.py)
+ANALYTICS_JOBS = {
+    'WORKERS': 2, # threads computing reports, per process (0 computes them in the request, after the commit)
+    'PER_USER': 2, # queued or running reports per user
+    'MAX_PENDING': 100, # queued or running reports in total
+    'TIMEOUT': 600, # seconds after which an unfinished report counts as failed
+}
+
+# daily exchange rates (python manage.py load_rates eurofxref-hist.xml, see transactionsApp/rates.py)
+EXCHANGE_RATES = {
+    'TTL': 300, # seconds after which a process reloads the rates
+}
+
+
+# per-request Server-Timing headers, slow request samples and per-route histograms at /internal/metrics/
+PROFILING = {
+    'ENABLED': os.environ.get('DJANGO_PROFILING') == '1',
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_REQUESTS_KEPT': 100,
+}
+
+
+# a request running more queries than the query_budget of its viewset action raises QueryBudgetExceeded
+QUERY_BUDGET_ENFORCED = DEBUG
+
+# a GET, HEAD or OPTIONS request to a viewset that writes to the database raises WriteOnRead
+READ_ONLY_GUARD = DEBUG
+
+
+REST_FRAMEWORK = {
+    # keyset pagination: every list endpoint seeks on its ordering columns, deep pages cost the same as the first
+    'DEFAULT_PAGINATION_CLASS': 'transactionsApp.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
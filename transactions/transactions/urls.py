@@ -1,6 +1,7 @@
 from rest_framework_nested import routers
 from transactionsApp.views import *
 from django.urls import path , include
+from transactionsApp.profiling import metrics_view
 
 router = routers.SimpleRouter()
 router.register(r'users', CustomUserViewSet)
@@ -15,4 +16,5 @@ users_router.register(r'analytics', AnalyticsViewSet , basename='user-analytics'
 urlpatterns = [
                 path('', include(router.urls)),
                 path('' , include(users_router.urls)),
+                path('internal/metrics/' , metrics_view , name='internal-metrics'),
               ]
\ No newline at end of file
@@ -0,0 +1,236 @@
+from .models import *
+from django.db.models import Sum , Count , Exists , OuterRef
+from django.db.models.functions import TruncDay , TruncWeek , TruncMonth
+
+
+
+
+class TransactionTotals:
+    # Sums the daily rollups of the transactions in the database, grouped by type, payment method, recurring,
+    # currency and by whether the card of the transaction still belongs to the user. Each group is converted
+    # to the goal currency once, so the cost depends on the number of days, not on the number of transactions.
+    # With historical_rates the groups are per day too, each converted at the rates of its day.
+
+    def __init__(self , rollups , user , currency , historical_rates=False):
+        user_cards = Card.objects.filter(user=user , card_number=OuterRef('card_number'))
+        fields = ['type' , 'payment_method' , 'recurring' , 'currency' , 'has_card'] + (['day'] if(historical_rates) else [])
+        rows = (rollups.annotate(has_card=Exists(user_cards))
+                       .values(*fields)
+                       .annotate(total=Sum('total'))
+                       .order_by())
+
+        self.groups = []
+        for row in rows:
+            if(row['currency'] != currency):
+                row['total'] = Currency_rate.convertion(row['total'] , row['currency'] , currency , on=row.get('day'))
+            self.groups.append(row)
+
+
+    def total(self , **match):
+        total = 0
+        for group in self.groups:
+            if(all(group[key] == value for key , value in match.items())):
+                total += group['total']
+        return total
+
+
+
+
+
+
+def cards_balances(cards , currency):
+    total_card_balance = 0
+    cards_balances = []
+    for card in cards:
+        card_balance = (card.balance if(card.currency == currency) else Currency_rate.convertion(card.balance , card.currency , currency))
+        total_card_balance += card_balance
+        cards_balances.append(f'{card.card_type} - {card.card_number}  ->  {card_balance:.2f} {currency}')
+    return total_card_balance , cards_balances
+
+
+
+
+
+
+REPORT_OPTIONS = ('all_assets' , 'cash' , 'card' , 'income_transactions' , 'expense_transactions' , 'subscriptions' , 'historical_rates')
+
+
+def report_params(data):
+    # the request data that decides the report, with the unset options as False (cache key, see caching.py)
+    params = {option: bool(data.get(option)) for option in REPORT_OPTIONS}
+    params.update(currency=data.get('currency') , compute_statistics_from=data.get('compute_statistics_from') ,
+                  compute_statistics_to=data.get('compute_statistics_to') , choose_card=data.get('choose_card') if(params['card']) else None)
+    return params
+
+
+
+
+def build_report(user , data , cards=None):
+    if(cards is None):
+        cards = Card.objects.filter(user=user).order_by('id') # same order as the user context
+    all_assets = data.get('all_assets')
+    cash = data.get('cash')
+    card = data.get('card')
+    income_transactions = data.get('income_transactions')
+    expense_transactions = data.get('expense_transactions')
+    subscriptions = data.get('subscriptions')
+    historical_rates = data.get('historical_rates') # transactions at the rates of their day, balances at the latest rates
+    currency = data.get('currency')
+    compute_statistics_from = data.get('compute_statistics_from')
+    compute_statistics_to = data.get('compute_statistics_to')
+    choose_card = str(data.get('choose_card')).strip('-').split()[3]
+    selected_card = data.get('choose_card')
+    message = []
+    # the subscription payments charged by the billing engine count like the other transactions of their day
+    rollups = DailyRollup.objects.filter(user=user ,
+                                         day__gte = compute_statistics_from ,
+                                         day__lte = compute_statistics_to
+                                         )
+
+
+
+    if(all_assets):
+        total_cash = user.cash if(user.currency == currency) else Currency_rate.convertion(user.cash , user.currency , currency)
+        total_card_balance , balances = cards_balances(cards , currency)
+        message.append( f'Total assets: {total_cash + total_card_balance:.2f} {currency}' )
+        message.append('Total cash: ' f'{total_cash:.2f} {currency}')
+        message.append('Total card balance: ' f'{total_card_balance:.2f} {currency}')
+        message.append(balances)
+
+        totals = TransactionTotals(rollups , user , currency , historical_rates)
+        # card transactions count only if the card still belongs to the user, subscriptions count regardless
+        total_income_cash = totals.total(type='Income' , payment_method='Cash')
+        total_income_card = totals.total(type='Income' , payment_method='Card' , has_card=True)
+        total_expenses_cash = totals.total(type='Expense' , payment_method='Cash')
+        total_expenses_card = totals.total(type='Expense' , payment_method='Card' , has_card=True)
+        total_incomes_subscriptions = totals.total(type='Income' , recurring=True)
+        total_expenses_subscriptions = totals.total(type='Expense' , recurring=True)
+
+        message.append(f'Total incomes in cash: {total_income_cash:.2f} {currency}')
+        message.append(f'Total incomes in card: {total_income_card:.2f} {currency}')
+        message.append(f'Total expenses in cash: {total_expenses_cash:.2f} {currency}')
+        message.append(f'Total expenses in card: {total_expenses_card:.2f} {currency}')
+        message.append(f'Total incomes subscriptions: {total_incomes_subscriptions:.2f} {currency}')
+        message.append(f'Total expenses subscriptions: {total_expenses_subscriptions:.2f} {currency}')
+
+
+
+    elif(cash):
+        total_cash = user.cash if(user.currency == currency) else Currency_rate.convertion(user.cash , user.currency , currency)
+        message.append('Total cash: ' f'{total_cash:.2f} {currency}')
+
+        totals = TransactionTotals(rollups.filter(payment_method='Cash') , user , currency , historical_rates)
+        total_income_cash = totals.total(type='Income')
+        total_expense_cash = totals.total(type='Expense') if(expense_transactions) else 0
+
+        if(income_transactions):
+            message.append(f'Total incomes in cash: {total_income_cash:.2f} {currency}')
+
+        if(expense_transactions):
+            message.append(f'Total expenses in cash: {total_expense_cash:.2f} {currency}')
+
+        elif(not income_transactions and not expense_transactions):
+            message.append(f'Total incomes in cash: {total_income_cash:.2f} {currency}')
+            message.append(f'Total expenses in cash: {total_expense_cash:.2f} {currency}')
+
+
+    elif(card):
+        total_card_balance , balances = cards_balances(cards , currency)
+        message.append('Total card balance: ' f'{total_card_balance:.2f} {currency}')
+        message.append(balances)
+
+        totals = TransactionTotals(rollups.filter(card_number=choose_card) , user , currency , historical_rates)
+        total_income_card = totals.total(type='Income' , payment_method='Card' , has_card=True)
+        total_expenses_card = totals.total(type='Expense' , payment_method='Card' , has_card=True)
+        total_incomes_subscriptions = totals.total(type='Income' , recurring=True , has_card=True)
+        total_expenses_subscriptions = totals.total(type='Expense' , recurring=True , has_card=True)
+
+        # the subscriptions option has always counted the recurring transactions a second time
+        if(subscriptions):
+            total_incomes_subscriptions += totals.total(type='Income' , recurring=True , has_card=True)
+            total_expenses_subscriptions += totals.total(type='Expense' , recurring=True , has_card=True)
+
+        if(income_transactions):
+            message.append(f'Total incomes with \'{selected_card}\': {total_income_card:.2f} {currency}')
+            if(subscriptions):
+                message.append(f'Total incomes subscriptions with \'{selected_card}\': {total_incomes_subscriptions:.2f} {currency}')
+        if(expense_transactions):
+            message.append(f'Total expenses with \'{selected_card}\': {total_expenses_card:.2f} {currency}')
+            if(subscriptions):
+                message.append(f'Total expenses subscriptions with \'{selected_card}\': {total_expenses_subscriptions:.2f} {currency}')
+        elif(subscriptions and not income_transactions and not expense_transactions):
+            message.append(f'Total incomes subscriptions with \'{selected_card}\': {total_incomes_subscriptions:.2f} {currency}')
+            message.append(f'Total expenses subscriptions with \'{selected_card}\': {total_expenses_subscriptions:.2f} {currency}')
+        elif(not income_transactions and not expense_transactions and not subscriptions):
+            message.append(f'Total incomes with \'{selected_card}\': {total_income_card:.2f} {currency}')
+            message.append(f'Total expenses with \'{selected_card}\': {total_expenses_card:.2f} {currency}')
+            message.append(f'Total incomes subscriptions with \'{selected_card}\': {total_incomes_subscriptions:.2f} {currency}')
+            message.append(f'Total expenses subscriptions with \'{selected_card}\': {total_expenses_subscriptions:.2f} {currency}')
+
+    return message
+
+
+
+
+
+
+
+
+SERIES_BUCKETS = {'day': TruncDay , 'week': TruncWeek , 'month': TruncMonth}
+
+
+
+def money(amount):
+    return f'{amount:.2f}'
+
+
+
+
+def build_series(user_id , compute_statistics_from , compute_statistics_to , bucket='month' , currency='EUR' , payment_method=None ,
+                 historical_rates=False):
+    # Income and expense per day, week or month, broken down by category and payment method, from one grouped
+    # query. Each group is converted to the goal currency once (once per day with historical_rates, at its rates).
+    transactions = Transaction.objects.filter(user_id=user_id ,
+                                              transaction_date__gte = compute_statistics_from ,
+                                              transaction_date__lte = compute_statistics_to
+                                              )
+    if(payment_method):
+        transactions = transactions.filter(payment_method=payment_method)
+    fields = ['period' , 'category_id' , 'category__title' , 'payment_method' , 'type' , 'currency'] + (['transaction_date'] if(historical_rates) else [])
+    rows = (transactions.annotate(period=SERIES_BUCKETS[bucket]('transaction_date'))
+                        .values(*fields)
+                        .annotate(total=Sum('amount') , count=Count('id'))
+                        .order_by('period'))
+
+    periods = {}
+    for row in rows:
+        total = row['total'] if(row['currency'] == currency) else Currency_rate.convertion(row['total'] , row['currency'] , currency ,
+                                                                                           on=row.get('transaction_date'))
+        side = 'income' if(row['type'] == 'Income') else 'expense'
+        period = periods.setdefault(row['period'] , {'income': 0 , 'expense': 0 , 'count': 0 , 'categories': {} , 'payment_methods': {}})
+        category = period['categories'].setdefault(row['category_id'] , {'id': row['category_id'] , 'title': row['category__title'] ,
+                                                                         'income': 0 , 'expense': 0})
+        method = period['payment_methods'].setdefault(row['payment_method'] , {'income': 0 , 'expense': 0})
+        period[side] += total
+        period['count'] += row['count']
+        category[side] += total
+        method[side] += total
+
+    series = []
+    for day , period in periods.items():
+        series.append({
+            'period': day.isoformat(),
+            'income': money(period['income']),
+            'expense': money(period['expense']),
+            'net': money(period['income'] - period['expense']),
+            'transactions': period['count'],
+            'expense_exceeds_income': period['expense'] > period['income'],
+            'categories': [{**category , 'income': money(category['income']) , 'expense': money(category['expense'])}
+                           for category in sorted(period['categories'].values() , key=lambda category: category['title'] or '')],
+            'payment_methods': {name: {'income': money(method['income']) , 'expense': money(method['expense'])}
+                                for name , method in sorted(period['payment_methods'].items())},
+        })
+
+    return {'bucket': bucket , 'currency': currency , 'from': compute_statistics_from.isoformat() , 'to': compute_statistics_to.isoformat() ,
+            'series': series , 'alerts': [f"⚠️ Expenses exceeded income in the {bucket} of {period['period']}."
+                                          for period in series if(period['expense_exceeds_income'])]}
@@ -4,5 +4,9 @@ class TransactionsappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transactionsApp'
 
+    def ready(self):
+        from . import versioning # connects the data version signals
+        from . import ledger # opening entries of the new cards and users
+
     #def ready(self):
     #    import transactionsApp.default_categories
\ No newline at end of file
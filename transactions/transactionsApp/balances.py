@@ -0,0 +1,78 @@
+from .models import *
+from . import ledger
+from django.db.models import F
+
+
+
+# Every balance mutation is a single conditional UPDATE evaluated by the database, so concurrent requests
+# cannot lose an update and a balance check cannot pass for two requests that together overdraw it.
+# QuerySet.update sends no post_save, so every successful mutation bumps the user's DataVersion itself.
+# Every successful mutation of a balance also books its LedgerEntry (ledger.py), the callers run them in a transaction.
+
+CENT = Decimal('0.01')
+
+
+
+def to_cents(amount):
+    return Decimal(amount).quantize(CENT)
+
+
+
+
+def credit_card(card , amount):
+    amount = to_cents(amount)
+    Card.objects.filter(pk=card.pk).update(balance=F('balance') + amount)
+    ledger.record(card.user_id , card.pk , card.currency , amount , 'transaction')
+    DataVersion.bump(card.user_id)
+
+
+
+
+def debit_card(card , amount):
+    # returns False (and changes nothing) if the balance is too low
+    amount = to_cents(amount)
+    if(Card.objects.filter(pk=card.pk , balance__gte=amount).update(balance=F('balance') - amount) != 1):
+        return False
+    ledger.record(card.user_id , card.pk , card.currency , -amount , 'transaction')
+    DataVersion.bump(card.user_id)
+    return True
+
+
+
+
+def credit_cash(user , amount):
+    amount = to_cents(amount)
+    CustomUser.objects.filter(pk=user.pk).update(cash=F('cash') + amount)
+    ledger.record(user.pk , ledger.CASH , user.currency , amount , 'transaction')
+    DataVersion.bump(user.pk)
+
+
+
+
+def debit_cash(user , amount):
+    # returns False (and changes nothing) if the cash is too low
+    amount = to_cents(amount)
+    if(CustomUser.objects.filter(pk=user.pk , cash__gte=amount).update(cash=F('cash') - amount) != 1):
+        return False
+    ledger.record(user.pk , ledger.CASH , user.currency , -amount , 'transaction')
+    DataVersion.bump(user.pk)
+    return True
+
+
+
+
+def add_debt(user , amount):
+    CustomUser.objects.filter(pk=user.pk).update(debt=F('debt') + to_cents(amount))
+    DataVersion.bump(user.pk)
+
+
+
+
+def pay_debt(user , amount):
+    # returns False (and changes nothing) if the amount exceeds the debt, refreshes user.debt otherwise
+    amount = to_cents(amount)
+    if(CustomUser.objects.filter(pk=user.pk , debt__gte=amount).update(debt=F('debt') - amount) != 1):
+        return False
+    DataVersion.bump(user.pk)
+    user.refresh_from_db(fields=['debt'])
+    return True
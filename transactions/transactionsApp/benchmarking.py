@@ -0,0 +1,205 @@
+from .models import *
+from django.db import connection , transaction as db_transaction
+from django.urls import URLResolver , get_resolver , reverse
+from django.test.utils import override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.test import APIClient
+from datetime import timedelta
+import math
+import time
+
+
+
+# Drives every route of the URLconf in-process through the DRF test client and measures latency, SQL query
+# count and SQL time. Every request runs in a transaction that is rolled back, so the dataset stays the same
+# from the first request to the last and results of different commits can be compared.
+
+
+
+def registered_routes(patterns=None):
+    # (url name, http method, viewset action, basename, url kwargs) of every viewset route
+    if(patterns is None):
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if(isinstance(pattern , URLResolver)):
+            yield from registered_routes(pattern.url_patterns)
+            continue
+        actions = getattr(pattern.callback , 'actions' , None)
+        if(not actions):
+            continue
+        basename = pattern.callback.initkwargs.get('basename')
+        for method , action in list(actions.items()):
+            if(method == 'head'): # added to the view's own actions once it has been called
+                continue
+            yield pattern.name , method , action , basename , list(pattern.pattern.regex.groupindex)
+
+
+
+
+def percentile(values , share):
+    # nearest rank
+    values = sorted(values)
+    return values[max(0 , math.ceil(share * len(values)) - 1)]
+
+
+
+
+class QueryProbe:
+    # database execute wrapper counting the queries and the time spent in the database
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0
+
+    def __call__(self , execute , sql , params , many , context):
+        start = time.perf_counter()
+        try:
+            return execute(sql , params , many , context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - start
+
+
+
+
+
+class Scenario:
+    # the objects of one user the routes are called with, and the request bodies of the write actions
+
+    def __init__(self , user):
+        self.user = user
+        self.card = Card.objects.filter(user=user).order_by('id').first()
+        self.category = Category.objects.filter(user=user).exclude(title__iexact='debt').order_by('id').first()
+        self.transaction = Transaction.objects.filter(user=user , recurring=False).order_by('id').first()
+        # a queued report job, so that its status, result and cancel routes have something to answer
+        self.analytics = Analytics.objects.filter(user=user , status='queued').order_by('id').first()
+        if(self.analytics is None):
+            self.analytics = Analytics.objects.create(user=user , status='queued' , **self.report())
+
+        self.objects = {'customuser': user , 'user-cards': self.card , 'user-categories': self.category ,
+                        'user-transactions': self.transaction , 'user-analytics': self.analytics}
+
+
+    def cash_income(self):
+        return {'category': self.category.pk , 'payment_method': 'Cash' , 'amount': '10.00' , 'currency': self.user.currency ,
+                'type': 'Income' , 'recurring': False , 'recurrence_choices': 'Daily'}
+
+
+    def statement(self , rows=100):
+        # a CSV bank statement of small incomes, from before the seeded history (no rollups to update on those days)
+        start = timezone.now().date() - timedelta(days=20 * 365)
+        lines = ['date,amount,category,description'] + [f'{start + timedelta(days=i % 30)},1.00,Benchmark,Row {i}' for i in range(rows)]
+        return '\n'.join(lines).encode()
+
+
+    def report(self):
+        today = timezone.now().date()
+        return {'all_assets': True , 'choose_card': f'{self.card.card_type} - {self.card.card_number}' , 'currency': 'EUR' ,
+                'compute_statistics_from': str(today - timedelta(days=365)) , 'compute_statistics_to': str(today)}
+
+
+    def payload(self , basename , action):
+        # None for the actions without a body, KeyError for write actions nobody wrote a body for yet
+        user = self.user
+        card = self.card
+        if(action in ('list' , 'retrieve' , 'destroy')):
+            return None
+        return {
+            ('customuser' , 'create'): lambda: {'username': 'benchmark-user' , 'password': 'benchmark' , 'currency': 'EUR'},
+            ('customuser' , 'update'): lambda: {'username': user.username , 'cash': str(user.cash) , 'currency': user.currency},
+            ('customuser' , 'partial_update'): lambda: {'job': 'Benchmark'},
+            ('customuser' , 'balance'): lambda: None,
+            ('user-cards' , 'create'): lambda: {'card_type': 'Debit Card' , 'balance': '100.00' , 'currency': 'EUR'},
+            ('user-cards' , 'update'): lambda: {'card_type': card.card_type , 'balance': str(card.balance) , 'currency': card.currency},
+            ('user-cards' , 'partial_update'): lambda: {'balance': '50.00'},
+            ('user-cards' , 'bulk_issue'): lambda: {'count': 100 , 'balance': '10.00'},
+            ('user-cards' , 'balance'): lambda: None,
+            ('user-categories' , 'create'): lambda: {'title': 'Benchmark'},
+            ('user-categories' , 'update'): lambda: {'title': 'Benchmark'},
+            ('user-categories' , 'partial_update'): lambda: {'title': 'Benchmark'},
+            ('user-categories' , 'insights'): lambda: {'compute_statistics_from': self.report()['compute_statistics_from']},
+            ('user-transactions' , 'create'): self.cash_income,
+            ('user-transactions' , 'update'): self.cash_income,
+            ('user-transactions' , 'partial_update'): lambda: {'amount': '12.00'},
+            ('user-transactions' , 'bulk'): lambda: [self.cash_income() for _ in range(100)],
+            ('user-transactions' , 'export'): lambda: {'output': 'csv'},
+            ('user-transactions' , 'import_statement'): lambda: {'file': SimpleUploadedFile('statement.csv' , self.statement())},
+            ('user-analytics' , 'create'): self.report,
+            ('user-analytics' , 'update'): self.report,
+            ('user-analytics' , 'partial_update'): self.report,
+            ('user-analytics' , 'series'): lambda: {'bucket': 'month' , 'compute_statistics_from': self.report()['compute_statistics_from'] ,
+                                                    'compute_statistics_to': self.report()['compute_statistics_to']},
+            ('user-analytics' , 'projection'): lambda: {'months': 12},
+            ('user-analytics' , 'job_status'): lambda: None,
+            ('user-analytics' , 'job_result'): lambda: None,
+            ('user-analytics' , 'cancel'): lambda: {},
+        }[(basename , action)]()
+
+
+    def path(self , name , basename , kwargs):
+        values = {'user_pk': self.user.pk , 'pk': getattr(self.objects.get(basename) , 'pk' , None)}
+        return reverse(name , kwargs={kwarg: values[kwarg] for kwarg in kwargs})
+
+
+
+
+
+def request_format(payload):
+    # uploads go as multipart, everything else as JSON
+    if(isinstance(payload , dict) and any(hasattr(value , 'read') for value in payload.values())):
+        return 'multipart'
+    return 'json'
+
+
+
+
+def run(user , repeat=50 , write_repeat=10 , warmup=2):
+    scenario = Scenario(user)
+    client = APIClient()
+    results = {}
+
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for name , method , action , basename , kwargs in list(registered_routes()):
+            key = f'{method.upper()} {name}'
+            try:
+                payload = scenario.payload(basename , action)
+            except KeyError:
+                results[key] = {'action': action , 'skipped': 'no request body for this action'}
+                continue
+            path = scenario.path(name , basename , kwargs)
+            runs = repeat if(method == 'get') else write_repeat
+
+            latencies = []
+            queries = []
+            sql_times = []
+            statuses = set()
+            for iteration in range(warmup + runs):
+                probe = QueryProbe()
+                with db_transaction.atomic():
+                    with connection.execute_wrapper(probe):
+                        start = time.perf_counter()
+                        response = getattr(client , method)(path , payload , format=request_format(payload))
+                        if(response.streaming):
+                            b''.join(response.streaming_content) # the exports read their rows while streaming
+                        elapsed = time.perf_counter() - start
+                    db_transaction.set_rollback(True)
+                if(iteration < warmup):
+                    continue
+                latencies.append(elapsed * 1000)
+                queries.append(probe.count)
+                sql_times.append(probe.time * 1000)
+                statuses.add(response.status_code)
+
+            results[key] = {
+                'action': action,
+                'path': path,
+                'status': sorted(statuses),
+                'runs': runs,
+                'p50_ms': round(percentile(latencies , 0.50) , 3),
+                'p95_ms': round(percentile(latencies , 0.95) , 3),
+                'p99_ms': round(percentile(latencies , 0.99) , 3),
+                'queries': percentile(queries , 0.50),
+                'queries_max': max(queries),
+                'sql_ms': round(percentile(sql_times , 0.50) , 3),
+            }
+    return results
@@ -0,0 +1,103 @@
+from .models import *
+from .recurrence import due_occurrences , occurrence
+from .balances import to_cents
+from . import rollups
+from . import ledger
+from django.db import transaction as db_transaction
+from django.db.models import Q , F
+
+
+
+def due_subscriptions(today):
+    # served by the transaction_due_idx index (recurring, payment_method, subscription_next_paid_date)
+    return Transaction.objects.filter(Q(subscription_end_date__isnull=True) | Q(subscription_next_paid_date__lt=F('subscription_end_date')) ,
+                                      recurring=True , payment_method='Card' , subscription_next_paid_date__lte=today)
+
+
+
+
+def chunks(iterable , size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if(len(chunk) >= size):
+            yield chunk
+            chunk = []
+    if(chunk):
+        yield chunk
+
+
+
+
+def bill_subscriptions(today=None , chunk_size=500):
+    # Charges every due subscription of every user, catching up all the periods that were missed since the
+    # last run. Users are processed in chunks, each chunk in its own transaction with its cards and
+    # subscriptions locked, so the run can be repeated or resumed without charging anything twice.
+    today = today or timezone.now().date()
+    summary = {'users': 0 , 'subscriptions': 0 , 'payments': 0 , 'declined': 0 , 'card_not_found': 0}
+
+    user_ids = due_subscriptions(today).values_list('user_id' , flat=True).distinct().order_by('user_id')
+    for chunk in chunks(user_ids.iterator() , chunk_size):
+        with db_transaction.atomic():
+            bill_users(chunk , today , summary)
+        summary['users'] += len(chunk)
+
+    return summary
+
+
+
+
+def bill_users(user_ids , today , summary):
+    subscriptions = list(due_subscriptions(today).filter(user_id__in=user_ids).select_for_update().order_by('id'))
+    cards = {}
+    for card in Card.objects.filter(user_id__in=user_ids).select_for_update().order_by('id'):
+        cards[(card.user_id , card.card_number , card.cvv , card.expiration_date)] = card
+
+    changed_cards = {}
+    billed = []
+    entries = []
+    billed_rollups = {}
+    for tr in subscriptions:
+        count , anchor , first = due_occurrences(tr.subscription_start_date , tr.subscription_next_paid_date ,
+                                                 tr.subscription_end_date , today , tr.recurrence_choices)
+        if(count == 0):
+            continue
+
+        card = cards.get((tr.user_id , tr.card_number , tr.cvv , tr.expiration_date))
+        if(not card):
+            summary['card_not_found'] += 1
+            continue
+
+        # in cents, as every payment is booked in the ledger, so the balance stays the sum of its entries
+        charge = to_cents(tr.amount if(card.currency == tr.currency) else Currency_rate.convertion(tr.amount , tr.currency , card.currency))
+        paid = count
+        if(tr.type == 'Expense'):
+            # pay the periods the card can afford, the rest stays due for the next run
+            paid = max(0 , min(count , int(card.balance // charge) if(charge) else count))
+            if(paid < count):
+                summary['declined'] += 1
+            card.balance -= charge * paid
+        else:
+            card.balance += charge * paid
+
+        if(paid == 0):
+            continue
+        entries.append(ledger.entry(card.user_id , card.pk , card.currency , charge * paid if(tr.type == 'Income') else -charge * paid ,
+                                    'subscription' , f'Subscription {tr.pk}: {paid} x {tr.amount} {tr.currency}'))
+
+        for index in range(first , first + paid):
+            key = (tr.user_id , occurrence(anchor , index , tr.recurrence_choices) , tr.currency , tr.type , 'Card' , tr.card_number , True , True)
+            total , payments = billed_rollups.get(key , (0 , 0))
+            billed_rollups[key] = (total + tr.amount , payments + 1)
+
+        tr.subscription_next_paid_date = occurrence(anchor , first + paid , tr.recurrence_choices)
+        changed_cards[card.pk] = card
+        billed.append(tr)
+        summary['subscriptions'] += 1
+        summary['payments'] += paid
+
+    Card.objects.bulk_update(changed_cards.values() , ['balance'] , batch_size=1000)
+    Transaction.objects.bulk_update(billed , ['subscription_next_paid_date'] , batch_size=1000)
+    ledger.record_many(entries)
+    DataVersion.bump(*{tr.user_id for tr in billed})
+    rollups.add_many(billed_rollups)
@@ -0,0 +1,44 @@
+from .models import *
+from .rates import rate_cache
+from django.conf import settings
+from django.core.cache import caches
+import hashlib
+import json
+
+
+
+# Analytics results in the cache alias settings.ANALYTICS_CACHE. The key holds the normalized request and the
+# data version of the user, so any change to the user's cards, categories, transactions or cash makes every
+# cached result of that user unreachable, without deleting anything: the entries age out by the TTL and the
+# LRU culling of the backend. A hit costs the primary-key lookup of the version and one cache read.
+# The version of the exchange rates (rates.py) is part of the key as well: new rates make the converted results
+# unreachable in the same way.
+
+
+
+def analytics_cache():
+    return caches[getattr(settings , 'ANALYTICS_CACHE' , 'default')]
+
+
+
+
+def result_key(kind , user_id , version , params):
+    # today is part of the key: results may depend on the date (e.g. defaults relative to today)
+    digest = hashlib.sha1(json.dumps(params , sort_keys=True , default=str).encode()).hexdigest()
+    return f'analytics:{kind}:{user_id}:{version}:{rate_cache().version}:{timezone.localdate().isoformat()}:{digest}'
+
+
+
+
+def cached_result(kind , user_id , params , compute):
+    version = DataVersion.objects.filter(user_id=user_id).values_list('version' , flat=True).first()
+    if(version is None):
+        return compute()
+
+    cache = analytics_cache()
+    key = result_key(kind , user_id , version , params)
+    result = cache.get(key)
+    if(result is None):
+        result = compute()
+        cache.set(key , result)
+    return result
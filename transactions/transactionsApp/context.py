@@ -0,0 +1,66 @@
+from .models import *
+from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
+
+
+
+class UserContext:
+    # The user of a nested route (/users/<id>/...) with their cards and categories, each loaded at most once per
+    # request and shared by the view, the serializers and the validation code.
+
+    def __init__(self , user_id , user=None):
+        self.user_id = user_id
+        if(user is not None):
+            self.user = user
+
+    @cached_property
+    def user(self):
+        return get_object_or_404(CustomUser , pk=self.user_id)
+
+    @cached_property
+    def cards(self):
+        return list(Card.objects.filter(user_id=self.user_id).order_by('id'))
+
+    @cached_property
+    def categories(self):
+        return list(Category.objects.filter(user_id=self.user_id).order_by('id'))
+
+    @cached_property
+    def debt_category(self):
+        return next((category for category in self.categories if(category.title.lower() == 'debt')) , None)
+
+
+    def has_cards(self):
+        return len(self.cards) > 0
+
+
+    def card(self , card_number , cvv , expiration_date):
+        return next((card for card in self.cards if(card.card_number == card_number and card.cvv == cvv and
+                                                      card.expiration_date == expiration_date)) , None)
+
+
+    def card_covering(self , amount):
+        # first card (by id) whose balance can cover the amount
+        return next((card for card in self.cards if(card.balance >= amount)) , None)
+
+
+    def has_category(self , title):
+        return any(category.title.lower() == str(title).lower() for category in self.categories)
+
+
+
+
+class UserContextMixin:
+    # for the viewsets nested under /users/<user_pk>/
+
+    def get_user_context(self):
+        context = getattr(self.request , 'user_context' , None)
+        if(context is None):
+            context = UserContext(self.kwargs.get('user_pk'))
+            self.request.user_context = context
+        return context
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['user_context'] = self.get_user_context()
+        return context
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+from contextvars import ContextVar
+
+
+
+# Reads of the read-only view actions go to the replica (settings.REPLICA_DATABASE) when one is configured.
+# Everything else goes to the primary: writes, reads outside the views (commands, billing), reads after a write
+# in the same request, and the reads of a user for REPLICA_PIN_SECONDS after a write to that user's data.
+
+PRIMARY = 'default'
+
+use_replica = ContextVar('use_replica' , default=False)
+
+
+
+def replica_alias():
+    alias = getattr(settings , 'REPLICA_DATABASE' , None)
+    return alias if(alias in settings.DATABASES) else None
+
+
+
+
+class ReplicaRouter:
+
+    def db_for_read(self , model , **hints):
+        # explicit, otherwise Django would follow the instance hint of an object read from the replica
+        if(use_replica.get()):
+            return replica_alias() or PRIMARY
+        return PRIMARY
+
+    def db_for_write(self , model , **hints):
+        # read-after-write: the rest of the request reads from the primary
+        use_replica.set(False)
+        return PRIMARY
+
+    def allow_relation(self , obj1 , obj2 , **hints):
+        return True
+
+
+
+
+class ReplicaReadMixin:
+    replica_actions = ('list' , 'retrieve') # actions that only read
+    pin_kwarg = 'user_pk' # url kwarg of the user whose reads are pinned to the primary after a write
+
+
+    def pin_key(self):
+        user_id = self.kwargs.get(self.pin_kwarg)
+        return f'replica-pin:{user_id}' if(user_id is not None) else None
+
+
+    def dispatch(self , request , *args , **kwargs):
+        token = use_replica.set(False)
+        try:
+            return super().dispatch(request , *args , **kwargs)
+        finally:
+            use_replica.reset(token)
+
+
+    def initial(self , request , *args , **kwargs):
+        super().initial(request , *args , **kwargs)
+        if(self.action in self.replica_actions and replica_alias()):
+            key = self.pin_key()
+            use_replica.set(not (key and cache.get(key)))
+
+
+    def finalize_response(self , request , response , *args , **kwargs):
+        response = super().finalize_response(request , response , *args , **kwargs)
+        if(request.method not in SAFE_METHODS and self.action not in self.replica_actions and replica_alias()):
+            # even a rejected request may have written (e.g. a debt imposed on a declined expense)
+            key = self.pin_key()
+            if(key):
+                cache.set(key , True , getattr(settings , 'REPLICA_PIN_SECONDS' , 5))
+        return response
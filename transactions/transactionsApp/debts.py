@@ -0,0 +1,44 @@
+from .models import *
+from .context import UserContext
+from django.db import transaction as db_transaction
+from django.db.models import Q
+
+
+
+DEBT_TIMEFRAME = relativedelta(minutes=5) # time to pay a debt once one of the user's cards can cover it
+
+
+
+
+def enforce_debt_deadlines(now=None):
+    # If a user has a card with balance more than his/her debt, the timeframe to pay the debt starts. If the timeframe
+    # is passed, the card that can pay the debt is deactivated. Used to happen while listing the transactions, now
+    # it is a job (enforce_debts command), so that reading never writes. Each user is handled in its own transaction.
+    now = now or timezone.now()
+    summary = {'notified': 0 , 'deactivated': 0 , 'cleared': 0}
+
+    user_ids = CustomUser.objects.filter(Q(debt__gt=0) | Q(debt_timeframe__isnull=False)).values_list('id' , flat=True).order_by('id')
+    for user_id in user_ids.iterator():
+        with db_transaction.atomic():
+            user = CustomUser.objects.select_for_update().get(pk=user_id)
+            card = UserContext(user.pk , user).card_covering(user.debt) if(user.debt > 0) else None
+
+            if(card is None):
+                # debt settled, or no card can cover it anymore
+                if(user.debt_timeframe):
+                    user.debt_timeframe = None
+                    user.save(update_fields=['debt_timeframe'])
+                    summary['cleared'] += 1
+
+            elif(not user.debt_timeframe):
+                user.debt_timeframe = now + DEBT_TIMEFRAME
+                user.save(update_fields=['debt_timeframe'])
+                summary['notified'] += 1
+
+            elif(now >= user.debt_timeframe):
+                card.delete()
+                user.debt_timeframe = None
+                user.save(update_fields=['debt_timeframe'])
+                summary['deactivated'] += 1
+
+    return summary
@@ -0,0 +1,61 @@
+from .serializers import TransactionExportRowSerializer
+from .pagination import TransactionPagination
+import csv
+import io
+import json
+
+
+
+# Full transaction history exports, streamed: the header goes out before the first query and the rows follow in
+# batches of EXPORT_CHUNK_SIZE. Every batch is its own query, seeking past the last row of the previous batch on
+# the (user, transaction_date) index, so neither the database driver (MySQL clients buffer whole result sets) nor
+# the process ever holds more than one batch, and no transaction stays open while the client downloads.
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8' , 'ndjson': 'application/x-ndjson'}
+
+
+
+
+def export_batches(queryset , chunk_size=EXPORT_CHUNK_SIZE):
+    pagination = TransactionPagination()
+    queryset = queryset.values(*TransactionExportRowSerializer.columns()).order_by(*pagination.ordering)
+    position = None
+    while(True):
+        batch = queryset.filter(pagination.seek(position , False)) if(position is not None) else queryset
+        rows = list(batch[:chunk_size])
+        if(rows):
+            yield rows
+        if(len(rows) < chunk_size):
+            return
+        position = pagination.position_of(rows[-1])
+
+
+
+
+def export_csv(queryset , chunk_size=EXPORT_CHUNK_SIZE):
+    serializer = TransactionExportRowSerializer()
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer , fieldnames=serializer.FIELDS , restval='')
+    writer.writeheader()
+    yield buffer.getvalue()
+
+    for rows in export_batches(queryset , chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(serializer.serialize(rows))
+        yield buffer.getvalue()
+
+
+
+
+def export_ndjson(queryset , chunk_size=EXPORT_CHUNK_SIZE):
+    serializer = TransactionExportRowSerializer()
+    yield '' # the response starts before the first query, like the CSV header
+    for rows in export_batches(queryset , chunk_size):
+        yield ''.join(json.dumps(item , separators=(',' , ':')) + '\n' for item in serializer.serialize(rows))
+
+
+
+
+EXPORTERS = {'csv': export_csv , 'ndjson': export_ndjson}
@@ -0,0 +1,187 @@
+from .models import *
+from .serializers import BulkTransactionItemSerializer
+from .balances import to_cents
+from . import rollups
+from . import ledger
+from django.db import transaction as db_transaction
+from django.db.models import F
+
+
+
+MAX_ITEMS = 10000
+
+
+
+class ItemError(Exception):
+    pass
+
+
+
+
+class BatchState:
+    # In-memory balances of one user while a batch is applied. Every item sees the balances left by the items
+    # before it, exactly as if they had been posted one by one, and only the net changes are written at the end.
+
+    def __init__(self , user , cards , categories):
+        self.user = user
+        self.cards = {(card.card_number , card.cvv , card.expiration_date): card for card in cards}
+        self.balances = {card.pk: card.balance for card in cards}
+        self.cash = user.cash
+        self.debt = user.debt
+        debt_categories = [category for category in categories if(category.title.lower() == 'debt')]
+        self.debt_category = min(debt_categories , key=lambda category: category.pk) if(debt_categories) else None
+
+
+    def debt_is_covered(self):
+        # if a card of the user can pay the debt, expense transactions are not processed
+        return self.debt > 0 and any(balance >= self.debt for balance in self.balances.values())
+
+
+    def subscription_message(self , data , currency , direction):
+        choice = {'Weekly': 'week' , 'Monthly': 'month' , 'Yearly': 'year'}.get(data.get('recurrence_choices') , 'day')
+        return (f"✅ Subscription period: {data.get('subscription_start_date')} / {data.get('subscription_end_date')}. "
+                f"Every {choice} {data.get('amount')} {currency} will be credited {direction} the user's card.")
+
+
+    def apply(self , data):
+        # mirrors TransactionSerializer.create, raises ItemError where it raises a ValidationError
+        type = data.get('type')
+        amount = data.get('amount')
+        currency = data.get('currency')
+        recurring = data.get('recurring')
+        category = data.get('category')
+
+        if(data.get('payment_method') == 'Card'):
+            card = self.cards.get((data.get('card_number') , data.get('cvv') , data.get('expiration_date')))
+            if(not card):
+                raise ItemError(f"Card '{str('*')*12}{str(data.get('card_number'))[12:]}' not found")
+
+            if(card.card_type == 'Credit Card' and type == 'Expense' and amount > CREDIT_LIMIT):
+                raise ItemError(f"❌ Transaction declined. Credit limit of {CREDIT_LIMIT} {card.currency} exceeded.")
+
+            card_amount = to_cents(amount if(card.currency == currency) else Currency_rate.convertion(amount , currency , card.currency))
+
+            if(type == 'Income'):
+                if(recurring):
+                    data['subscription_next_paid_date'] = data.get('subscription_start_date')
+                    return self.subscription_message(data , card.currency , 'to')
+                self.balances[card.pk] += card_amount
+                return '✅ Transaction completed successfully.'
+
+            if(self.debt_category and category == self.debt_category):
+                if(self.balances[card.pk] < card_amount):
+                    raise ItemError('❌ Transaction declined: Card balance is too low.')
+                if(self.debt < card_amount):
+                    raise ItemError(f'⚠️ Attention! Your amount exceeds the debt you must pay. Debt is {self.debt} {self.user.currency}')
+                self.debt -= card_amount
+                return f'✅ Transaction completed successfully. Debt is {self.debt} {card.currency}.'
+
+            if(self.debt_is_covered()):
+                raise ItemError('❌ New transactions cannot be processed until debt is cleared.')
+
+            if(recurring):
+                data['subscription_next_paid_date'] = data.get('subscription_start_date')
+                return self.subscription_message(data , card.currency , 'from')
+
+            if(self.balances[card.pk] < card_amount):
+                self.debt += card_amount
+                raise ItemError(f'❌ Transaction declined: Card balance is too low. A debt of {amount} {card.currency} has been imposed.')
+            self.balances[card.pk] -= card_amount
+            return '✅ Transaction completed successfully.'
+
+        # cash usage
+        if(recurring):
+            raise ItemError('⚠️ Recurring payments are only permitted via card.')
+
+        data['card_number'] = None
+        data['cvv'] = None
+        data['expiration_date'] = None
+        cash_amount = to_cents(amount if(self.user.currency == currency) else Currency_rate.convertion(amount , currency , self.user.currency))
+
+        if(type == 'Income'):
+            self.cash += cash_amount
+            return '✅ Transaction completed successfully.'
+
+        if(self.debt_category and category.title == self.debt_category.title):
+            if(self.cash < cash_amount):
+                raise ItemError('❌ Transaction declined: Cash are too low.')
+            if(self.debt < cash_amount):
+                raise ItemError(f'⚠️ Attention! Your amount exceeds the debt you must pay. Debt is {self.debt} {self.user.currency}')
+            self.debt -= cash_amount
+            return f'✅ Transaction completed successfully. Debt is {self.debt} {self.user.currency}.'
+
+        if(self.debt_is_covered()):
+            raise ItemError('❌ New transactions cannot be processed until debt is cleared.')
+
+        if(self.cash < cash_amount):
+            self.debt += cash_amount
+            raise ItemError(f'❌ Transaction declined. Cash are too low. A debt of {amount} {self.user.currency} has been imposed.')
+        self.cash -= cash_amount
+        return '✅ Transaction completed successfully.'
+
+
+
+
+def ingest(user_id , items):
+    # Validates a list of transactions as a set and applies the valid ones with one bulk_create, one UPDATE per
+    # affected card and one UPDATE of the user, all in one atomic block. Returns one result per item, in order.
+    results = [None] * len(items)
+    categories = {category.pk: category for category in Category.objects.filter(user_id=user_id)}
+
+    valid = []
+    for index , item in enumerate(items):
+        serializer = BulkTransactionItemSerializer(data=item)
+        if(not serializer.is_valid()):
+            results[index] = {'index': index , 'status': 'error' , 'errors': serializer.errors}
+            continue
+        data = dict(serializer.validated_data)
+        data['category'] = categories.get(data['category'])
+        if(data['category'] is None):
+            results[index] = {'index': index , 'status': 'error' , 'errors': {'category': ['Invalid pk - object does not exist.']}}
+            continue
+        valid.append((index , data))
+
+    with db_transaction.atomic():
+        user = CustomUser.objects.select_for_update().get(pk=user_id)
+        cards = list(Card.objects.select_for_update().filter(user=user).order_by('id'))
+        state = BatchState(user , cards , categories.values())
+
+        transactions = []
+        for index , data in valid:
+            try:
+                data['message'] = state.apply(data)
+            except ItemError as error:
+                results[index] = {'index': index , 'status': 'error' , 'errors': [str(error)]}
+                continue
+            transactions.append(Transaction(user=user , **data))
+            results[index] = {'index': index , 'status': 'created' , 'message': data['message']}
+
+        Transaction.objects.bulk_create(transactions , batch_size=1000)
+
+        entries = []
+        changed = bool(transactions) # a batch of declined items can still have imposed debt
+        note = f'{len(transactions)} transactions posted at once'
+        for card in cards:
+            delta = state.balances[card.pk] - card.balance
+            if(delta):
+                Card.objects.filter(pk=card.pk).update(balance=F('balance') + delta)
+                entries.append(ledger.entry(user.pk , card.pk , card.currency , delta , 'transaction' , note))
+                changed = True
+        if(state.cash != user.cash or state.debt != user.debt):
+            CustomUser.objects.filter(pk=user.pk).update(cash=F('cash') + (state.cash - user.cash) ,
+                                                          debt=F('debt') + (state.debt - user.debt))
+            if(state.cash != user.cash):
+                entries.append(ledger.entry(user.pk , ledger.CASH , user.currency , state.cash - user.cash , 'transaction' , note))
+            changed = True
+        ledger.record_many(entries)
+        if(changed):
+            DataVersion.bump(user.pk)
+
+        entries = {}
+        for tr in transactions:
+            key = rollups.transaction_key(tr)
+            total , count = entries.get(key , (0 , 0))
+            entries[key] = (total + tr.amount , count + 1)
+        rollups.add_many(entries)
+
+    return results
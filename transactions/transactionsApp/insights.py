@@ -0,0 +1,166 @@
+from .models import *
+from django.db import connection
+from django.db.models import Sum , Count , F , Case , When , Value , Func , Window , Aggregate , DecimalField , FloatField
+from django.db.models.functions import Rank
+from bisect import bisect_right , insort
+
+
+
+# Category ranking, share of the total and median / p90 transaction size, computed by the database. Backends with
+# ordered-set aggregates (PostgreSQL, Oracle) compute the percentiles in the grouped query. The others (MySQL,
+# SQLite) stream the converted amounts once through a P2 quantile sketch per category, in constant memory.
+
+PERCENTILE_VENDORS = ('postgresql' , 'oracle')
+STREAM_CHUNK_SIZE = 10000
+
+
+
+
+class PercentileCont(Aggregate):
+    function = 'PERCENTILE_CONT'
+    name = 'PercentileCont'
+    template = '%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self , percentile , expression , **extra):
+        super().__init__(expression , percentile=float(percentile) , **extra)
+
+
+
+
+class WindowSum(Func):
+    # SUM(...) OVER (...) of an aggregate of the same query, which Sum() refuses to wrap
+    function = 'SUM'
+    window_compatible = True
+
+
+
+
+class P2Quantile:
+    # Streaming estimate of one quantile with five markers (Jain & Chlamtac's P2 algorithm): O(1) memory and time
+    # per value. Exact for fewer than five values.
+
+    def __init__(self , p):
+        self.p = p
+        self.heights = []
+        self.positions = [1 , 2 , 3 , 4 , 5]
+        self.desired = [1 , 1 + 2 * p , 1 + 4 * p , 3 + 2 * p , 5]
+        self.increments = [0 , p / 2 , p , (1 + p) / 2 , 1]
+
+
+    def add(self , x):
+        q = self.heights
+        n = self.positions
+        if(len(q) < 5):
+            insort(q , x)
+            return
+
+        if(x < q[0]):
+            q[0] = x
+            k = 0
+        elif(x >= q[4]):
+            q[4] = x
+            k = 3
+        else:
+            k = bisect_right(q , x) - 1
+        for i in range(k + 1 , 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1 , 2 , 3):
+            d = self.desired[i] - n[i]
+            if((d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1)):
+                d = 1 if(d > 0) else -1
+                height = self.parabolic(i , d)
+                if(not q[i - 1] < height < q[i + 1]):
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+
+    def parabolic(self , i , d):
+        q = self.heights
+        n = self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                                                   (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+
+    def value(self):
+        q = self.heights
+        if(not q):
+            return None
+        if(len(q) < 5 or self.positions[4] == 5):
+            # exact, interpolated like PERCENTILE_CONT
+            rank = self.p * (len(q) - 1)
+            low = int(rank)
+            high = min(low + 1 , len(q) - 1)
+            return q[low] + (q[high] - q[low]) * (rank - low)
+        return q[2]
+
+
+
+
+def converted_amount(currency):
+    # the amount in the goal currency, computed by the database
+    whens = [When(currency=code , then=F('amount') * Value(Currency_rate.convertion(Decimal(1) , code , currency).quantize(Decimal('1e-12'))))
+             for code , label in Currency.currency if(code != currency)]
+    return Case(*whens , default=F('amount') , output_field=DecimalField(max_digits=24 , decimal_places=12))
+
+
+
+
+def streamed_percentiles(transactions , shares=(0.5 , 0.9)):
+    # {category_id: [estimate per share]}, one pass over the rows, never holding them in memory
+    sketches = {}
+    rows = transactions.values_list('category_id' , 'converted').order_by().iterator(chunk_size=STREAM_CHUNK_SIZE)
+    for category_id , amount in rows:
+        category = sketches.get(category_id)
+        if(category is None):
+            category = sketches[category_id] = [P2Quantile(share) for share in shares]
+        amount = float(amount)
+        for sketch in category:
+            sketch.add(amount)
+    return {category_id: [sketch.value() for sketch in category] for category_id , category in sketches.items()}
+
+
+
+
+def build_insights(user_id , compute_statistics_from , compute_statistics_to , currency , type='Expense' , limit=None):
+    transactions = (Transaction.objects.filter(user_id=user_id , type=type ,
+                                               transaction_date__gte = compute_statistics_from ,
+                                               transaction_date__lte = compute_statistics_to)
+                                       .annotate(converted=converted_amount(currency)))
+
+    groups = (transactions.values('category_id' , 'category__title')
+                          .annotate(total=Sum('converted') , count=Count('id'))
+                          .annotate(rank=Window(Rank() , order_by=F('total').desc()) ,
+                                    grand_total=Window(WindowSum(F('total') , output_field=DecimalField(max_digits=24 , decimal_places=12))))
+                          .order_by('rank' , 'category__title'))
+
+    if(connection.vendor in PERCENTILE_VENDORS):
+        method = 'percentile_cont'
+        groups = groups.annotate(median=PercentileCont(0.5 , 'converted') , p90=PercentileCont(0.9 , 'converted'))
+        rows = list(groups)
+        percentiles = {row['category_id']: [row['median'] , row['p90']] for row in rows}
+    else:
+        method = 'p2_sketch'
+        rows = list(groups)
+        percentiles = streamed_percentiles(transactions) if(rows) else {}
+
+    categories = []
+    for row in rows[:limit]:
+        median , p90 = percentiles.get(row['category_id'] , (None , None))
+        categories.append({
+            'rank': row['rank'],
+            'id': row['category_id'],
+            'title': row['category__title'],
+            'total': f"{row['total']:.2f}",
+            'share': f"{100 * row['total'] / row['grand_total']:.2f}" if(row['grand_total']) else '0.00',
+            'transactions': row['count'],
+            'median': None if(median is None) else f'{median:.2f}',
+            'p90': None if(p90 is None) else f'{p90:.2f}',
+        })
+
+    return {'from': compute_statistics_from.isoformat() , 'to': compute_statistics_to.isoformat() , 'currency': currency , 'type': type ,
+            'total': f"{rows[0]['grand_total']:.2f}" if(rows) else '0.00' , 'percentiles': method , 'categories': categories}
@@ -0,0 +1,132 @@
+from .models import *
+from .analytics import build_report , report_params
+from .caching import cached_result
+from django.conf import settings
+from django.db import connections , transaction as db_transaction
+from django.shortcuts import get_object_or_404
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import threading
+
+
+
+# Analytics reports computed in the background. A job is an Analytics row with a status: the request creates it
+# as queued and returns its id, a thread of a bounded pool (settings.ANALYTICS_JOBS['WORKERS'] per process)
+# moves it to running, computes the report and stores it on the row as done (or the error as failed).
+# Every transition is a conditional UPDATE on the status, so a cancelled or expired job is never overwritten:
+# a queued job is dropped before it starts, the result of a running one is discarded.
+# The pool lives in the process that received the request, a job lost with a restarted process stays active
+# until it is older than TIMEOUT and then counts as failed.
+
+DEFAULTS = {'WORKERS': 2 , 'PER_USER': 2 , 'MAX_PENDING': 100 , 'TIMEOUT': 600}
+ACTIVE = ('queued' , 'running')
+REPORT_FIELDS = ('all_assets' , 'cash' , 'card' , 'choose_card' , 'income_transactions' , 'expense_transactions' , 'subscriptions' ,
+                 'currency' , 'compute_statistics_from' , 'compute_statistics_to' , 'historical_rates')
+
+_executor = None
+_lock = threading.Lock()
+futures = {} # job id -> Future of the jobs submitted by this process
+
+
+
+
+class JobLimitExceeded(Exception):
+    pass
+
+
+
+
+def jobs_settings():
+    return {**DEFAULTS , **getattr(settings , 'ANALYTICS_JOBS' , {})}
+
+
+
+
+def executor():
+    global _executor
+    with _lock:
+        if(_executor is None):
+            _executor = ThreadPoolExecutor(max_workers=jobs_settings()['WORKERS'] , thread_name_prefix='analytics-job')
+        return _executor
+
+
+
+
+def enqueue(user_id , data):
+    # creates the job from the validated report request, the pool gets it once the row is committed
+    config = jobs_settings()
+    with db_transaction.atomic():
+        get_object_or_404(CustomUser.objects.select_for_update().only('id') , pk=user_id) # one enqueue per user at a time
+        expire_stale(config['TIMEOUT'])
+        active = Analytics.objects.filter(status__in=ACTIVE)
+        if(active.filter(user_id=user_id).count() >= config['PER_USER']):
+            raise JobLimitExceeded(f"⚠️ You already have {config['PER_USER']} reports in progress. Wait for them or cancel one.")
+        if(active.count() >= config['MAX_PENDING']):
+            raise JobLimitExceeded('⚠️ Too many reports are in progress. Try again later.')
+
+        job = Analytics.objects.create(user_id=user_id , status='queued' , **data)
+        db_transaction.on_commit(lambda: submit(job.pk))
+    return job
+
+
+
+
+def expire_stale(timeout):
+    limit = timezone.now() - timedelta(seconds=timeout)
+    return Analytics.objects.filter(status__in=ACTIVE , created_at__lt=limit).update(
+        status='failed' , error='⚠️ The report did not finish in time.' , finished_at=timezone.now())
+
+
+
+
+def submit(job_id):
+    if(jobs_settings()['WORKERS'] == 0): # computed right away in this thread (tests, debugging)
+        run(job_id)
+        return
+    future = executor().submit(work , job_id)
+    futures[job_id] = future
+    future.add_done_callback(lambda future: futures.pop(job_id , None))
+
+
+
+
+def work(job_id):
+    try:
+        run(job_id)
+    finally:
+        connections.close_all() # the connections of this worker thread
+
+
+
+
+def run(job_id):
+    if(Analytics.objects.filter(pk=job_id , status='queued').update(status='running') != 1):
+        return # cancelled or expired while queued
+
+    job = Analytics.objects.select_related('user').get(pk=job_id)
+    try:
+        data = {field: getattr(job , field) for field in REPORT_FIELDS}
+        # same cache entry as the synchronous report of the same request
+        result = cached_result('report' , job.user_id , report_params(data) , lambda: build_report(job.user , data))
+        Analytics.objects.filter(pk=job_id , status='running').update(status='done' , result=result , finished_at=timezone.now())
+    except Exception as error:
+        Analytics.objects.filter(pk=job_id , status='running').update(status='failed' , error=str(error)[:200] , finished_at=timezone.now())
+
+
+
+
+def cancel(job_id):
+    # the time of the cancellation, None when the job has already finished
+    now = timezone.now()
+    if(Analytics.objects.filter(pk=job_id , status__in=ACTIVE).update(status='cancelled' , finished_at=now) != 1):
+        return None
+    future = futures.get(job_id)
+    if(future):
+        future.cancel() # frees the slot in the pool if the job has not started
+    return now
+
+
+
+
+def job_status(job):
+    return {'id': job.pk , 'status': job.status , 'created_at': job.created_at , 'finished_at': job.finished_at , 'error': job.error}
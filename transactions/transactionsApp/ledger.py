@@ -0,0 +1,191 @@
+from .models import *
+from django.db import transaction as db_transaction
+from django.db.models import Sum , Max
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from datetime import timedelta
+
+
+
+# Append-only history of the balances. Every change of a card balance or of the cash writes a LedgerEntry with
+# the signed amount in the currency of the account, next to the UPDATE of the balance and in its transaction.
+# A currency conversion is booked as the difference between the converted and the old balance, so the entries
+# of an account always add up to its balance. The history starts with an 'opening' entry per account.
+#
+# The checkpoint_balances command stores the closing balance of every account for every past day on which it
+# moved. The balance at the end of a day is then the last checkpoint up to that day plus the entries booked after
+# it, which are only the days the command has not closed yet: one indexed row and a short tail, however old the
+# account is.
+
+CASH = LedgerEntry.CASH
+CENT = Decimal('0.01')
+CHECKPOINT_LAG = timedelta(hours=1) # a day is closed this long after it ended, once its last transactions committed
+
+
+
+
+def entry(user_id , account , currency , amount , kind , note=None):
+    return LedgerEntry(user_id=user_id , account=account , currency=currency , amount=Decimal(amount).quantize(CENT) , kind=kind ,
+                       note=note[:200] if(note) else None)
+
+
+
+
+def record(user_id , account , currency , amount , kind , note=None):
+    new = entry(user_id , account , currency , amount , kind , note)
+    new.save()
+    return new
+
+
+
+
+def record_many(entries):
+    if(entries):
+        LedgerEntry.objects.bulk_create(entries , batch_size=1000)
+
+
+
+
+def record_change(user_id , account , old_balance , old_currency , new_balance , new_currency , converted=False):
+    # a balance written by a serializer (PUT/PATCH of a card or of the user), nothing is booked if nothing changed
+    old_balance , new_balance = Decimal(str(old_balance)).quantize(CENT) , Decimal(str(new_balance)).quantize(CENT)
+    if(new_balance == old_balance and new_currency == old_currency):
+        return
+    note = f'{old_balance} {old_currency} -> {new_balance} {new_currency}'
+    record(user_id , account , new_currency , new_balance - old_balance , 'conversion' if(converted) else 'adjustment' , note)
+
+
+
+
+def openings(cards=() , users=()):
+    # the opening entries of accounts created with bulk_create, which sends no post_save
+    cards = [card for card in cards if(card.balance)]
+    missing = [card.card_number for card in cards if(card.pk is None)] # bulk_create sets no primary keys on MySQL
+    ids = {}
+    for start in range(0 , len(missing) , 1000):
+        ids.update(Card.objects.filter(card_number__in=missing[start:start + 1000]).values_list('card_number' , 'id'))
+
+    entries = [entry(card.user_id , card.pk or ids[card.card_number] , card.currency , card.balance , 'opening') for card in cards]
+    entries += [entry(user.pk , CASH , user.currency , user.cash , 'opening') for user in users if(user.cash)]
+    record_many(entries)
+
+
+
+
+@receiver(post_save , sender=Card)
+def card_opened(sender , instance , created , raw=False , **kwargs):
+    if(created and not raw and instance.balance):
+        record(instance.user_id , instance.pk , instance.currency , instance.balance , 'opening')
+
+
+
+@receiver(post_save , sender=CustomUser)
+def cash_opened(sender , instance , created , raw=False , **kwargs):
+    if(created and not raw and instance.cash):
+        record(instance.pk , CASH , instance.currency , Decimal(str(instance.cash)) , 'opening')
+
+
+
+
+
+def daily_moves(entries):
+    # {(user id, account): {day: (sum of the amounts, currency of the last entry)}}
+    rows = entries.values('user_id' , 'account' , 'booked_on' , 'currency').annotate(total=Sum('amount') , last=Max('id')).order_by('last')
+    moves = {}
+    for row in rows:
+        days = moves.setdefault((row['user_id'] , row['account']) , {})
+        total = days.get(row['booked_on'] , (0 , None))[0]
+        days[row['booked_on']] = (total + row['total'].quantize(CENT) , row['currency']) # SQLite sums decimals as floats
+    return moves
+
+
+
+
+def balance_history(user_id , account , date_from , date_to):
+    # the balance at the end of every day from date_from to date_to, with its currency (None before the account existed)
+    checkpoints = BalanceCheckpoint.objects.filter(user_id=user_id , account=account)
+    closing = {row[0]: row[1:] for row in checkpoints.filter(day__gte=date_from , day__lte=date_to).values_list('day' , 'balance' , 'currency')}
+    before = checkpoints.filter(day__lt=date_from).order_by('-day').values_list('day' , 'balance' , 'currency').first()
+
+    # the tail: entries after the last checkpoint, on days the command has not closed yet
+    last = max(closing) if(closing) else (before[0] if(before) else None)
+    tail = LedgerEntry.objects.filter(user_id=user_id , account=account , booked_on__lte=date_to)
+    if(last):
+        tail = tail.filter(booked_on__gt=last)
+    moves = daily_moves(tail).get((user_id , account) , {})
+
+    balance , currency = (before[1] , before[2]) if(before) else (Decimal('0.00') , None)
+    for day in sorted(day for day in moves if(day < date_from)):
+        balance += moves[day][0]
+        currency = moves[day][1]
+
+    history = []
+    day = date_from
+    while(day <= date_to):
+        if(day in closing):
+            balance , currency = closing[day]
+        elif(day in moves):
+            balance += moves[day][0]
+            currency = moves[day][1]
+        history.append({'day': day , 'balance': balance , 'currency': currency})
+        day += timedelta(days=1)
+    return history
+
+
+
+
+def balance_on(user_id , account , day):
+    return balance_history(user_id , account , day , day)[0]
+
+
+
+
+def checkpoint_balances(through=None , chunk_size=1000):
+    # Closes the days up to through (yesterday by default): one checkpoint per account and day with entries, the
+    # balance carried over from the latest checkpoint of the account. One transaction, the next run continues from
+    # the latest checkpoints.
+    through = through or timezone.localdate(timezone.now() - CHECKPOINT_LAG) - timedelta(days=1)
+    summary = {'through': through , 'users': 0 , 'checkpoints': 0}
+
+    with db_transaction.atomic():
+        closed = BalanceCheckpoint.objects.aggregate(day=Max('day'))['day']
+        entries = LedgerEntry.objects.filter(booked_on__lte=through)
+        if(closed):
+            entries = entries.filter(booked_on__gt=closed)
+        user_ids = list(entries.values_list('user_id' , flat=True).distinct().order_by('user_id'))
+
+        for start in range(0 , len(user_ids) , chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            summary['checkpoints'] += checkpoint_users(chunk , entries.filter(user_id__in=chunk))
+            summary['users'] += len(chunk)
+    return summary
+
+
+
+
+def checkpoint_users(user_ids , entries):
+    latest = {(checkpoint.user_id , checkpoint.account): checkpoint
+              for checkpoint in BalanceCheckpoint.objects.filter(user_id__in=user_ids , latest=True)}
+
+    created = []
+    replaced = []
+    for key , days in daily_moves(entries).items():
+        previous = latest.get(key)
+        balance = previous.balance if(previous) else Decimal('0.00')
+        checkpoints = []
+        for day in sorted(days):
+            if(previous and day <= previous.day):
+                continue
+            total , currency = days[day]
+            balance += total
+            checkpoints.append(BalanceCheckpoint(user_id=key[0] , account=key[1] , day=day , balance=balance , currency=currency))
+        if(checkpoints):
+            checkpoints[-1].latest = True
+            created += checkpoints
+            if(previous):
+                replaced.append(previous.pk)
+
+    for start in range(0 , len(replaced) , 1000):
+        BalanceCheckpoint.objects.filter(pk__in=replaced[start:start + 1000]).update(latest=False)
+    BalanceCheckpoint.objects.bulk_create(created , batch_size=1000)
+    return len(created)
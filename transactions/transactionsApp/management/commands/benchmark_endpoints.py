@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand , CommandError
+from django.db import connection
+from django.conf import settings
+from transactionsApp.models import *
+from transactionsApp.seeding import seed , clear_seed , SEED_PREFIX
+from transactionsApp.benchmarking import run
+import django
+import json
+import platform
+import random
+import subprocess
+
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git' , 'rev-parse' , '--short' , 'HEAD'] , capture_output=True , text=True , check=True).stdout.strip()
+    except (OSError , subprocess.CalledProcessError):
+        return None
+
+
+
+
+class Command(BaseCommand):
+    help = ('Seeds a dataset, calls every registered route in-process and reports p50/p95/p99 latency, SQL query count and '
+            'SQL time per endpoint. Results are written as JSON, pass the file of another commit to --compare to see the change.')
+
+    def add_arguments(self , parser):
+        parser.add_argument('--users' , type=int , default=20)
+        parser.add_argument('--cards' , type=int , default=3 , help='Cards per user.')
+        parser.add_argument('--transactions' , type=int , default=2000 , help='Transactions per user.')
+        parser.add_argument('--days' , type=int , default=730)
+        parser.add_argument('--repeat' , type=int , default=50 , help='Measured runs of each GET route.')
+        parser.add_argument('--write-repeat' , type=int , default=10 , help='Measured runs of each write route.')
+        parser.add_argument('--warmup' , type=int , default=2 , help='Unmeasured runs before each route.')
+        parser.add_argument('--random-seed' , type=int , default=0)
+        parser.add_argument('--no-seed' , action='store_true' , help='Benchmark the data seeded by a previous run or by seed_data.')
+        parser.add_argument('--keep' , action='store_true' , help='Keep the seeded data after the benchmark.')
+        parser.add_argument('--output' , default='benchmark.json')
+        parser.add_argument('--compare' , default=None , help='JSON results of an earlier run.')
+        parser.add_argument('--label' , default=None)
+
+
+    def handle(self , *args , **options):
+        dataset = None
+        if(not options['no_seed']):
+            random.seed(options['random_seed'])
+            self.stdout.write('Seeding...')
+            dataset = seed(users=options['users'] , cards_per_user=options['cards'] , transactions_per_user=options['transactions'] ,
+                           days=options['days'])
+            self.stdout.write(f"Seeded {dataset['users']} users, {dataset['cards']} cards, {dataset['transactions']} transactions.")
+
+        user = CustomUser.objects.filter(username__startswith=SEED_PREFIX).order_by('-id').first()
+        if(user is None):
+            raise CommandError('No seeded data found, run without --no-seed or run seed_data first.')
+
+        try:
+            endpoints = run(user , repeat=options['repeat'] , write_repeat=options['write_repeat'] , warmup=options['warmup'])
+        finally:
+            if(not options['keep'] and not options['no_seed']):
+                clear_seed()
+
+        report = {
+            'label': options['label'],
+            'commit': current_commit(),
+            'created': timezone.now().isoformat(),
+            'environment': {'database': connection.vendor , 'debug': settings.DEBUG , 'python': platform.python_version() ,
+                            'django': django.get_version()},
+            'dataset': dataset or {'users': CustomUser.objects.filter(username__startswith=SEED_PREFIX).count()},
+            'user_transactions': Transaction.objects.filter(user=user).count() if(options['keep'] or options['no_seed']) else options['transactions'],
+            'endpoints': endpoints,
+        }
+        with open(options['output'] , 'w') as file:
+            json.dump(report , file , indent=2)
+
+        previous = None
+        if(options['compare']):
+            with open(options['compare']) as file:
+                previous = json.load(file)['endpoints']
+        self.print_table(endpoints , previous)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+
+    def print_table(self , endpoints , previous):
+        self.stdout.write(f"\n{'endpoint':<48} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8} {'sql':>9}")
+        for key , result in endpoints.items():
+            if('skipped' in result):
+                self.stdout.write(self.style.WARNING(f"{key:<48} skipped: {result['skipped']}"))
+                continue
+            line = (f"{key:<48} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f} "
+                    f"{result['queries']:8d} {result['sql_ms']:9.2f}")
+            before = (previous or {}).get(key)
+            if(before and 'p50_ms' in before):
+                line += f"   p50 {result['p50_ms'] - before['p50_ms']:+.2f} ms, queries {result['queries'] - before['queries']:+d}"
+            if(any(code >= 400 for code in result['status'])):
+                line += f"   status {result['status']}"
+            self.stdout.write(line)
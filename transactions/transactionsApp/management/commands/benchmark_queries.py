@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from datetime import timedelta
+from transactionsApp.models import *
+from transactionsApp.seeding import seed , clear_seed , SEED_PREFIX
+import time
+
+
+
+def hot_queries(user , card):
+    today = timezone.now().date()
+    return [
+        ('transactions in date range' , lambda: Transaction.objects.filter(user=user , transaction_date__gte=today - timedelta(days=90) ,
+                                                                           transaction_date__lte=today)),
+        ('recurring card transactions' , lambda: Transaction.objects.filter(user=user , payment_method='Card' , recurring=True)),
+        ('transactions of a card' , lambda: Transaction.objects.filter(user=user , card_number=card.card_number)),
+        ('card by details' , lambda: Card.objects.filter(user=user , card_number=card.card_number , cvv=card.cvv ,
+                                                         expiration_date=card.expiration_date)),
+        ('cards covering a debt' , lambda: Card.objects.filter(user=user , balance__gte=card.balance)),
+    ]
+
+
+
+
+class Command(BaseCommand):
+    help = 'Seeds a large dataset and prints EXPLAIN plans and timings of the hot per-user queries without and with the composite indexes.'
+
+    def add_arguments(self , parser):
+        parser.add_argument('--users' , type=int , default=200)
+        parser.add_argument('--cards' , type=int , default=3 , help='Cards per user.')
+        parser.add_argument('--transactions' , type=int , default=2000 , help='Transactions per user.')
+        parser.add_argument('--repeat' , type=int , default=20 , help='Runs per query, the median is reported.')
+        parser.add_argument('--keep' , action='store_true' , help='Keep the seeded data after the benchmark.')
+
+
+    def handle(self , *args , **options):
+        self.stdout.write('Seeding...')
+        counts = seed(users=options['users'] , cards_per_user=options['cards'] , transactions_per_user=options['transactions'])
+        self.stdout.write(f"Seeded {counts['users']} users, {counts['cards']} cards, {counts['transactions']} transactions.")
+
+        card = Card.objects.filter(user__username__startswith=SEED_PREFIX).order_by('-id').first()
+        queries = hot_queries(card.user , card)
+        indexes = [(model , index) for model in (Transaction , Card) for index in model._meta.indexes]
+
+        try:
+            with connection.schema_editor() as editor:
+                for model , index in indexes:
+                    editor.remove_index(model , index)
+            before = self.run_queries('before (implicit indexes only)' , queries , options['repeat'])
+        finally:
+            with connection.schema_editor() as editor:
+                for model , index in indexes:
+                    editor.add_index(model , index)
+        after = self.run_queries('after (composite indexes)' , queries , options['repeat'])
+
+        self.stdout.write('\nSummary (median ms, before -> after):')
+        for name , _ in queries:
+            self.stdout.write(f'  {name:<30} {before[name]:9.3f} -> {after[name]:9.3f}')
+
+        if(not options['keep']):
+            clear_seed()
+
+
+    def run_queries(self , title , queries , repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n=== {title} ==='))
+        timings = {}
+        for name , query in queries:
+            self.stdout.write(self.style.MIGRATE_LABEL(f'\n{name}'))
+            self.stdout.write(query().explain())
+            runs = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(query())
+                runs.append((time.perf_counter() - start) * 1000)
+            runs.sort()
+            timings[name] = runs[len(runs) // 2]
+            self.stdout.write(f'median {timings[name]:.3f} ms over {repeat} runs')
+        return timings
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand , CommandError
+from rest_framework.renderers import JSONRenderer
+from transactionsApp.models import *
+from transactionsApp.serializers import TransactionSerializer , TransactionRowSerializer
+from transactionsApp.seeding import seed , clear_seed , SEED_PREFIX
+import random
+import time
+
+
+
+class Command(BaseCommand):
+    help = ('Serializes the transactions of one seeded user with TransactionSerializer (model instances) and with '
+            'TransactionRowSerializer (.values() rows), checks that the JSON is identical and prints the timings.')
+
+    def add_arguments(self , parser):
+        parser.add_argument('--transactions' , type=int , default=10000)
+        parser.add_argument('--recurring-share' , type=float , default=0.3)
+        parser.add_argument('--repeat' , type=int , default=5 , help='Runs per path, the median is reported.')
+        parser.add_argument('--random-seed' , type=int , default=0)
+        parser.add_argument('--keep' , action='store_true' , help='Keep the seeded data after the benchmark.')
+
+
+    def handle(self , *args , **options):
+        random.seed(options['random_seed'])
+        seed(users=1 , cards_per_user=3 , transactions_per_user=options['transactions'] , recurring_share=options['recurring_share'])
+        user = CustomUser.objects.filter(username__startswith=SEED_PREFIX).order_by('-id').first()
+        transactions = Transaction.objects.filter(user=user).order_by('transaction_date' , 'id')
+
+        try:
+            renderer = JSONRenderer()
+            paths = {
+                'TransactionSerializer': (lambda: list(transactions.all()) ,
+                                          lambda rows: TransactionSerializer(rows , many=True).data),
+                'TransactionRowSerializer': (lambda: list(transactions.values(*TransactionRowSerializer.columns())) ,
+                                             lambda rows: TransactionRowSerializer().serialize(rows)),
+            }
+            timings = {}
+            outputs = {}
+            for name , (fetch , serialize) in paths.items():
+                runs = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    rows = fetch()
+                    fetched = time.perf_counter()
+                    data = serialize(rows)
+                    runs.append((time.perf_counter() - start , time.perf_counter() - fetched))
+                runs.sort()
+                timings[name] = [timing * 1000 for timing in runs[len(runs) // 2]]
+                outputs[name] = renderer.render(data)
+        finally:
+            if(not options['keep']):
+                clear_seed()
+
+        if(outputs['TransactionSerializer'] != outputs['TransactionRowSerializer']):
+            raise CommandError('The two paths produced different JSON.')
+
+        count = transactions.count() if(options['keep']) else options['transactions']
+        self.stdout.write(f"{count} transactions, identical JSON ({len(outputs['TransactionSerializer'])} bytes)")
+        for name , (total , serialization) in timings.items():
+            self.stdout.write(f'  {name:<26} {total:9.1f} ms, {serialization:9.1f} ms of it serializing (median of {options["repeat"]})')
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {timings['TransactionSerializer'][0] / timings['TransactionRowSerializer'][0]:.1f}x overall, "
+                                             f"{timings['TransactionSerializer'][1] / timings['TransactionRowSerializer'][1]:.1f}x serializing"))
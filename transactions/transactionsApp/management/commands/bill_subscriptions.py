@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from datetime import date
+from transactionsApp.billing import bill_subscriptions
+
+
+
+class Command(BaseCommand):
+    help = 'Charges every due subscription of every user, including the periods missed since the last run. Meant to run daily, e.g. from cron.'
+
+    def add_arguments(self , parser):
+        parser.add_argument('--date' , type=date.fromisoformat , default=None , help='Bill as of this date (YYYY-MM-DD), defaults to today.')
+        parser.add_argument('--chunk-size' , type=int , default=500 , help='Users billed per database transaction.')
+
+
+    def handle(self , *args , **options):
+        summary = bill_subscriptions(today=options['date'] , chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Billed {summary['payments']} payments of {summary['subscriptions']} subscriptions for {summary['users']} users."
+        ))
+        if(summary['declined']):
+            self.stdout.write(self.style.WARNING(f"{summary['declined']} subscriptions could not be fully paid: card balance is too low."))
+        if(summary['card_not_found']):
+            self.stdout.write(self.style.WARNING(f"{summary['card_not_found']} subscriptions skipped: card not found."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from transactionsApp.ledger import checkpoint_balances
+from datetime import date
+
+
+
+class Command(BaseCommand):
+    help = 'Stores the closing balance of every card and cash account for the past days on which it moved, so balance histories read one checkpoint instead of the whole ledger. Meant to run daily, e.g. from cron shortly after midnight.'
+
+    def add_arguments(self , parser):
+        parser.add_argument('--through' , type=date.fromisoformat , help='Last day to close (YYYY-MM-DD), yesterday by default.')
+        parser.add_argument('--chunk-size' , type=int , default=1000 , help='Users per batch.')
+
+    def handle(self , *args , **options):
+        summary = checkpoint_balances(options['through'] , chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['checkpoints']} checkpoints written for {summary['users']} users, days closed through {summary['through']}."
+        ))
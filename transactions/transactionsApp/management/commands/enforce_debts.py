@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from transactionsApp.debts import enforce_debt_deadlines
+
+
+
+class Command(BaseCommand):
+    help = 'Starts the timeframe to pay the debt of the users with a card that can cover it and deactivates that card once the timeframe has passed. Meant to run every minute, e.g. from cron.'
+
+    def handle(self , *args , **options):
+        summary = enforce_debt_deadlines()
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['notified']} users notified, {summary['deactivated']} cards deactivated, {summary['cleared']} timeframes cleared."
+        ))
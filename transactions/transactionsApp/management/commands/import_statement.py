@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand , CommandError
+from transactionsApp.models import CustomUser , Card
+from transactionsApp.statements import PARSERS , FILE_EXTENSIONS , DEFAULT_CATEGORY , DEFAULT_CHUNK_SIZE , import_statement
+
+
+
+class Command(BaseCommand):
+    help = 'Imports a CSV or OFX bank statement into the transactions of a user, in chunks, reporting progress and the rejected rows.'
+
+    def add_arguments(self , parser):
+        parser.add_argument('user' , type=int , help='Id of the user.')
+        parser.add_argument('path' , help='The statement file.')
+        parser.add_argument('--format' , dest='file_format' , choices=sorted(PARSERS) , default=None , help='Defaults to the file extension.')
+        parser.add_argument('--card' , type=int , default=None , help='Book the statement to this card of the user instead of the cash.')
+        parser.add_argument('--category' , default=DEFAULT_CATEGORY , help='Category of the rows without one.')
+        parser.add_argument('--chunk-size' , type=int , default=DEFAULT_CHUNK_SIZE , help='Rows booked per database transaction.')
+
+
+    def handle(self , *args , **options):
+        if(not CustomUser.objects.filter(pk=options['user']).exists()):
+            raise CommandError(f"User {options['user']} not found.")
+        card = None
+        if(options['card'] is not None):
+            card = Card.objects.filter(pk=options['card'] , user_id=options['user']).first()
+            if(card is None):
+                raise CommandError(f"Card {options['card']} of user {options['user']} not found.")
+
+        file_format = options['file_format'] or FILE_EXTENSIONS.get(options['path'].rsplit('.' , 1)[-1].lower())
+        if(file_format is None):
+            raise CommandError('Unknown file type, use --format.')
+
+        def progress(summary):
+            self.stdout.write(f"Chunk {summary['chunks']}: {summary['imported']} imported, {summary['failed']} rejected")
+
+        with open(options['path'] , 'rb') as file:
+            summary = import_statement(options['user'] , PARSERS[file_format](file) , card=card , category=options['category'] ,
+                                       chunk_size=options['chunk_size'] , progress=progress)
+
+        for error in summary['errors']:
+            self.stdout.write(self.style.WARNING(f"Row {error['row']}: {' '.join(error['errors'])}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['imported']} transactions in {summary['chunks']} chunks, {summary['failed']} rows rejected, "
+            f"{summary['categories_created']} categories created."
+        ))
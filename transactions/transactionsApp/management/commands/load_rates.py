@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand , CommandError
+from xml.etree.ElementTree import ParseError
+from transactionsApp.rates import PARSERS , FILE_EXTENSIONS , DEFAULT_CHUNK_SIZE , RateFileError , load_rates
+
+
+
+class Command(BaseCommand):
+    help = 'Loads daily exchange rates from an ECB XML or CSV file (e.g. eurofxref-hist.xml), replacing the rates already stored for the same days.'
+
+    def add_arguments(self , parser):
+        parser.add_argument('path' , help='The rates file.')
+        parser.add_argument('--format' , dest='file_format' , choices=sorted(PARSERS) , default=None , help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size' , type=int , default=DEFAULT_CHUNK_SIZE , help='Rates stored per INSERT.')
+
+
+    def handle(self , *args , **options):
+        file_format = options['file_format'] or FILE_EXTENSIONS.get(options['path'].rsplit('.' , 1)[-1].lower())
+        if(file_format is None):
+            raise CommandError('Unknown file type, use --format.')
+
+        def progress(summary):
+            self.stdout.write(f"{summary['rates']} rates stored, up to {summary['last']}")
+
+        try:
+            with open(options['path'] , 'rb') as file:
+                summary = load_rates(PARSERS[file_format](file) , chunk_size=options['chunk_size'] , progress=progress)
+        except (RateFileError , ParseError) as error:
+            raise CommandError(str(error))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {summary['rates']} rates from {summary['first']} to {summary['last']}, {summary['skipped']} skipped "
+            f"(unsupported currencies or missing rates)."
+        ))
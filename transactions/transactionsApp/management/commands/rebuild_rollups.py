@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from transactionsApp.rollups import rebuild
+
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily analytics rollups from the Transaction rows (backfill or repair).'
+
+    def add_arguments(self , parser):
+        parser.add_argument('--user' , type=int , action='append' , dest='users' , help='Only rebuild this user, can be repeated.')
+        parser.add_argument('--chunk-size' , type=int , default=200 , help='Users rebuilt per database transaction.')
+
+
+    def handle(self , *args , **options):
+        rows = rebuild(user_ids=options['users'] , chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {rows} rollup rows.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from transactionsApp.seeding import seed , clear_seed
+import random
+
+
+
+class Command(BaseCommand):
+    help = 'Generates synthetic users, cards, categories and transactions (recurring ones included) with bulk_create.'
+
+    def add_arguments(self , parser):
+        parser.add_argument('--users' , type=int , default=10)
+        parser.add_argument('--cards' , type=int , default=3 , help='Cards per user.')
+        parser.add_argument('--transactions' , type=int , default=1000 , help='Transactions per user.')
+        parser.add_argument('--days' , type=int , default=730 , help='Transactions are spread over this many past days.')
+        parser.add_argument('--recurring-share' , type=float , default=0.1 , help='Share of the card transactions that are subscriptions.')
+        parser.add_argument('--batch-size' , type=int , default=5000)
+        parser.add_argument('--random-seed' , type=int , default=None , help='Makes the generated data reproducible.')
+        parser.add_argument('--clear' , action='store_true' , help='Delete the previously seeded data first.')
+
+
+    def handle(self , *args , **options):
+        if(options['clear']):
+            deleted , _ = clear_seed()
+            self.stdout.write(f'Deleted {deleted} seeded rows.')
+        if(options['random_seed'] is not None):
+            random.seed(options['random_seed'])
+
+        counts = seed(users=options['users'] , cards_per_user=options['cards'] , transactions_per_user=options['transactions'] ,
+                      days=options['days'] , recurring_share=options['recurring_share'] , batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Seeded {counts['users']} users, {counts['cards']} cards, {counts['transactions']} transactions."))
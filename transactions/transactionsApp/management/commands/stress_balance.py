@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand , CommandError
+from django.db import connection
+from rest_framework import serializers
+from concurrent.futures import ThreadPoolExecutor
+from transactionsApp.models import *
+from transactionsApp.serializers import TransactionSerializer
+import time
+import uuid
+
+
+
+class Command(BaseCommand):
+    help = ('Fires concurrent card expenses at a single card from many threads and checks that the final balance and debt '
+            'are exact. Run it against a database with row locking (MySQL), SQLite serializes every writer.')
+
+    def add_arguments(self , parser):
+        parser.add_argument('--threads' , type=int , default=16)
+        parser.add_argument('--transactions' , type=int , default=2000)
+        parser.add_argument('--amount' , type=Decimal , default=Decimal('1.00'))
+        parser.add_argument('--coverage' , type=float , default=0.75 , help='Share of the transactions the initial balance can pay for.')
+        parser.add_argument('--keep' , action='store_true' , help='Keep the test user, card and transactions.')
+
+
+    def handle(self , *args , **options):
+        amount = options['amount']
+        count = options['transactions']
+        initial_balance = (amount * int(count * options['coverage'])).quantize(Decimal('0.01'))
+
+        user = CustomUser.objects.create(username=f'stress-{uuid.uuid4().hex[:12]}' , currency='EUR')
+        category = Category.objects.create(user=user , title='Stress')
+        card = Card.objects.create(user=user , card_type='Debit Card' , balance=initial_balance , currency='EUR')
+        data = {'category': category.pk , 'payment_method': 'Card' , 'card_number': card.card_number , 'cvv': card.cvv ,
+                'expiration_date': card.expiration_date , 'amount': str(amount) , 'currency': 'EUR' , 'type': 'Expense' ,
+                'recurring': False , 'recurrence_choices': 'Daily'}
+
+        def expense(_):
+            try:
+                serializer = TransactionSerializer(data=data)
+                serializer.is_valid(raise_exception=True)
+                serializer.save(user=CustomUser.objects.get(pk=user.pk))
+                return 'completed'
+            except serializers.ValidationError as error:
+                if('debt of' in str(error.detail)):
+                    return 'declined'
+                return 'blocked' if('until debt is cleared' in str(error.detail)) else f'error: {error.detail}'
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            outcomes = list(pool.map(expense , range(count)))
+        elapsed = time.perf_counter() - start
+
+        completed = outcomes.count('completed')
+        declined = outcomes.count('declined')
+        card.refresh_from_db()
+        user.refresh_from_db()
+        rows = Transaction.objects.filter(user=user).count()
+
+        self.stdout.write(f'{count} transactions in {elapsed:.2f}s ({count / elapsed:.0f}/s) with {options["threads"]} threads')
+        self.stdout.write(f'completed {completed}, declined {declined}, blocked by debt {outcomes.count("blocked")}')
+        self.stdout.write(f'balance {initial_balance} -> {card.balance}, debt {user.debt}, transaction rows {rows}')
+
+        errors = sorted(set(outcome for outcome in outcomes if outcome.startswith('error')))
+        if(card.balance != initial_balance - amount * completed):
+            errors.append(f'balance is {card.balance}, expected {initial_balance - amount * completed}')
+        if(card.balance < 0):
+            errors.append('balance went negative')
+        if(user.debt != amount * declined):
+            errors.append(f'debt is {user.debt}, expected {amount * declined}')
+        if(rows != completed):
+            errors.append(f'{rows} transaction rows for {completed} completed transactions')
+
+        if(not options['keep']):
+            user.delete()
+        if(errors):
+            raise CommandError('Lost updates detected: ' + '; '.join(errors))
+        self.stdout.write(self.style.SUCCESS('Balances are exact.'))
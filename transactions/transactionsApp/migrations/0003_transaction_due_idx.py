@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactionsApp', '0002_card_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['recurring', 'payment_method', 'subscription_next_paid_date'], name='transaction_due_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count , Sum
+
+
+def backfill_rollups(apps , schema_editor):
+    Transaction = apps.get_model('transactionsApp' , 'Transaction')
+    DailyRollup = apps.get_model('transactionsApp' , 'DailyRollup')
+    entries = {}
+    groups = (Transaction.objects.values('user_id' , 'transaction_date' , 'currency' , 'type' , 'payment_method' , 'card_number' , 'recurring')
+                                 .annotate(total=Sum('amount') , count=Count('id')).order_by())
+    for group in groups.iterator():
+        key = (group['user_id'] , group['transaction_date'] , group['currency'] , group['type'] , group['payment_method'] ,
+               group['card_number'] or '' , group['recurring'])
+        total , count = entries.get(key , (0 , 0))
+        entries[key] = (total + group['total'] , count + group['count'])
+    DailyRollup.objects.bulk_create([
+        DailyRollup(user_id=key[0] , day=key[1] , currency=key[2] , type=key[3] , payment_method=key[4] , card_number=key[5] ,
+                    recurring=key[6] , total=total , count=count)
+        for key , (total , count) in entries.items()
+    ] , batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactionsApp', '0003_transaction_due_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('currency', models.CharField(choices=[('EUR', 'EUR (€)'), ('USD', 'USD ($)'), ('GBP', 'GBP (£)'), ('JPY', 'JPY (¥)'), ('SEK', 'SEK (Kr)'), ('CHF', 'CHF (₣)')], max_length=10)),
+                ('type', models.CharField(max_length=10)),
+                ('payment_method', models.CharField(max_length=10)),
+                ('card_number', models.CharField(blank=True, default='', max_length=16)),
+                ('recurring', models.BooleanField(default=False)),
+                ('billed', models.BooleanField(default=False)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'day', 'currency', 'type', 'payment_method', 'card_number', 'recurring', 'billed'), name='daily_rollup_key')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups , migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_versions(apps , schema_editor):
+    CustomUser = apps.get_model('transactionsApp' , 'CustomUser')
+    DataVersion = apps.get_model('transactionsApp' , 'DataVersion')
+    user_ids = CustomUser.objects.values_list('id' , flat=True)
+    DataVersion.objects.bulk_create([DataVersion(user_id=user_id) for user_id in user_ids.iterator()] , batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactionsApp', '0005_cardnumbersequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.BigIntegerField(default=1)),
+                ('valid_until', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(create_versions , migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+def zero_null_debts(apps , schema_editor):
+    CustomUser = apps.get_model('transactionsApp' , 'CustomUser')
+    CustomUser.objects.filter(debt__isnull=True).update(debt=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactionsApp', '0006_dataversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(zero_null_debts , migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customuser',
+            name='debt',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactionsApp', '0007_debt_not_null'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_date',
+            field=models.DateField(default=django.utils.timezone.localdate, editable=False),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactionsApp', '0008_transaction_date_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analytics',
+            name='status',
+            field=models.CharField(blank=True, choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed'), ('cancelled', 'cancelled')], default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='analytics',
+            name='result',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analytics',
+            name='error',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='analytics',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='analytics',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='analytics',
+            index=models.Index(fields=['status', 'created_at'], name='analytics_job_status_idx'),
+        ),
+    ]
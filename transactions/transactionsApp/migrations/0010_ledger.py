@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def open_accounts(apps , schema_editor):
+    # the history of the existing balances starts today, with their current value
+    CustomUser = apps.get_model('transactionsApp' , 'CustomUser')
+    Card = apps.get_model('transactionsApp' , 'Card')
+    LedgerEntry = apps.get_model('transactionsApp' , 'LedgerEntry')
+    batch = []
+    accounts = [(user_id , 0 , currency , cash) for user_id , currency , cash in
+                CustomUser.objects.exclude(cash=0).values_list('id' , 'currency' , 'cash').iterator()]
+    accounts += [(user_id , card_id , currency , balance) for card_id , user_id , currency , balance in
+                 Card.objects.exclude(balance=0).values_list('id' , 'user_id' , 'currency' , 'balance').iterator()]
+    for user_id , account , currency , balance in accounts:
+        batch.append(LedgerEntry(user_id=user_id , account=account , currency=currency , amount=balance , kind='opening'))
+        if(len(batch) >= 1000):
+            LedgerEntry.objects.bulk_create(batch)
+            batch = []
+    LedgerEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactionsApp', '0009_analytics_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.BigIntegerField(default=0)),
+                ('kind', models.CharField(choices=[('opening', 'opening'), ('transaction', 'transaction'), ('subscription', 'subscription'), ('statement', 'statement'), ('adjustment', 'adjustment'), ('conversion', 'conversion')], max_length=12)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('currency', models.CharField(choices=[('EUR', 'EUR (€)'), ('USD', 'USD ($)'), ('GBP', 'GBP (£)'), ('JPY', 'JPY (¥)'), ('SEK', 'SEK (Kr)'), ('CHF', 'CHF (₣)')], max_length=10)),
+                ('note', models.CharField(blank=True, max_length=200, null=True)),
+                ('booked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('booked_on', models.DateField(default=django.utils.timezone.localdate)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'account', 'booked_on'], name='ledger_account_day_idx'), models.Index(fields=['booked_on'], name='ledger_day_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.BigIntegerField(default=0)),
+                ('day', models.DateField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('currency', models.CharField(choices=[('EUR', 'EUR (€)'), ('USD', 'USD ($)'), ('GBP', 'GBP (£)'), ('JPY', 'JPY (¥)'), ('SEK', 'SEK (Kr)'), ('CHF', 'CHF (₣)')], max_length=10)),
+                ('latest', models.BooleanField(default=False)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'latest'], name='checkpoint_latest_idx'), models.Index(fields=['day'], name='checkpoint_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'account', 'day'), name='checkpoint_account_day')],
+            },
+        ),
+        migrations.RunPython(open_accounts , migrations.RunPython.noop),
+    ]
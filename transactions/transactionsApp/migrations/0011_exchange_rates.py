@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactionsApp', '0010_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analytics',
+            name='historical_rates',
+            field=models.BooleanField(default=False, help_text='Convert every transaction at the rates of its own day.'),
+        ),
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('EUR', 'EUR (€)'), ('USD', 'USD ($)'), ('GBP', 'GBP (£)'), ('JPY', 'JPY (¥)'), ('SEK', 'SEK (Kr)'), ('CHF', 'CHF (₣)')], max_length=10)),
+                ('day', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='exchange_rate_updated_idx')],
+                'constraints': [models.UniqueConstraint(fields=('currency', 'day'), name='exchange_rate_currency_day')],
+            },
+        ),
+    ]
@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models , transaction as db_transaction
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from decimal import Decimal
 import random
+import threading
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
 from django.core.validators import MinValueValidator
@@ -12,20 +14,23 @@ CREDIT_LIMIT = 1000 # credit cards have limits for every currency
 
 
 class Currency_rate:
-    # rates in relation to EUR.
+    # rates in relation to EUR, used for the currencies the ExchangeRate table has no rates for (rates.py).
     currency_rates = {
-        'EUR':1.00,
-        'USD':1.16,
-        'GBP':0.85,
-        'JPY':171.00,
-        'SEK':11.56,
-        'CHF':1.09
+        'EUR':Decimal('1.00'),
+        'USD':Decimal('1.16'),
+        'GBP':Decimal('0.85'),
+        'JPY':Decimal('171.00'),
+        'SEK':Decimal('11.56'),
+        'CHF':Decimal('1.09')
     }
 
     @staticmethod
-    def convertion(amount , initial_currency , goal_currency):
-        euro_amount = amount / Decimal(Currency_rate.currency_rates[initial_currency])
-        goal_cur_amount = euro_amount * Decimal(Currency_rate.currency_rates[goal_currency])
+    def convertion(amount , initial_currency , goal_currency , on=None):
+        # at the rates of the day on, the latest rates if on is None
+        from .rates import rate_cache
+        rates = rate_cache()
+        euro_amount = amount / rates.rate(initial_currency , on)
+        goal_cur_amount = euro_amount * rates.rate(goal_currency , on)
         return goal_cur_amount
 
 
@@ -64,7 +69,7 @@ class CustomUser(AbstractUser):
     job = models.CharField(max_length=100 , blank=True , null=True)
     cash = models.DecimalField(max_digits=12 , decimal_places=2 , blank=False , null=False , default=0 , 
                                validators=[MinValueValidator(0)] , verbose_name='Cash*')
-    debt = models.DecimalField(max_digits=12 , decimal_places=2 , blank=True , null=True , default=0)
+    debt = models.DecimalField(max_digits=12 , decimal_places=2 , blank=False , null=False , default=0)
     debt_timeframe = models.DateTimeField(blank=True , null=True)
     currency = models.CharField(max_length=10 , blank=False , null=False , choices=Currency.currency , verbose_name='Currency*')
     convert_currency = models.BooleanField(default=False)
@@ -85,6 +90,85 @@ class CustomUser(AbstractUser):
 
 
 
+# a single row per sequence name, handing out blocks of card numbers
+class CardNumberSequence(models.Model):
+    name = models.CharField(max_length=20 , unique=True)
+    next_value = models.BigIntegerField(default=0)
+
+
+
+
+
+
+class Card_number:
+    # Card numbers are the issuer prefix, 13 digits scrambled from a database sequence and a Luhn check digit.
+    # The scrambling (x * MULTIPLIER + OFFSET) mod 10^13 is a bijection, so distinct sequence values always give
+    # distinct numbers, without probing the cards table for every attempt.
+    PREFIX = '42'
+    BODY_DIGITS = 13
+    MULTIPLIER = 3_781_264_599_737 # coprime with 10^13
+    OFFSET = 5_106_829_443_017
+    BLOCK_SIZE = 100 # sequence values reserved at a time
+    cached = [] # sequence values this process reserved and has not handed out yet
+    lock = threading.Lock()
+
+    @staticmethod
+    def luhn_digit(payload):
+        total = 0
+        for position , digit in enumerate(reversed(payload)):
+            digit = int(digit)
+            if(position % 2 == 0):
+                digit *= 2
+                if(digit > 9):
+                    digit -= 9
+            total += digit
+        return str((10 - total % 10) % 10)
+
+
+    @staticmethod
+    def from_sequence(value):
+        modulus = 10 ** Card_number.BODY_DIGITS
+        body = str((value * Card_number.MULTIPLIER + Card_number.OFFSET) % modulus).zfill(Card_number.BODY_DIGITS)
+        payload = Card_number.PREFIX + body
+        return payload + Card_number.luhn_digit(payload)
+
+
+    @staticmethod
+    def reserve(count):
+        # row lock on the sequence for the rest of the caller's transaction, the block is never handed out twice
+        with db_transaction.atomic():
+            sequence , _ = CardNumberSequence.objects.select_for_update().get_or_create(name='card_number')
+            start = sequence.next_value
+            CardNumberSequence.objects.filter(pk=sequence.pk).update(next_value=F('next_value') + count)
+        return range(start , start + count)
+
+
+    @staticmethod
+    def allocate(count):
+        # Numbers are handed out from the values the process reserved, the sequence is locked again only when
+        # they run out. The rest of a block is cached once the transaction that reserved it commits: after a
+        # rollback the sequence hands the same values out again, so they must not stay in the cache too.
+        with Card_number.lock:
+            values = Card_number.cached[:count]
+            del Card_number.cached[:count]
+        needed = count - len(values)
+        if(needed > 0):
+            block = Card_number.reserve(max(needed , Card_number.BLOCK_SIZE))
+            values.extend(block[:needed])
+            db_transaction.on_commit(lambda: Card_number.cache(block[needed:]))
+        return [Card_number.from_sequence(value) for value in values]
+
+
+    @staticmethod
+    def cache(values):
+        with Card_number.lock:
+            Card_number.cached.extend(values)
+
+
+
+
+
+
 # create multiple cards for users
 class Card(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL , on_delete=models.CASCADE) # if user is deleted, card must be deleted
@@ -98,27 +182,49 @@ class Card(models.Model):
     initial_currency = models.CharField(max_length=10 , blank=True , null=True , choices=Currency.currency)
     convert_currency = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user' , 'card_number' , 'cvv' , 'expiration_date'] , name='card_user_details_idx'),
+            models.Index(fields=['user' , 'balance'] , name='card_user_balance_idx'),
+        ]
+
     def save(self , *args , **kwargs):
         if(not self.pk):
             if(self.initial_currency is None):
                 self.initial_currency = self.currency
 
-            cvv = ''.join([str(random.randint(0,9)) for _ in range(3)])
-            year = str((timezone.now().today() + relativedelta(years=random.randint(1,7))).year)[2:]
-            month = str(random.randint(1,12))
-            month = '0' + month if int(month) < 10 else month            
-            expiration_date = f'{month}' + '/' + f'{year}'
-            self.cvv = cvv
-            self.expiration_date = expiration_date
-
-            while(1):
-                number = ''.join([str(random.randint(0,9)) for _ in range(16)])
-                if(not Card.objects.filter(card_number=number).exists()):
-                    self.card_number = number
-                    break
+            self.generate_details()
+            if(not self.card_number):
+                self.card_number = Card_number.allocate(1)[0]
         return super().save(*args , **kwargs)
 
 
+    def generate_details(self):
+        cvv = ''.join([str(random.randint(0,9)) for _ in range(3)])
+        year = str((timezone.now().today() + relativedelta(years=random.randint(1,7))).year)[2:]
+        month = str(random.randint(1,12))
+        month = '0' + month if int(month) < 10 else month            
+        expiration_date = f'{month}' + '/' + f'{year}'
+        self.cvv = cvv
+        self.expiration_date = expiration_date
+
+
+    @staticmethod
+    def bulk_issue(user_ids , count , card_type , balance , currency , batch_size=1000):
+        # count new cards for every user, with one block of card numbers and one bulk_create
+        numbers = iter(Card_number.allocate(count * len(user_ids)))
+        cards = []
+        for user_id in user_ids:
+            for _ in range(count):
+                card = Card(user_id=user_id , card_type=card_type , card_number=next(numbers) , balance=balance ,
+                            currency=currency , initial_currency=currency)
+                card.generate_details()
+                cards.append(card)
+        cards = Card.objects.bulk_create(cards , batch_size=batch_size)
+        DataVersion.bump(*user_ids)
+        return cards
+
+
 
 
 
@@ -156,7 +262,7 @@ class Transaction(models.Model):
                                                     ] , 
                             default='Expense' , verbose_name='Type*'
                            )
-    transaction_date = models.DateField(auto_now=True)
+    transaction_date = models.DateField(default=timezone.localdate , editable=False) # explicit dates are kept (seeding, statement imports)
     category = models.ForeignKey(Category , blank=False , null=False , on_delete=models.CASCADE , verbose_name='Category*')
     recurring = models.BooleanField(help_text='Subscription payments are only permitted via card.')
     subscription_start_date = models.DateField(blank=True , null=True)
@@ -170,6 +276,14 @@ class Transaction(models.Model):
     subscription_next_paid_date = models.DateField(blank=True , null=True , default=timezone.now().date())
     message = models.CharField(max_length=200 , blank=True , null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user' , 'transaction_date'] , name='transaction_user_date_idx'),
+            models.Index(fields=['user' , 'payment_method' , 'recurring'] , name='transaction_user_method_idx'),
+            models.Index(fields=['user' , 'card_number'] , name='transaction_user_card_idx'),
+            models.Index(fields=['recurring' , 'payment_method' , 'subscription_next_paid_date'] , name='transaction_due_idx'),
+        ]
+
 
 
 
@@ -187,4 +301,139 @@ class Analytics(models.Model):
     subscriptions = models.BooleanField(default=False)
     compute_statistics_from = models.DateField(blank=True , null=True , verbose_name='From')
     compute_statistics_to = models.DateField(blank=True , null=True , verbose_name='Until')
-    currency = models.CharField(max_length=10 , choices=Currency.currency , default=('EUR' , 'EUR (€)'))
\ No newline at end of file
+    currency = models.CharField(max_length=10 , choices=Currency.currency , default=('EUR' , 'EUR (€)'))
+    historical_rates = models.BooleanField(default=False , help_text='Convert every transaction at the rates of its own day.')
+    # reports computed in the background (jobs.py), status is '' for the others
+    status = models.CharField(max_length=10 , blank=True , default='' , choices=[('queued' , 'queued'),
+                                                                                ('running' , 'running'),
+                                                                                ('done' , 'done'),
+                                                                                ('failed' , 'failed'),
+                                                                                ('cancelled' , 'cancelled')
+                                                                               ])
+    result = models.JSONField(blank=True , null=True)
+    error = models.CharField(max_length=200 , blank=True , null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True , null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status' , 'created_at'] , name='analytics_job_status_idx'),
+        ]
+
+
+
+
+
+
+# daily sums of the money that moved, one row per (user, day, currency, type, payment method, card, recurring)
+class DailyRollup(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL , on_delete=models.CASCADE)
+    day = models.DateField()
+    currency = models.CharField(max_length=10 , choices=Currency.currency)
+    type = models.CharField(max_length=10)
+    payment_method = models.CharField(max_length=10)
+    card_number = models.CharField(max_length=16 , blank=True , default='') # '' for cash
+    recurring = models.BooleanField(default=False)
+    billed = models.BooleanField(default=False) # subscription payments charged by the billing engine, not Transaction rows
+    total = models.DecimalField(max_digits=14 , decimal_places=2 , default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user' , 'day' , 'currency' , 'type' , 'payment_method' , 'card_number' , 'recurring' , 'billed'] ,
+                                    name='daily_rollup_key'),
+        ]
+
+
+
+
+
+
+
+# per-user data version behind the ETags of the list/retrieve endpoints, bumped on every change of the user's data
+class DataVersion(models.Model):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL , on_delete=models.CASCADE , primary_key=True)
+    version = models.BigIntegerField(default=1)
+    valid_until = models.DateTimeField(blank=True , null=True) # the responses change by themselves at this time (debt timeframe)
+
+    @staticmethod
+    def bump(*user_ids):
+        # one UPDATE, for the paths that bypass the post_save signals (F() updates, bulk_create, bulk_update)
+        DataVersion.objects.filter(user_id__in=user_ids).update(version=F('version') + 1)
+
+
+
+
+
+
+
+# append-only history of the card balances and the cash, one row per change of a balance (ledger.py)
+class LedgerEntry(models.Model):
+    CASH = 0 # account of the cash, the other accounts are card ids
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL , on_delete=models.CASCADE)
+    account = models.BigIntegerField(default=CASH) # no foreign key: the entries of a deleted card stay
+    kind = models.CharField(max_length=12 , choices=[('opening' , 'opening'),
+                                                     ('transaction' , 'transaction'),
+                                                     ('subscription' , 'subscription'),
+                                                     ('statement' , 'statement'),
+                                                     ('adjustment' , 'adjustment'),
+                                                     ('conversion' , 'conversion')
+                                                    ])
+    amount = models.DecimalField(max_digits=14 , decimal_places=2) # signed, in the currency of the account
+    currency = models.CharField(max_length=10 , choices=Currency.currency)
+    note = models.CharField(max_length=200 , blank=True , null=True)
+    booked_at = models.DateTimeField(default=timezone.now)
+    booked_on = models.DateField(default=timezone.localdate)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user' , 'account' , 'booked_on'] , name='ledger_account_day_idx'),
+            models.Index(fields=['booked_on'] , name='ledger_day_idx'),
+        ]
+
+
+
+
+
+
+
+# closing balance of an account on a day it moved, written by the checkpoint_balances command (ledger.py)
+class BalanceCheckpoint(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL , on_delete=models.CASCADE)
+    account = models.BigIntegerField(default=LedgerEntry.CASH)
+    day = models.DateField()
+    balance = models.DecimalField(max_digits=14 , decimal_places=2)
+    currency = models.CharField(max_length=10 , choices=Currency.currency)
+    latest = models.BooleanField(default=False) # the last checkpoint of the account, where the next run continues
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user' , 'account' , 'day'] , name='checkpoint_account_day'),
+        ]
+        indexes = [
+            models.Index(fields=['user' , 'latest'] , name='checkpoint_latest_idx'),
+            models.Index(fields=['day'] , name='checkpoint_day_idx'),
+        ]
+
+
+
+
+
+
+
+# units of a currency per euro on a day, as published by the ECB (no rows on weekends and holidays), loaded by
+# the load_rates command and read through the in-process cache of rates.py
+class ExchangeRate(models.Model):
+    currency = models.CharField(max_length=10 , choices=Currency.currency)
+    day = models.DateField()
+    rate = models.DecimalField(max_digits=18 , decimal_places=8)
+    updated_at = models.DateTimeField(default=timezone.now) # of the load that stored the rate, the caches reload when it moves
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['currency' , 'day'] , name='exchange_rate_currency_day'),
+        ]
+        indexes = [
+            models.Index(fields=['updated_at'] , name='exchange_rate_updated_idx'),
+        ]
@@ -0,0 +1,143 @@
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from django.db.models import Q
+from collections import OrderedDict
+import base64
+import json
+
+
+
+class KeysetPagination(BasePagination):
+    # Cursor pagination that seeks on the values of the ordering columns instead of an offset, so every page
+    # is one indexed range scan no matter how deep the client scrolls. The ordering must end with a unique
+    # column (id), the cursor is the opaque encoding of the ordering values of the row at the page boundary.
+    ordering = ('id' ,)
+    page_size = api_settings.PAGE_SIZE or 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = '⚠️ Invalid cursor.'
+
+
+    def paginate_queryset(self , queryset , request , view=None):
+        self.request = request
+        self.model = queryset.model
+        self.size = self.get_page_size(request)
+        position , reverse = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.get_ordering(reverse))
+        if(position is not None):
+            queryset = queryset.filter(self.seek(position , reverse))
+
+        results = list(queryset[:self.size + 1])
+        has_more = len(results) > self.size
+        results = results[:self.size]
+
+        if(reverse):
+            results.reverse()
+            self.has_next , self.has_previous = True , has_more
+        else:
+            self.has_next , self.has_previous = has_more , position is not None
+
+        self.page = results
+        return results
+
+
+    def get_paginated_response(self , data):
+        return Response(OrderedDict([
+            ('next' , self.get_next_link()),
+            ('previous' , self.get_previous_link()),
+            ('results' , data)
+        ]))
+
+
+    def get_paginated_response_schema(self , schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string' , 'nullable': True , 'format': 'uri'},
+                'previous': {'type': 'string' , 'nullable': True , 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+    def get_page_size(self , request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param , self.page_size))
+        except (TypeError , ValueError):
+            return self.page_size
+        return max(1 , min(size , self.max_page_size))
+
+
+    def get_ordering(self , reverse=False):
+        if(not reverse):
+            return self.ordering
+        return tuple(field[1:] if(field.startswith('-')) else '-' + field for field in self.ordering)
+
+
+    def seek(self , position , reverse):
+        # (a, b) > (x, y)  ->  a > x OR (a = x AND b > y), with the direction of every column respected
+        condition = Q()
+        equal = Q()
+        for field , value in zip(self.ordering , position):
+            name = field.lstrip('-')
+            lookup = 'lt' if(field.startswith('-') != reverse) else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+
+    def position_of(self , item):
+        names = [field.lstrip('-') for field in self.ordering]
+        if(isinstance(item , dict)):
+            return [item[name] for name in names]
+        return [getattr(item , name) for name in names]
+
+
+    def encode_cursor(self , item , reverse):
+        values = [None if(value is None) else str(value) for value in self.position_of(item)]
+        cursor = json.dumps({'p': values , 'r': reverse} , separators=(',' , ':'))
+        encoded = base64.urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri() , self.cursor_query_param , encoded)
+
+
+    def decode_cursor(self , request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if(not encoded):
+            return None , False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            values = cursor['p']
+            if(len(values) != len(self.ordering)):
+                raise ValueError
+            # clean() also runs the range validators, an id out of the range of the column is refused here, not by the database
+            position = [self.model._meta.get_field(field.lstrip('-')).clean(value , None)
+                        for field , value in zip(self.ordering , values)]
+            return position , bool(cursor.get('r'))
+        except Exception:
+            raise ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+
+
+    def get_next_link(self):
+        if(not self.has_next or not self.page):
+            return None
+        return self.encode_cursor(self.page[-1] , False)
+
+
+    def get_previous_link(self):
+        if(not self.has_previous or not self.page):
+            return None
+        return self.encode_cursor(self.page[0] , True)
+
+
+
+
+
+
+class TransactionPagination(KeysetPagination):
+    ordering = ('transaction_date' , 'id')
@@ -0,0 +1,239 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse , Http404
+from django.utils import timezone
+from collections import deque
+from contextlib import contextmanager , ExitStack
+from contextvars import ContextVar
+import math
+import threading
+import time
+
+
+
+# Opt-in request profiling. Enable it with PROFILING = {'ENABLED': True} in settings (or DJANGO_PROFILING=1).
+# Every request gets a Server-Timing header with its database, serializer and view time. Slow requests are
+# sampled with their SQL into a ring buffer, and per-route histograms are served by metrics_view.
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_REQUESTS_KEPT': 100, # size of the ring buffer
+    'SQL_PER_SLOW_REQUEST': 200,
+    'BUCKETS_MS': (5 , 10 , 25 , 50 , 100 , 250 , 500 , 1000 , 2500 , 5000),
+}
+
+
+
+def profiling_settings():
+    return {**DEFAULTS , **getattr(settings , 'PROFILING' , {})}
+
+
+
+current_profile = ContextVar('current_profile' , default=None)
+
+
+
+
+class RequestProfile:
+    # collects the timings of one request, it is also the execute wrapper of every database connection
+
+    def __init__(self , keep_sql):
+        self.queries = 0
+        self.db_time = 0
+        self.serializer_time = 0
+        self.serializer_depth = 0
+        self.view_start = None
+        self.view_time = 0
+        self.sql = []
+        self.keep_sql = keep_sql
+
+
+    def __call__(self , execute , sql , params , many , context):
+        start = time.perf_counter()
+        try:
+            return execute(sql , params , many , context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            if(len(self.sql) < self.keep_sql):
+                self.sql.append({'sql': sql , 'ms': round(duration * 1000 , 3)})
+
+
+    def server_timing(self , total):
+        return (f'db;desc="{self.queries} queries";dur={self.db_time * 1000:.2f}, '
+                f'serializer;dur={self.serializer_time * 1000:.2f}, '
+                f'view;dur={self.view_time * 1000:.2f}, '
+                f'total;dur={total * 1000:.2f}')
+
+
+
+
+@contextmanager
+def serializer_timer():
+    # only the outermost serializer call is timed, nested serializers and list items are part of it
+    profile = current_profile.get()
+    if(profile is None or profile.serializer_depth):
+        yield
+        return
+    profile.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.serializer_depth -= 1
+        profile.serializer_time += time.perf_counter() - start
+
+
+
+
+class ProfiledSerializerMixin:
+    # validation and representation time of the serializer count as serializer time
+
+    def run_validation(self , *args , **kwargs):
+        with serializer_timer():
+            return super().run_validation(*args , **kwargs)
+
+    def to_representation(self , instance):
+        with serializer_timer():
+            return super().to_representation(instance)
+
+
+
+
+
+class Metrics:
+    # per-route histograms and the ring buffer of slow requests, shared by the threads of the process
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.configure(DEFAULTS)
+
+
+    def configure(self , config):
+        with self.lock:
+            self.bounds = list(config['BUCKETS_MS'])
+            self.routes = {}
+            self.slow = deque(maxlen=config['SLOW_REQUESTS_KEPT'])
+
+
+    def record(self , route , total_ms , status , profile , sample=None):
+        bucket = next((index for index , bound in enumerate(self.bounds) if(total_ms <= bound)) , len(self.bounds))
+        with self.lock:
+            entry = self.routes.get(route)
+            if(entry is None):
+                entry = {'count': 0 , 'errors': 0 , 'total_ms': 0 , 'max_ms': 0 , 'queries': 0 , 'db_ms': 0 , 'serializer_ms': 0 ,
+                         'buckets': [0] * (len(self.bounds) + 1)}
+                self.routes[route] = entry
+            entry['count'] += 1
+            entry['errors'] += status >= 500
+            entry['total_ms'] += total_ms
+            entry['max_ms'] = max(entry['max_ms'] , total_ms)
+            entry['queries'] += profile.queries
+            entry['db_ms'] += profile.db_time * 1000
+            entry['serializer_ms'] += profile.serializer_time * 1000
+            entry['buckets'][bucket] += 1
+            if(sample):
+                self.slow.append(sample)
+
+
+    def quantile(self , buckets , count , share):
+        # upper bound of the bucket holding the quantile
+        rank = math.ceil(share * count)
+        seen = 0
+        for bound , bucket in zip(self.bounds + [None] , buckets):
+            seen += bucket
+            if(seen >= rank):
+                return bound
+        return None
+
+
+    def snapshot(self):
+        with self.lock:
+            routes = {}
+            for route , entry in sorted(self.routes.items()):
+                count = entry['count']
+                cumulative = 0
+                histogram = {}
+                for bound , bucket in zip(self.bounds + ['inf'] , entry['buckets']):
+                    cumulative += bucket
+                    histogram[f'le_{bound}'] = cumulative
+                routes[route] = {
+                    'count': count,
+                    'errors': entry['errors'],
+                    'mean_ms': round(entry['total_ms'] / count , 3),
+                    'max_ms': round(entry['max_ms'] , 3),
+                    'p50_ms': self.quantile(entry['buckets'] , count , 0.50),
+                    'p95_ms': self.quantile(entry['buckets'] , count , 0.95),
+                    'p99_ms': self.quantile(entry['buckets'] , count , 0.99),
+                    'mean_queries': round(entry['queries'] / count , 2),
+                    'mean_db_ms': round(entry['db_ms'] / count , 3),
+                    'mean_serializer_ms': round(entry['serializer_ms'] / count , 3),
+                    'histogram_ms': histogram,
+                }
+            return {'routes': routes , 'slow_requests': list(self.slow)}
+
+
+
+metrics = Metrics()
+
+
+
+
+
+class ProfilingMiddleware:
+    # put it first in MIDDLEWARE, so that the total covers the other middleware as well
+
+    def __init__(self , get_response):
+        self.config = profiling_settings()
+        if(not self.config['ENABLED']):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        metrics.configure(self.config)
+
+
+    def __call__(self , request):
+        profile = RequestProfile(self.config['SQL_PER_SLOW_REQUEST'])
+        token = current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        end = time.perf_counter()
+        total = end - start
+        if(profile.view_start is not None):
+            profile.view_time = end - profile.view_start
+
+        response['Server-Timing'] = profile.server_timing(total)
+
+        match = request.resolver_match
+        route = f"{request.method} {match.view_name if(match) else 'unresolved'}"
+        total_ms = total * 1000
+        sample = None
+        if(total_ms >= self.config['SLOW_REQUEST_MS']):
+            sample = {'at': timezone.now().isoformat() , 'route': route , 'path': request.get_full_path() ,
+                      'status': response.status_code , 'total_ms': round(total_ms , 3) , 'view_ms': round(profile.view_time * 1000 , 3) ,
+                      'db_ms': round(profile.db_time * 1000 , 3) , 'queries': profile.queries ,
+                      'serializer_ms': round(profile.serializer_time * 1000 , 3) , 'sql': profile.sql}
+        metrics.record(route , total_ms , response.status_code , profile , sample)
+        return response
+
+
+    def process_view(self , request , view_func , view_args , view_kwargs):
+        current_profile.get().view_start = time.perf_counter()
+
+
+
+
+
+def metrics_view(request):
+    # internal: only answered for the addresses in INTERNAL_IPS
+    if(request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS):
+        raise Http404()
+    return JsonResponse({'enabled': profiling_settings()['ENABLED'] , **metrics.snapshot()} , json_dumps_params={'ensure_ascii': False})
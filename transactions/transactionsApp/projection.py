@@ -0,0 +1,74 @@
+from .models import *
+from .analytics import money
+from .recurrence import monthly_occurrences
+from django.db.models import Q , F , Sum , Count , Case , When , DateField
+from dateutil.relativedelta import relativedelta
+
+
+
+# Cash-flow forecast of the subscriptions of a user. The recurring transactions are grouped by schedule in the
+# database and the payments of each schedule are counted per month with recurrence.monthly_occurrences, so the
+# cost depends on the number of distinct schedules, not on the number of subscriptions or of payments. Every
+# (month, type, currency) total is converted to the goal currency once.
+# Subscriptions with the same recurrence, type, currency and next payment pay in the same months, unless an end
+# date within the forecast cuts them: only then the end date, and for monthly and yearly ones the start date
+# (the day of the month the payments keep), tell them apart.
+# Only card subscriptions are charged (billing.py); payments that are overdue today are due at the next billing
+# run, so they are counted in the current month.
+
+MAX_MONTHS = 120
+
+
+
+
+def subscriptions(user_id , horizon):
+    return Transaction.objects.filter(Q(subscription_end_date__isnull=True) | Q(subscription_next_paid_date__lt=F('subscription_end_date')) ,
+                                      user_id=user_id , recurring=True , payment_method='Card' ,
+                                      subscription_next_paid_date__lte=horizon)
+
+
+
+
+def build_projection(user_id , months=12 , currency='EUR' , today=None):
+    today = today or timezone.localdate()
+    first_month = (today.year , today.month)
+    horizon = today.replace(day=1) + relativedelta(months=months) - relativedelta(days=1)
+
+    ends_within = Q(subscription_end_date__lte=horizon)
+    schedules = (subscriptions(user_id , horizon)
+                 .annotate(start=Case(When(ends_within & Q(recurrence_choices__in=('Monthly' , 'Yearly')) , then='subscription_start_date') ,
+                                      output_field=DateField()) ,
+                           end=Case(When(ends_within , then='subscription_end_date') , output_field=DateField()))
+                 .values('recurrence_choices' , 'type' , 'currency' , 'subscription_next_paid_date' , 'start' , 'end')
+                 .annotate(total=Sum('amount') , count=Count('id'))
+                 .order_by())
+
+    totals = {} # (month, type, currency) -> amount
+    payments = {} # month -> number of payments
+    count = 0
+    for schedule in schedules:
+        count += schedule['count']
+        occurrences = monthly_occurrences(schedule['start'] , schedule['subscription_next_paid_date'] , schedule['end'] , horizon ,
+                                          schedule['recurrence_choices'])
+        for month , times in occurrences.items():
+            month = max(month , first_month)
+            key = (month , schedule['type'] , schedule['currency'])
+            totals[key] = totals.get(key , 0) + schedule['total'] * times
+            payments[month] = payments.get(month , 0) + schedule['count'] * times
+
+    forecast = {}
+    for offset in range(months):
+        month = today.replace(day=1) + relativedelta(months=offset)
+        forecast[(month.year , month.month)] = {'month': f'{month.year}-{month.month:02d}' , 'income': 0 , 'expense': 0}
+    for (month , type , group_currency) , total in totals.items():
+        if(group_currency != currency):
+            total = Currency_rate.convertion(total , group_currency , currency)
+        forecast[month]['income' if(type == 'Income') else 'expense'] += total
+
+    result = []
+    for month , row in forecast.items():
+        result.append({'month': row['month'] , 'income': money(row['income']) , 'expense': money(row['expense']) ,
+                       'net': money(row['income'] - row['expense']) , 'payments': payments.get(month , 0)})
+    return {'currency': currency , 'from': today.isoformat() , 'to': horizon.isoformat() , 'subscriptions': count ,
+            'income': money(sum(row['income'] for row in forecast.values())) ,
+            'expense': money(sum(row['expense'] for row in forecast.values())) , 'months': result}
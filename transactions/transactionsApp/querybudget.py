@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+from collections import Counter
+from contextlib import ExitStack , contextmanager
+import threading
+
+
+
+# Every viewset declares the most queries each of its actions may run (query_budget). With QUERY_BUDGET_ENFORCED
+# on (debug mode and the tests), a request that runs more raises QueryBudgetExceeded listing the repeated SQL.
+
+TRANSACTION_CONTROL = ('SAVEPOINT' , 'RELEASE SAVEPOINT' , 'ROLLBACK TO SAVEPOINT')
+WRITE_STATEMENTS = ('INSERT' , 'UPDATE' , 'DELETE' , 'REPLACE')
+
+_uncounted = threading.local()
+
+
+
+class QueryBudgetExceeded(Exception):
+
+    def __init__(self , view , budget , counter):
+        self.view = view
+        self.budget = budget
+        self.counter = counter
+        lines = [f'{view} ran {counter.count} queries, its budget is {budget}.']
+        duplicates = counter.duplicates()
+        if(duplicates):
+            lines.append('Repeated statements (N+1 candidates):')
+            lines.extend(f'  {times}x {sql}' for sql , times in duplicates)
+        super().__init__('\n'.join(lines))
+
+
+
+
+@contextmanager
+def uncounted():
+    # the statements that reload a cache of the process (rates.py): whichever request finds it expired runs
+    # them, they are not the cost of its action
+    _uncounted.active = True
+    try:
+        yield
+    finally:
+        _uncounted.active = False
+
+
+
+
+class QueryCounter:
+    # execute wrapper counting the statements that touch data. Savepoints are left out: they depend on
+    # whether the request runs inside an outer transaction (as in the tests) and not on the code.
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self , execute , sql , params , many , context):
+        if(not getattr(_uncounted , 'active' , False) and not sql.lstrip().upper().startswith(TRANSACTION_CONTROL)):
+            self.statements.append(sql)
+        return execute(sql , params , many , context)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def duplicates(self):
+        # same SQL with different parameters, most repeated first
+        return [(sql , times) for sql , times in Counter(self.statements).most_common() if(times > 1)]
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self , *exc_info):
+        return self.stack.__exit__(*exc_info)
+
+
+
+
+class QueryBudgetMixin:
+    query_budget = {} # {action: max queries}, None for actions whose queries grow with the request body
+
+    def dispatch(self , request , *args , **kwargs):
+        if(not getattr(settings , 'QUERY_BUDGET_ENFORCED' , False)):
+            return super().dispatch(request , *args , **kwargs)
+
+        with QueryCounter() as counter:
+            response = super().dispatch(request , *args , **kwargs)
+
+        action = getattr(self , 'action' , None)
+        if(action is None or action == 'metadata'):
+            return response
+        if(action not in self.query_budget):
+            raise ImproperlyConfigured(f'{type(self).__name__}.{action} declares no query budget.')
+        budget = self.query_budget[action]
+        if(budget is not None and counter.count > budget):
+            raise QueryBudgetExceeded(f'{type(self).__name__}.{action}' , budget , counter)
+        return response
+
+
+
+
+
+class WriteOnRead(Exception):
+    pass
+
+
+
+
+class ReadOnlyGuard:
+    # execute wrapper refusing the statements that write, before they run
+
+    def __init__(self , view , method):
+        self.view = view
+        self.method = method
+
+    def __call__(self , execute , sql , params , many , context):
+        if(sql.lstrip().upper().startswith(WRITE_STATEMENTS)):
+            raise WriteOnRead(f'{self.view} wrote during a {self.method} request: {sql}')
+        return execute(sql , params , many , context)
+
+
+
+
+class ReadOnlyGuardMixin:
+    # With READ_ONLY_GUARD on (debug mode and the tests), safe requests may not write: they are served by replicas
+    # and caches, and the ETags assume that reading leaves the data version alone.
+
+    def dispatch(self , request , *args , **kwargs):
+        if(not getattr(settings , 'READ_ONLY_GUARD' , False) or request.method not in SAFE_METHODS):
+            return super().dispatch(request , *args , **kwargs)
+
+        guard = ReadOnlyGuard(type(self).__name__ , request.method)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(guard))
+            return super().dispatch(request , *args , **kwargs)
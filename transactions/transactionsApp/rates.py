@@ -0,0 +1,207 @@
+from .models import *
+from .billing import chunks
+from .querybudget import uncounted
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count , Max
+from decimal import InvalidOperation
+from datetime import date
+from bisect import bisect_right
+from xml.etree.ElementTree import iterparse
+import threading
+import time
+import csv
+
+
+
+# Exchange rates by day. The ExchangeRate table holds the ECB reference rates (units of a currency per euro),
+# loaded from the ECB XML or CSV files by the load_rates command. Conversions read them from the RateCache of the
+# process: every rate in memory, per currency the days and the rates in two sorted lists, so the rate of a day is
+# one bisection. Every EXCHANGE_RATES['TTL'] seconds the cache checks the number of rates and the time of the last
+# load (one aggregate on an index) and reloads the table only if they moved, so the rates loaded by another
+# process are used within TTL.
+# The rate of a day is the last one published on or before it (there are none on weekends and holidays), days
+# before the first rate use the first one and currencies without rates the static Currency_rate.currency_rates.
+
+DEFAULTS = {'TTL': 300}
+DEFAULT_CHUNK_SIZE = 1000
+CURRENCIES = {code for code , label in Currency.currency if(code != 'EUR')}
+STATIC_VERSION = 'static' # rates version while the table is empty
+FILE_EXTENSIONS = {'xml': 'xml' , 'csv': 'csv'}
+
+_cache = None
+_lock = threading.Lock()
+
+
+
+
+class RateFileError(Exception):
+    pass
+
+
+
+
+def rates_settings():
+    return {**DEFAULTS , **getattr(settings , 'EXCHANGE_RATES' , {})}
+
+
+
+
+def rate_cache():
+    global _cache
+    with _lock:
+        if(_cache is None):
+            _cache = RateCache(rates_settings()['TTL'])
+        return _cache
+
+
+
+
+class RateCache:
+
+    def __init__(self , ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.table = ({} , {} , STATIC_VERSION) # currency -> days , currency -> rates , version
+
+
+    def load(self):
+        with uncounted():
+            state = ExchangeRate.objects.aggregate(count=Count('id') , updated=Max('updated_at'))
+            version = f"{state['count']}-{state['updated'].timestamp():.6f}" if(state['count']) else STATIC_VERSION
+            if(version != self.table[2]):
+                rows = ExchangeRate.objects.order_by('currency' , 'day').values_list('currency' , 'day' , 'rate')
+                days , rates = {} , {}
+                for currency , day , rate in rows:
+                    days.setdefault(currency , []).append(day)
+                    rates.setdefault(currency , []).append(rate)
+                # one assignment, the threads converting meanwhile read either the old or the new table
+                self.table = (days , rates , version)
+        self.loaded_at = time.monotonic()
+
+
+    def current(self):
+        if(self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl):
+            with self.lock:
+                if(self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl):
+                    self.load()
+        return self.table
+
+
+    def expire(self):
+        self.loaded_at = None
+
+
+    @property
+    def version(self):
+        # part of the analytics cache keys (caching.py): results converted at other rates are not reused
+        return self.current()[2]
+
+
+    def rate(self , currency , on=None):
+        days , rates , version = self.current()
+        if(currency not in days):
+            return Currency_rate.currency_rates[currency]
+        if(on is None):
+            return rates[currency][-1]
+        return rates[currency][max(bisect_right(days[currency] , on) - 1 , 0)]
+
+
+
+
+
+
+def ecb_xml_rates(file):
+    # yields (day, currency, rate) of the ECB XML (eurofxref-daily.xml, eurofxref-hist.xml), one day at a time:
+    # <Cube time="2024-01-02"><Cube currency="USD" rate="1.0956"/>...</Cube>
+    day = None
+    for event , element in iterparse(file , events=('start' , 'end')):
+        if(not element.tag.endswith('Cube')):
+            continue
+        if(event == 'start'):
+            if(element.get('time')):
+                day = element.get('time')
+            elif(element.get('currency') and day):
+                yield day , element.get('currency') , element.get('rate')
+        elif(element.get('time')):
+            element.clear() # the rates of a day are not kept once read
+
+
+
+
+def csv_rates(file):
+    # yields (day, currency, rate) of the ECB CSV (eurofxref-hist.csv: a Date column, then one column per currency,
+    # N/A where there is no rate) or of a CSV with date, currency and rate columns, one rate per line
+    lines = (line.decode('utf-8-sig' , errors='replace') for line in file)
+    reader = csv.reader(lines)
+    header = [name.strip() for name in next(reader , [])]
+    names = [name.lower() for name in header]
+    if('date' not in names):
+        raise RateFileError('⚠️ The header has no date column.')
+
+    if('currency' in names and 'rate' in names):
+        positions = [names.index(name) for name in ('date' , 'currency' , 'rate')]
+        for values in reader:
+            if(len(values) > max(positions)):
+                yield tuple(values[position].strip() for position in positions)
+        return
+
+    day_position = names.index('date')
+    for values in reader:
+        for position , value in enumerate(values):
+            if(position != day_position and position < len(header) and header[position]):
+                yield values[day_position].strip() , header[position].upper() , value.strip()
+
+
+
+PARSERS = {'xml': ecb_xml_rates , 'csv': csv_rates}
+
+
+
+
+def parse_rate(day , currency , rate):
+    # (currency, day, rate) or None for the currencies that are not supported and the missing or invalid rates
+    if(currency not in CURRENCIES):
+        return None
+    try:
+        rate = Decimal(rate)
+        day = date.fromisoformat(day)
+    except (InvalidOperation , TypeError , ValueError):
+        return None
+    if(not rate.is_finite() or rate <= 0):
+        return None
+    return currency , day , rate.quantize(Decimal('1e-8'))
+
+
+
+
+def load_rates(rows , chunk_size=DEFAULT_CHUNK_SIZE , progress=None):
+    # Stores the (day, currency, rate) rows of a parser, chunk_size at a time: one INSERT per chunk, the rates
+    # already stored for a currency and day are replaced. The cache of this process reloads at the next conversion.
+    summary = {'rates': 0 , 'skipped': 0 , 'first': None , 'last': None}
+    updated_at = timezone.now()
+    # the unique constraint is the conflict target, MySQL takes it without naming it
+    conflict = {'unique_fields': ['currency' , 'day']} if(connection.features.supports_update_conflicts_with_target) else {}
+
+    for chunk in chunks(rows , chunk_size):
+        parsed = {}
+        for row in chunk:
+            rate = parse_rate(*row)
+            if(rate is None):
+                summary['skipped'] += 1
+                continue
+            parsed[rate[:2]] = rate[2] # one row per currency and day, the last one counts
+        ExchangeRate.objects.bulk_create([ExchangeRate(currency=currency , day=day , rate=rate , updated_at=updated_at)
+                                          for (currency , day) , rate in parsed.items()] ,
+                                         update_conflicts=True , update_fields=['rate' , 'updated_at'] , **conflict)
+
+        summary['rates'] += len(parsed)
+        for currency , day in parsed:
+            summary['first'] = min(summary['first'] or day , day)
+            summary['last'] = max(summary['last'] or day , day)
+        if(progress):
+            progress(summary)
+
+    rate_cache().expire()
+    return summary
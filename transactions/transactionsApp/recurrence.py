@@ -0,0 +1,100 @@
+from datetime import date , timedelta
+from calendar import monthrange
+
+
+
+PERIOD_DAYS = {'Daily': 1 , 'Weekly': 7}
+PERIOD_MONTHS = {'Monthly': 1 , 'Yearly': 12}
+
+
+
+
+def occurrence(anchor , index , recurrence):
+    # date of the index-th payment counted from anchor (anchor itself is index 0). Months and years keep the day
+    # of the anchor, clipped to the end of shorter months (Jan 31 -> Feb 28 -> Mar 31), as relativedelta does.
+    if(recurrence in PERIOD_MONTHS):
+        year , month = divmod(anchor.year * 12 + anchor.month - 1 + index * PERIOD_MONTHS[recurrence] , 12)
+        return date(year , month + 1 , min(anchor.day , monthrange(year , month + 1)[1]))
+    return anchor + timedelta(days=index * PERIOD_DAYS.get(recurrence , 1))
+
+
+
+
+def periods_between(anchor , day , recurrence):
+    # number of whole periods from anchor until day, i.e. the index of the last occurrence <= day
+    if(recurrence == 'Weekly'):
+        return (day - anchor).days // 7
+    if(recurrence == 'Monthly'):
+        months = (day.year - anchor.year) * 12 + day.month - anchor.month
+        return months - 1 if(occurrence(anchor , months , recurrence) > day) else months
+    if(recurrence == 'Yearly'):
+        years = day.year - anchor.year
+        return years - 1 if(occurrence(anchor , years , recurrence) > day) else years
+    return (day - anchor).days
+
+
+
+
+def due_occurrences(start , next_paid , end , today , recurrence):
+    # Counts the payments that are due on or before today, without stepping through the calendar.
+    # A subscription is never charged on its end date. Returns (count, anchor, index of next_paid), so the
+    # date after paying n of them is occurrence(anchor, index + n, recurrence).
+    if(next_paid is None or next_paid > today):
+        return 0 , next_paid , 0
+
+    last_day = today if(end is None) else min(today , end - timedelta(days=1))
+    if(last_day < next_paid):
+        return 0 , next_paid , 0
+
+    anchor , first = anchor_of(start , next_paid , recurrence)
+    last = periods_between(anchor , last_day , recurrence)
+    return last - first + 1 , anchor , first
+
+
+
+
+def anchor_of(start , next_paid , recurrence):
+    # payments are counted from the start date, unless an older row has drifted away from it.
+    # Returns (anchor, index of next_paid).
+    anchor = start if(start and start <= next_paid) else next_paid
+    first = periods_between(anchor , next_paid , recurrence)
+    if(occurrence(anchor , first , recurrence) != next_paid):
+        return next_paid , 0
+    return anchor , first
+
+
+
+
+def monthly_occurrences(start , next_paid , end , horizon , recurrence):
+    # Number of payments per calendar month from next_paid up to horizon, never on the end date, as
+    # {(year, month): count}. Monthly and yearly payments fall in one month each, daily and weekly ones are
+    # counted per month from the day numbers, nothing steps through the days.
+    last_day = horizon if(end is None) else min(horizon , end - timedelta(days=1))
+    if(next_paid is None or last_day < next_paid):
+        return {}
+    anchor , first = anchor_of(start , next_paid , recurrence)
+    payments = periods_between(anchor , last_day , recurrence) - first + 1
+    if(payments <= 0):
+        return {}
+
+    month = next_paid.year * 12 + next_paid.month - 1
+    if(recurrence in PERIOD_MONTHS):
+        step = PERIOD_MONTHS[recurrence]
+        return {(year , index + 1): 1 for year , index in (divmod(month + payment * step , 12) for payment in range(payments))}
+
+    period = PERIOD_DAYS.get(recurrence , 1)
+    origin = next_paid.toordinal()
+    last = origin + (payments - 1) * period
+    counts = {}
+    while(True):
+        year , index = divmod(month , 12)
+        first_day = max(origin , date(year , index + 1 , 1).toordinal())
+        next_month = divmod(month + 1 , 12)
+        last_of_month = min(last , date(next_month[0] , next_month[1] + 1 , 1).toordinal() - 1)
+        if(first_day > last):
+            return counts
+        # payments at origin + k * period within [first_day, last_of_month]
+        count = (last_of_month - origin) // period - (first_day - origin + period - 1) // period + 1
+        if(count > 0):
+            counts[(year , index + 1)] = count
+        month += 1
@@ -0,0 +1,127 @@
+from .models import *
+from django.db import transaction as db_transaction , IntegrityError
+from django.db.models import F , Sum , Count , Value , OuterRef , Subquery , Exists
+from django.db.models.functions import Coalesce
+
+
+
+# Keeps DailyRollup in step with the money that moves. Callers run these inside the same database
+# transaction as the write they describe, so a rollup never counts a transaction that was rolled back.
+
+KEY_FIELDS = ('user_id' , 'day' , 'currency' , 'type' , 'payment_method' , 'card_number' , 'recurring' , 'billed')
+
+
+
+def transaction_key(tr):
+    return (tr.user_id , tr.transaction_date , tr.currency , tr.type , tr.payment_method , tr.card_number or '' , bool(tr.recurring) , False)
+
+
+
+
+def add(key , total , count):
+    key = dict(zip(KEY_FIELDS , key))
+    if(DailyRollup.objects.filter(**key).update(total=F('total') + total , count=F('count') + count)):
+        return
+    try:
+        with db_transaction.atomic():
+            DailyRollup.objects.create(**key , total=total , count=count)
+    except IntegrityError:
+        # created by a concurrent request in the meantime
+        DailyRollup.objects.filter(**key).update(total=F('total') + total , count=F('count') + count)
+
+
+
+
+def record(tr):
+    add(transaction_key(tr) , tr.amount , 1)
+
+
+
+
+def unrecord(tr):
+    # only ever decrements: the user may be in the middle of a cascading delete
+    DailyRollup.objects.filter(**dict(zip(KEY_FIELDS , transaction_key(tr)))).update(total=F('total') - tr.amount , count=F('count') - 1)
+
+
+
+
+def unrecord_category(category):
+    # Takes the transactions of a category off their rollups, before the category deletes them. The sums per rollup
+    # key are computed by the database inside one conditional UPDATE of the rollups they touch, then the rollups
+    # left without transactions are deleted: two statements whatever the size of the category or of the history.
+    transactions = (Transaction.objects.filter(category=category)
+                                       .annotate(rollup_card=Coalesce('card_number' , Value('')))
+                                       .filter(user_id=OuterRef('user_id') , transaction_date=OuterRef('day') , currency=OuterRef('currency') ,
+                                               type=OuterRef('type') , payment_method=OuterRef('payment_method') ,
+                                               rollup_card=OuterRef('card_number') , recurring=OuterRef('recurring')))
+    sums = transactions.order_by().values('category_id').annotate(total=Sum('amount') , count=Count('id'))
+    rows = DailyRollup.objects.filter(Exists(transactions) , user_id=category.user_id , billed=False)
+    rows.update(total=F('total') - Subquery(sums.values('total')) , count=F('count') - Subquery(sums.values('count')))
+    DailyRollup.objects.filter(user_id=category.user_id , billed=False , count__lte=0).delete()
+
+
+
+
+def add_many(entries):
+    # entries: {key: (total, count)}. Used by the batch paths, one SELECT plus one bulk UPDATE and one bulk INSERT.
+    if(not entries):
+        return
+    user_ids = set(key[0] for key in entries)
+    days = set(key[1] for key in entries)
+    existing = {}
+    for rollup in DailyRollup.objects.select_for_update().filter(user_id__in=user_ids , day__in=days):
+        existing[tuple(getattr(rollup , field) for field in KEY_FIELDS)] = rollup
+
+    changed = []
+    created = []
+    for key , (total , count) in entries.items():
+        rollup = existing.get(key)
+        if(rollup):
+            rollup.total += total
+            rollup.count += count
+            changed.append(rollup)
+        else:
+            created.append(DailyRollup(**dict(zip(KEY_FIELDS , key)) , total=total , count=count))
+    DailyRollup.objects.bulk_update(changed , ['total' , 'count'] , batch_size=1000)
+    DailyRollup.objects.bulk_create(created , batch_size=1000)
+
+
+
+
+def rebuild(user_ids=None , chunk_size=200):
+    # Recomputes the rollups of Transaction rows from scratch. Billed subscription payments have no rows to
+    # recompute from, so they are left untouched.
+    users = CustomUser.objects.order_by('id').values_list('id' , flat=True)
+    if(user_ids is not None):
+        users = users.filter(id__in=user_ids)
+
+    rows = 0
+    chunk = []
+    for user_id in users.iterator():
+        chunk.append(user_id)
+        if(len(chunk) >= chunk_size):
+            rows += rebuild_users(chunk)
+            chunk = []
+    if(chunk):
+        rows += rebuild_users(chunk)
+    return rows
+
+
+
+
+def rebuild_users(user_ids):
+    with db_transaction.atomic():
+        DailyRollup.objects.filter(user_id__in=user_ids , billed=False).delete()
+        groups = (Transaction.objects.filter(user_id__in=user_ids)
+                                     .values('user_id' , 'transaction_date' , 'currency' , 'type' , 'payment_method' , 'card_number' , 'recurring')
+                                     .annotate(total=Sum('amount') , count=Count('id'))
+                                     .order_by())
+        entries = {}
+        for group in groups:
+            key = (group['user_id'] , group['transaction_date'] , group['currency'] , group['type'] , group['payment_method'] ,
+                   group['card_number'] or '' , group['recurring'] , False)
+            total , count = entries.get(key , (0 , 0))
+            entries[key] = (total + group['total'] , count + group['count'])
+        rollups = [DailyRollup(**dict(zip(KEY_FIELDS , key)) , total=total , count=count) for key , (total , count) in entries.items()]
+        DailyRollup.objects.bulk_create(rollups , batch_size=1000)
+    return len(rollups)
@@ -0,0 +1,89 @@
+from .models import *
+from .rollups import rebuild
+from .ledger import openings
+from datetime import timedelta
+import random
+
+
+
+SEED_PREFIX = 'seed-'
+
+
+
+def seed(users=10 , cards_per_user=3 , transactions_per_user=1000 , days=730 , recurring_share=0.1 , batch_size=5000):
+    # Fills the database with synthetic users, cards, categories and transactions using bulk_create only.
+    # Seeded usernames start with SEED_PREFIX, so they can be removed with clear_seed().
+    currencies = [code for code , label in Currency.currency]
+    today = timezone.now().date()
+    start = CustomUser.objects.filter(username__startswith=SEED_PREFIX).count()
+
+    new_users = [CustomUser(username=f'{SEED_PREFIX}{start + i}' , cash=random.randint(0 , 100000) ,
+                            currency=random.choice(currencies)) for i in range(users)]
+    for user in new_users:
+        user.initial_currency = user.currency
+        user.set_unusable_password()
+    CustomUser.objects.bulk_create(new_users , batch_size=batch_size)
+    new_users = list(CustomUser.objects.filter(username__in=[user.username for user in new_users]))
+    DataVersion.objects.bulk_create([DataVersion(user=user) for user in new_users] , batch_size=batch_size)
+
+    Category.objects.bulk_create([Category(user=user , title=title) for user in new_users
+                                  for title in ['Food' , 'Clothing' , 'Transportation' , 'Household bills' , 'Health' , 'Entertainment' , 'debt']] ,
+                                 batch_size=batch_size)
+    categories = {}
+    for category in Category.objects.filter(user__in=new_users):
+        categories.setdefault(category.user_id , []).append(category)
+
+    numbers = iter(Card_number.allocate(users * cards_per_user))
+    cards = []
+    for user in new_users:
+        for _ in range(cards_per_user):
+            currency = random.choice(currencies)
+            cards.append(Card(user=user , card_type=random.choice(Transaction_methods.methods)[0] , card_number=next(numbers) ,
+                              cvv=''.join([str(random.randint(0,9)) for _ in range(3)]) ,
+                              expiration_date=f'{random.randint(1,12):02d}/{str(today.year + random.randint(1,7))[2:]}' ,
+                              balance=random.randint(0 , 100000) , currency=currency , initial_currency=currency))
+    Card.objects.bulk_create(cards , batch_size=batch_size)
+    openings(cards=cards , users=new_users)
+    user_cards = {}
+    for card in cards:
+        user_cards.setdefault(card.user_id , []).append(card)
+
+    batch = []
+    count = 0
+    for user in new_users:
+        for _ in range(transactions_per_user):
+            card = random.choice(user_cards[user.id]) if(user_cards.get(user.id) and random.random() < 0.6) else None
+            recurring = card is not None and random.random() < recurring_share
+            transaction = Transaction(user=user , category=random.choice(categories[user.id]) ,
+                                      payment_method='Card' if(card) else 'Cash' ,
+                                      amount=random.randint(1 , 500000) / 100 , currency=random.choice(currencies) ,
+                                      type=random.choice(['Income' , 'Expense']) ,
+                                      transaction_date=today - timedelta(days=random.randint(0 , days)) ,
+                                      recurring=recurring , recurrence_choices='')
+            if(card):
+                transaction.card_number = card.card_number
+                transaction.cvv = card.cvv
+                transaction.expiration_date = card.expiration_date
+            if(recurring):
+                transaction.recurrence_choices = random.choice(['Daily' , 'Weekly' , 'Monthly' , 'Yearly'])
+                transaction.subscription_start_date = transaction.transaction_date
+                transaction.subscription_end_date = transaction.transaction_date + timedelta(days=365 * 2)
+                transaction.subscription_next_paid_date = today + timedelta(days=random.randint(-30 , 30))
+            batch.append(transaction)
+
+            if(len(batch) >= batch_size):
+                Transaction.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+    if(batch):
+        Transaction.objects.bulk_create(batch)
+        count += len(batch)
+
+    rebuild([user.id for user in new_users])
+    return {'users': len(new_users) , 'cards': len(cards) , 'transactions': count}
+
+
+
+
+def clear_seed():
+    return CustomUser.objects.filter(username__startswith=SEED_PREFIX).delete()
@@ -1,11 +1,19 @@
 from .models import *
+from . import rollups
+from .context import UserContext
+from .profiling import ProfiledSerializerMixin , serializer_timer
+from .balances import credit_card , debit_card , credit_cash , debit_cash , add_debt , pay_debt , to_cents
+from . import ledger
+from .projection import MAX_MONTHS
+from .statements import DEFAULT_CATEGORY , DEFAULT_CHUNK_SIZE , MAX_CHUNK_SIZE , FILE_EXTENSIONS
 from rest_framework import serializers
-from datetime import date
+from django.db import transaction as db_transaction
+from datetime import date , timedelta
 from django.utils import timezone
 
 
 
-class CustomUserSerializer(serializers.ModelSerializer):
+class CustomUserSerializer(ProfiledSerializerMixin , serializers.ModelSerializer):
     password = serializers.CharField(write_only=True , required=False)
 
     class Meta():
@@ -41,14 +49,14 @@ class CustomUserSerializer(serializers.ModelSerializer):
         user.set_password(password)
         user.save()
         return user
-    
 
 
-    def to_representation(self , instance):
-        rep = super().to_representation(instance)
-        if(instance.debt is None):
-            CustomUser.objects.filter(debt__isnull=True).update(debt=0.00)
-        return rep
+    def update(self , instance , validated_data):
+        cash , currency = instance.cash , instance.currency
+        with db_transaction.atomic():
+            user = super().update(instance , validated_data)
+            ledger.record_change(user.pk , ledger.CASH , cash , currency , user.cash , user.currency , validated_data.get('convert_currency'))
+        return user
     
 
 
@@ -61,21 +69,22 @@ class CustomUserSerializer(serializers.ModelSerializer):
 
 
 
-class AnalyticsSerializer(serializers.ModelSerializer):
+class AnalyticsSerializer(ProfiledSerializerMixin , serializers.ModelSerializer):
     choose_card = serializers.ChoiceField(choices=[])
 
     class Meta:
         model = Analytics
         fields = ['all_assets' , 'cash' , 'card' , 'choose_card' , 'income_transactions' , 'expense_transactions' , 'subscriptions' ,
-                  'currency' , 'compute_statistics_from' , 'compute_statistics_to']
+                  'currency' , 'compute_statistics_from' , 'compute_statistics_to' , 'historical_rates']
 
 
     def __init__(self , *args , **kwargs):
         user_id = kwargs.pop('user_id', None)
         super().__init__(*args , **kwargs)
         
-        if user_id:
-            cards = Card.objects.filter(user_id=user_id)
+        user_context = self.context.get('user_context')
+        if(user_context or user_id):
+            cards = user_context.cards if(user_context) else Card.objects.filter(user_id=user_id)
             self.fields['choose_card'].choices = [(f'{card.card_type} - {card.card_number}' , f'{card.card_type} - {card.card_number}') for card in cards]
 
 
@@ -114,7 +123,35 @@ class AnalyticsSerializer(serializers.ModelSerializer):
 
 
 
-class CardSerializer(serializers.ModelSerializer):
+class AnalyticsSeriesSerializer(ProfiledSerializerMixin , serializers.Serializer):
+    MAX_DAILY_BUCKETS = 366
+
+    bucket = serializers.ChoiceField(choices=['day' , 'week' , 'month'] , default='month')
+    currency = serializers.ChoiceField(choices=Currency.currency , default='EUR')
+    payment_method = serializers.ChoiceField(choices=['Cash' , 'Card'] , required=False)
+    compute_statistics_from = serializers.DateField()
+    compute_statistics_to = serializers.DateField()
+    historical_rates = serializers.BooleanField(default=False , help_text='Convert every transaction at the rates of its own day.')
+
+
+    def validate(self , data):
+        if(data.get('compute_statistics_to') < data.get('compute_statistics_from')):
+            raise serializers.ValidationError('⚠️ The end date must strictly follow the start date.')
+
+        if(data.get('bucket') == 'day' and (data.get('compute_statistics_to') - data.get('compute_statistics_from')).days >= self.MAX_DAILY_BUCKETS):
+            raise serializers.ValidationError(f'⚠️ Daily series are limited to {self.MAX_DAILY_BUCKETS} days, use weekly or monthly buckets.')
+
+        return data
+
+
+
+
+
+
+
+
+
+class CardSerializer(ProfiledSerializerMixin , serializers.ModelSerializer):
     user = serializers.SerializerMethodField()
 
     class Meta:
@@ -141,13 +178,105 @@ class CardSerializer(serializers.ModelSerializer):
         return data
 
 
+    def update(self , instance , validated_data):
+        balance , currency = instance.balance , instance.currency
+        with db_transaction.atomic():
+            card = super().update(instance , validated_data)
+            ledger.record_change(card.user_id , card.pk , balance , currency , card.balance , card.currency , validated_data.get('convert_currency'))
+        return card
+
+
+
+
+
+
+
+
+class CardIssueSerializer(ProfiledSerializerMixin , serializers.Serializer):
+    MAX_CARDS = 100000
+
+    count = serializers.IntegerField(min_value=1)
+    card_type = serializers.ChoiceField(choices=Transaction_methods.methods , default='Prepaid Card')
+    balance = serializers.DecimalField(max_digits=12 , decimal_places=2 , min_value=Decimal('0') , default=Decimal('0'))
+    currency = serializers.ChoiceField(choices=Currency.currency , default='EUR')
+    users = serializers.ListField(child=serializers.IntegerField() , required=False , allow_empty=False ,
+                                  help_text='Issue the cards to these users instead of the user of the URL.')
+
+
+    def validate(self , data):
+        users = data.get('users') or [self.context.get('user_id')]
+        users = list(dict.fromkeys(users))
+        found = set(CustomUser.objects.filter(id__in=users).values_list('id' , flat=True))
+        missing = [user for user in users if(user not in found)]
+        if(missing):
+            raise serializers.ValidationError(f'⚠️ Users not found: {missing}')
+
+        if(data.get('count') * len(users) > self.MAX_CARDS):
+            raise serializers.ValidationError(f'⚠️ At most {self.MAX_CARDS} cards can be issued at once.')
+
+        data['users'] = users
+        return data
+
+
 
 
 
 
 
 
-class CategorySerializer(serializers.ModelSerializer):
+
+class AnalyticsProjectionSerializer(ProfiledSerializerMixin , serializers.Serializer):
+    months = serializers.IntegerField(min_value=1 , max_value=MAX_MONTHS , default=12 , help_text='Months to forecast, the current one included.')
+    currency = serializers.ChoiceField(choices=Currency.currency , default='EUR')
+
+
+
+
+
+
+
+
+
+class BalanceHistorySerializer(ProfiledSerializerMixin , serializers.Serializer):
+    MAX_DAYS = 366
+
+    on = serializers.DateField(required=False , help_text='The balance at the end of this day only.')
+    date_from = serializers.DateField(required=False , help_text='Defaults to 30 days before date_to.')
+    date_to = serializers.DateField(required=False , help_text='Defaults to today.')
+
+
+    def validate(self , data):
+        if(data.get('on')):
+            data['date_from'] = data['date_to'] = data.get('on')
+        data.setdefault('date_to' , timezone.localdate())
+        data.setdefault('date_from' , data.get('date_to') - timedelta(days=30))
+
+        if(data.get('date_to') < data.get('date_from')):
+            raise serializers.ValidationError('⚠️ The end date must strictly follow the start date.')
+
+        if((data.get('date_to') - data.get('date_from')).days >= self.MAX_DAYS):
+            raise serializers.ValidationError(f'⚠️ Balance histories are limited to {self.MAX_DAYS} days.')
+
+        return data
+
+
+
+
+class BalanceSerializer(serializers.Serializer):
+    # one day of ledger.balance_history
+    day = serializers.DateField()
+    balance = serializers.DecimalField(max_digits=14 , decimal_places=2)
+    currency = serializers.CharField(allow_null=True)
+
+
+
+
+
+
+
+
+
+class CategorySerializer(ProfiledSerializerMixin , serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id' , 'title']
@@ -155,7 +284,12 @@ class CategorySerializer(serializers.ModelSerializer):
 
     def validate(self, data):
         user = self.context.get('user')
-        if Category.objects.filter(user=user, title__iexact=data.get('title')).exists():
+        user_context = self.context.get('user_context')
+        if(user_context):
+            exists = user_context.has_category(data.get('title'))
+        else:
+            exists = Category.objects.filter(user=user, title__iexact=data.get('title')).exists()
+        if exists:
             raise serializers.ValidationError(f"⚠️ This category already exists for this user.")
 
         return data
@@ -164,7 +298,28 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class CategoryInsightsSerializer(ProfiledSerializerMixin , serializers.Serializer):
+    compute_statistics_from = serializers.DateField(required=False , help_text='Defaults to the first day of the month.')
+    compute_statistics_to = serializers.DateField(required=False , help_text='Defaults to today.')
+    currency = serializers.ChoiceField(choices=Currency.currency , required=False , help_text="Defaults to the user's currency.")
+    type = serializers.ChoiceField(choices=['Income' , 'Expense'] , default='Expense')
+    limit = serializers.IntegerField(min_value=1 , required=False)
+
+
+    def validate(self , data):
+        data.setdefault('compute_statistics_to' , timezone.now().date())
+        data.setdefault('compute_statistics_from' , data.get('compute_statistics_to').replace(day=1))
+
+        if(data.get('compute_statistics_to') < data.get('compute_statistics_from')):
+            raise serializers.ValidationError('⚠️ The end date must strictly follow the start date.')
+
+        return data
+
+
+
+
+
+class TransactionSerializer(ProfiledSerializerMixin , serializers.ModelSerializer):
     card_number = serializers.CharField(required=False)
     cvv = serializers.CharField(required=False)
     expiration_date = serializers.CharField(required=False)
@@ -278,6 +433,16 @@ class TransactionSerializer(serializers.ModelSerializer):
 
 
 
+    def save_transaction(self , validated_data):
+        # joins the atomic block of the balance update, if there is one
+        with db_transaction.atomic(savepoint=False):
+            transaction = super().create(validated_data)
+            rollups.record(transaction)
+        return transaction
+
+
+
+
     def create(self , validated_data):
         payment_method = validated_data.get('payment_method')
         type = validated_data.get('type')
@@ -288,14 +453,13 @@ class TransactionSerializer(serializers.ModelSerializer):
         subscription_start_date = validated_data.get('subscription_start_date')
         subscription_end_date = validated_data.get('subscription_end_date')
         category = validated_data.get('category')
+        user_context = self.context.get('user_context') or UserContext(user.pk , user=user)
 
         # card usage
         if(payment_method == 'Card'):
             recurrence_choices = validated_data.get('recurrence_choices')
 
-            card = Card.objects.filter(user=user , card_number=validated_data.get('card_number') , 
-                                    cvv=validated_data.get('cvv') , 
-                                    expiration_date=validated_data.get('expiration_date')).first()
+            card = user_context.card(validated_data.get('card_number') , validated_data.get('cvv') , validated_data.get('expiration_date'))
             
             # card not found
             if(not card):
@@ -307,14 +471,14 @@ class TransactionSerializer(serializers.ModelSerializer):
                     if(amount > CREDIT_LIMIT):
                         raise serializers.ValidationError(f"❌ Transaction declined. Credit limit of {CREDIT_LIMIT} {card.currency} exceeded.")
 
+            card_amount = amount if(card.currency == currency) else Currency_rate.convertion(amount , currency , card.currency)
+
             if(type == 'Income'):
                 if(not recurring):
-                    card.balance += (amount if(card.currency == currency) else Currency_rate.convertion(amount , currency , card.currency))
-                    card.save()
-                    transaction = super().create(validated_data)
-                    transaction.message = '✅ Transaction completed successfully.'
-                    transaction.save()
-                    return transaction
+                    with db_transaction.atomic():
+                        credit_card(card , card_amount)
+                        validated_data['message'] = '✅ Transaction completed successfully.'
+                        return self.save_transaction(validated_data)
                 
                 else:
                     choice = 'day'
@@ -325,47 +489,38 @@ class TransactionSerializer(serializers.ModelSerializer):
                     elif(recurrence_choices == 'Yearly'):
                         choice = 'year'
                     
-                    transaction = super().create(validated_data)
-                    transaction.subscription_next_paid_date = subscription_start_date
-                    transaction.message = f'✅ Subscription period: {subscription_start_date} / {subscription_end_date}. Every {choice} {amount} {card.currency} will be credited to the user\'s card.'
-                    transaction.save()
-                    return transaction
+                    validated_data['subscription_next_paid_date'] = subscription_start_date
+                    validated_data['message'] = f'✅ Subscription period: {subscription_start_date} / {subscription_end_date}. Every {choice} {amount} {card.currency} will be credited to the user\'s card.'
+                    return self.save_transaction(validated_data)
 
             elif(type == 'Expense'):
-                debt_category = Category.objects.filter(user=user , title__iexact='debt').first()
+                debt_category = user_context.debt_category
                 if(debt_category and category == debt_category):
-                    
-                    if(card.balance < amount):
-                        raise serializers.ValidationError(f'❌ Transaction declined: Card balance is too low.')
-
-                    debt = user.debt
-                    user.debt -= (amount if(card.currency == currency) else Currency_rate.convertion(amount , currency , card.currency))
-                    if(user.debt < 0):
-                        raise serializers.ValidationError(f'⚠️ Attention! Your amount exceeds the debt you must pay. Debt is {debt} {user.currency}')
-                    user.save()
-                    transaction = super().create(validated_data)
-                    transaction.message = f'✅ Transaction completed successfully. Debt is {user.debt} {card.currency}.'
-                    transaction.save()
-                    return transaction
+                    with db_transaction.atomic():
+                        # lock the card, so its balance cannot drop below the amount until the debt is paid
+                        if(not Card.objects.select_for_update().filter(pk=card.pk , balance__gte=to_cents(card_amount)).exists()):
+                            raise serializers.ValidationError(f'❌ Transaction declined: Card balance is too low.')
+
+                        debt = user.debt
+                        if(not pay_debt(user , card_amount)):
+                            raise serializers.ValidationError(f'⚠️ Attention! Your amount exceeds the debt you must pay. Debt is {debt} {user.currency}')
+                        validated_data['message'] = f'✅ Transaction completed successfully. Debt is {user.debt} {card.currency}.'
+                        return self.save_transaction(validated_data)
                 
                 else:
                     if(user.debt > 0):
                         # if a card of the user has balance lower than his/her debt, then just abort all his/her expense transactions
-                        if(Card.objects.filter(user=user , balance__gte=user.debt).exists()):
+                        if(user_context.card_covering(user.debt)):
                             raise serializers.ValidationError('❌ New transactions cannot be processed until debt is cleared.')
 
                 if(not recurring):
-                    if(card.balance < amount):
-                        user.debt += (amount if(card.currency == currency) else Currency_rate.convertion(amount , currency , card.currency))
-                        user.save()
-                        raise serializers.ValidationError(f'❌ Transaction declined: Card balance is too low. A debt of {amount} {card.currency} has been imposed.')
-                    
-                    card.balance -= (amount if(card.currency == currency) else Currency_rate.convertion(amount , currency , card.currency))
-                    card.save()
-                    transaction = super().create(validated_data)
-                    transaction.message = '✅ Transaction completed successfully.'
-                    transaction.save()
-                    return transaction
+                    with db_transaction.atomic():
+                        if(debit_card(card , card_amount)):
+                            validated_data['message'] = '✅ Transaction completed successfully.'
+                            return self.save_transaction(validated_data)
+
+                    add_debt(user , card_amount)
+                    raise serializers.ValidationError(f'❌ Transaction declined: Card balance is too low. A debt of {amount} {card.currency} has been imposed.')
                 
                 elif(recurring):
                     choice = 'day'
@@ -376,11 +531,9 @@ class TransactionSerializer(serializers.ModelSerializer):
                     elif(recurrence_choices == 'Yearly'):
                         choice = 'year'
 
-                    transaction = super().create(validated_data)
-                    transaction.subscription_next_paid_date = subscription_start_date
-                    transaction.message = f'✅ Subscription period: {subscription_start_date} / {subscription_end_date}. Every {choice} {amount} {card.currency} will be credited from the user\'s card.'
-                    transaction.save()
-                    return transaction
+                    validated_data['subscription_next_paid_date'] = subscription_start_date
+                    validated_data['message'] = f'✅ Subscription period: {subscription_start_date} / {subscription_end_date}. Every {choice} {amount} {card.currency} will be credited from the user\'s card.'
+                    return self.save_transaction(validated_data)
                     
 
         # cash usage
@@ -392,48 +545,168 @@ class TransactionSerializer(serializers.ModelSerializer):
             validated_data['card_number'] = None
             validated_data['cvv'] = None
             validated_data['expiration_date'] = None
+            cash_amount = amount if(user.currency == currency) else Currency_rate.convertion(amount , currency , user.currency)
             
             if(type == 'Income'):
                 if(not recurring):
-                    user.cash += (amount if(user.currency == currency) else Currency_rate.convertion(amount , currency , user.currency))
-                    user.save()
-                    transaction = super().create(validated_data)
-                    transaction.message = '✅ Transaction completed successfully.'   
-                    transaction.save()
-                    return transaction
+                    with db_transaction.atomic():
+                        credit_cash(user , cash_amount)
+                        validated_data['message'] = '✅ Transaction completed successfully.'
+                        return self.save_transaction(validated_data)
                 
             elif(type == 'Expense'):
-                debt_category = Category.objects.filter(user=user , title__iexact='debt').first()
+                debt_category = user_context.debt_category
                 if(str(category) == str(debt_category.title)):
-                    if(user.cash < amount):
-                        raise serializers.ValidationError(f'❌ Transaction declined: Cash are too low.')
-
-                    debt = user.debt
-                    user.debt -= (amount if(user.currency == currency) else Currency_rate.convertion(amount , currency , user.currency))
-
-                    if(user.debt < 0):
-                        raise serializers.ValidationError(f'⚠️ Attention! Your amount exceeds the debt you must pay. Debt is {debt} {user.currency}')
-                    user.save()
-                    transaction = super().create(validated_data)
-                    transaction.message = f'✅ Transaction completed successfully. Debt is {user.debt} {user.currency}.'
-                    transaction.save()
-                    return transaction
+                    with db_transaction.atomic():
+                        debt = user.debt
+                        # the cash check and the debt payment happen under the same row lock
+                        if(not CustomUser.objects.select_for_update().filter(pk=user.pk , cash__gte=to_cents(cash_amount)).exists()):
+                            raise serializers.ValidationError(f'❌ Transaction declined: Cash are too low.')
+
+                        if(not pay_debt(user , cash_amount)):
+                            raise serializers.ValidationError(f'⚠️ Attention! Your amount exceeds the debt you must pay. Debt is {debt} {user.currency}')
+                        validated_data['message'] = f'✅ Transaction completed successfully. Debt is {user.debt} {user.currency}.'
+                        return self.save_transaction(validated_data)
                 
                 else:
                     if(user.debt > 0):
                         # if a card of the user has balance lower than his/her debt, then just abort all his/her expense transactions
-                        if(Card.objects.filter(user=user , balance__gte=user.debt).exists()):
+                        if(user_context.card_covering(user.debt)):
                             raise serializers.ValidationError('❌ New transactions cannot be processed until debt is cleared.')
                         
                 if(not recurring):
-                    if(user.cash < amount):
-                        user.debt += (amount if(user.currency == currency) else Currency_rate.convertion(amount , currency , user.currency))
-                        user.save()
-                        raise serializers.ValidationError(f'❌ Transaction declined. Cash are too low. A debt of {amount} {user.currency} has been imposed.')
-
-                    user.cash -= (amount if(user.currency == currency) else Currency_rate.convertion(amount , currency , user.currency))
-                    user.save()
-                    transaction = super().create(validated_data)
-                    transaction.message = '✅ Transaction completed successfully.'
-                    transaction.save()
-                    return transaction
+                    with db_transaction.atomic():
+                        if(debit_cash(user , cash_amount)):
+                            validated_data['message'] = '✅ Transaction completed successfully.'
+                            return self.save_transaction(validated_data)
+
+                    add_debt(user , cash_amount)
+                    raise serializers.ValidationError(f'❌ Transaction declined. Cash are too low. A debt of {amount} {user.currency} has been imposed.')
+
+
+
+
+
+
+
+
+class BulkTransactionItemSerializer(TransactionSerializer):
+    # the categories of a batch are resolved once by the ingestion code, not with one query per item
+    category = serializers.IntegerField()
+
+    class Meta(TransactionSerializer.Meta):
+        pass
+
+
+
+
+
+
+
+
+
+class TransactionRowSerializer:
+    # Read path of the transaction listings: builds the JSON of TransactionSerializer straight from .values() rows.
+    # The keys of each of the four shapes (cash/card, one-off/recurring) are computed once, and only amount and
+    # the dates go through their DRF field.
+    FIELDS = TransactionSerializer.Meta.fields
+    CARD_FIELDS = ('card_number' , 'cvv' , 'expiration_date')
+    SUBSCRIPTION_FIELDS = ('recurring' , 'subscription_start_date' , 'subscription_end_date' , 'recurrence_choices' , 'subscription_next_paid_date')
+    COLUMNS = {'category': 'category_id'} # output key -> .values() column, when they differ
+
+
+    def __init__(self):
+        fields = TransactionSerializer().fields
+        converters = {name: fields[name].to_representation for name in
+                      ('amount' , 'subscription_start_date' , 'subscription_end_date' , 'subscription_next_paid_date')}
+        converters['transaction_date'] = serializers.DateField().to_representation # exports only, not a TransactionSerializer field
+
+        # (key, column, converter or None) per shape
+        self.shapes = {}
+        for card in (False , True):
+            for recurring in (False , True):
+                self.shapes[(card , recurring)] = tuple((field , self.COLUMNS.get(field , field) , converters.get(field)) for field in self.FIELDS
+                                                        if((card or field not in self.CARD_FIELDS) and (recurring or field not in self.SUBSCRIPTION_FIELDS)))
+
+
+    @classmethod
+    def columns(cls , *extra):
+        # what the queryset has to select, plus e.g. the ordering columns of the paginator
+        return list(dict.fromkeys([cls.COLUMNS.get(field , field) for field in cls.FIELDS] + list(extra)))
+
+
+    def serialize(self , rows):
+        shapes = self.shapes
+        data = []
+        with serializer_timer():
+            for row in rows:
+                item = {}
+                for field , column , converter in shapes[(row['payment_method'] != 'Cash' , bool(row['recurring']))]:
+                    value = row[column]
+                    item[field] = value if(value is None or converter is None) else converter(value)
+                data.append(item)
+        return data
+
+
+
+
+
+
+
+class TransactionExportRowSerializer(TransactionRowSerializer):
+    # the rows of the exports (exports.py), which also carry the date of every transaction
+    FIELDS = ['id' , 'transaction_date'] + [field for field in TransactionRowSerializer.FIELDS if(field != 'id')]
+
+
+
+
+
+
+
+class TransactionExportSerializer(ProfiledSerializerMixin , serializers.Serializer):
+    output = serializers.ChoiceField(choices=['csv' , 'ndjson'] , default='csv')
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    type = serializers.ChoiceField(choices=['Income' , 'Expense'] , required=False)
+    category = serializers.IntegerField(required=False)
+
+
+    def validate(self , data):
+        if(data.get('date_from') and data.get('date_to') and data.get('date_to') < data.get('date_from')):
+            raise serializers.ValidationError('⚠️ The end date must strictly follow the start date.')
+
+        user_context = self.context.get('user_context')
+        if(data.get('category') is not None and not any(category.pk == data.get('category') for category in user_context.categories)):
+            raise serializers.ValidationError('⚠️ This category does not exist for this user.')
+
+        return data
+
+
+
+
+
+
+
+class StatementImportSerializer(ProfiledSerializerMixin , serializers.Serializer):
+    file = serializers.FileField()
+    file_format = serializers.ChoiceField(choices=['csv' , 'ofx'] , required=False , help_text='Defaults to the extension of the file.')
+    card = serializers.IntegerField(required=False , help_text='Book the statement to this card of the user instead of the cash.')
+    category = serializers.CharField(max_length=50 , default=DEFAULT_CATEGORY , help_text='Category of the rows without one (every OFX row).')
+    chunk_size = serializers.IntegerField(min_value=1 , max_value=MAX_CHUNK_SIZE , default=DEFAULT_CHUNK_SIZE)
+
+
+    def validate(self , data):
+        if(not data.get('file_format')):
+            extension = data.get('file').name.rsplit('.' , 1)[-1].lower()
+            if(extension not in FILE_EXTENSIONS):
+                raise serializers.ValidationError('⚠️ Unknown file type. Provide file_format (csv or ofx).')
+            data['file_format'] = FILE_EXTENSIONS[extension]
+
+        if(data.get('card') is not None):
+            user_context = self.context.get('user_context')
+            data['card'] = next((card for card in user_context.cards if(card.pk == data.get('card'))) , None)
+            if(data['card'] is None):
+                raise serializers.ValidationError('⚠️ This card does not exist for this user.')
+
+        return data
+
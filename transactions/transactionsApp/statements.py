@@ -0,0 +1,248 @@
+from .models import *
+from .balances import to_cents
+from .billing import chunks
+from . import rollups
+from . import ledger
+from django.db import transaction as db_transaction
+from django.db.models import F
+from datetime import datetime
+from decimal import InvalidOperation
+import codecs
+import csv
+import re
+
+
+
+# Bank statement imports. The parsers read the file incrementally and yield one row at a time, the importer
+# books them in chunks: per chunk one bulk_create of the missing categories, one bulk_create of the transactions
+# and one balance UPDATE of the card (or the cash) the statement belongs to, in one database transaction.
+# The rows are history: they move the balance but are not declined and impose no debt, except that a row that
+# would take the balance below zero is rejected.
+
+DEFAULT_CATEGORY = 'Imported'
+DEFAULT_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 10000
+MAX_REPORTED_ERRORS = 1000
+READ_SIZE = 64 * 1024
+
+CSV_DATE_FORMATS = ('%Y-%m-%d' , '%d/%m/%Y' , '%d.%m.%Y')
+CSV_COLUMNS = ('date' , 'amount' , 'type' , 'currency' , 'category' , 'description')
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+MAX_AMOUNT = Decimal('1e10') # max_digits=12 , decimal_places=2
+
+
+
+
+class RowError(Exception):
+    pass
+
+
+
+
+def statement_row(date , amount , type=None , currency=None , category=None , description=None):
+    # the fields of one row, as the parsers found them, checked and converted
+    try:
+        amount = Decimal(str(amount).strip().replace(',' , '.'))
+    except InvalidOperation:
+        raise RowError(f'⚠️ Invalid amount: {amount}')
+    if(type):
+        type = type.strip().capitalize()
+        if(type not in ('Income' , 'Expense')):
+            raise RowError(f"⚠️ Invalid type: {type}. Use 'Income' or 'Expense'.")
+    elif(amount):
+        type = 'Income' if(amount > 0) else 'Expense'
+    amount = to_cents(abs(amount))
+    if(not amount or amount >= MAX_AMOUNT):
+        raise RowError(f'⚠️ Invalid amount: {amount}')
+
+    if(date > timezone.localdate()):
+        raise RowError(f'⚠️ The date {date.isoformat()} is in the future.')
+
+    currency = (currency or '').strip().upper() or None
+    if(currency and currency not in Currency_rate.currency_rates):
+        raise RowError(f'⚠️ Unsupported currency: {currency}')
+
+    return {'date': date , 'amount': amount , 'type': type , 'currency': currency ,
+            'category': (category or '').strip()[:50] or None , 'description': (description or '').strip()[:200] or None}
+
+
+
+
+def csv_rows(file):
+    # yields (line number, row or None, error or None). A header line is required, date and amount columns too.
+    lines = (line.decode('utf-8-sig' , errors='replace') for line in file)
+    reader = csv.reader(lines)
+    header = [name.strip().lower() for name in next(reader , [])]
+    missing = [name for name in ('date' , 'amount') if(name not in header)]
+    if(missing):
+        yield 1 , None , f"⚠️ The header has no {' and no '.join(missing)} column. Columns: {', '.join(CSV_COLUMNS)}."
+        return
+    positions = {name: header.index(name) for name in CSV_COLUMNS if(name in header)}
+
+    for values in reader:
+        if(not any(value.strip() for value in values)):
+            continue
+        try:
+            fields = {name: values[position] if(position < len(values)) else '' for name , position in positions.items()}
+            yield reader.line_num , statement_row(parse_date(fields.pop('date')) , **fields) , None
+        except RowError as error:
+            yield reader.line_num , None , str(error)
+
+
+
+
+def parse_date(value):
+    for date_format in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip() , date_format).date()
+        except ValueError:
+            continue
+    raise RowError(f'⚠️ Invalid date: {value}. Use YYYY-MM-DD.')
+
+
+
+
+def ofx_tokens(file):
+    # (closing, tag, text) of the OFX 1.x (SGML, leaf tags left open) or 2.x (XML) document, READ_SIZE at a time
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = ''
+    while(True):
+        data = file.read(READ_SIZE)
+        buffer += decoder.decode(data or b'' , final=not data)
+        # the text of the last tag may continue in the next block
+        end = len(buffer) if(not data) else buffer.rfind('<')
+        if(end > 0):
+            for closing , tag , text in OFX_TAG.findall(buffer[:end]):
+                yield closing == '/' , tag.upper() , text.strip()
+            buffer = buffer[end:]
+        if(not data):
+            return
+
+
+
+
+def ofx_rows(file):
+    # yields (transaction number, row or None, error or None) of the STMTTRN aggregates
+    currency = None
+    transaction = None
+    number = 0
+    for closing , tag , text in ofx_tokens(file):
+        if(tag == 'CURDEF' and not closing):
+            currency = text
+        elif(tag == 'STMTTRN'):
+            if(not closing):
+                transaction = {}
+                number += 1
+                continue
+            try:
+                posted = transaction.get('DTPOSTED' , '')
+                try:
+                    date = datetime.strptime(posted[:8] , '%Y%m%d').date()
+                except ValueError:
+                    raise RowError(f'⚠️ Invalid DTPOSTED: {posted}')
+                description = ' - '.join(text for text in (transaction.get('NAME') , transaction.get('MEMO')) if(text))
+                yield number , statement_row(date , transaction.get('TRNAMT' , '') , currency=currency , description=description) , None
+            except RowError as error:
+                yield number , None , str(error)
+            transaction = None
+        elif(transaction is not None and not closing):
+            transaction[tag] = text
+
+
+
+
+PARSERS = {'csv': csv_rows , 'ofx': ofx_rows}
+FILE_EXTENSIONS = {'csv': 'csv' , 'ofx': 'ofx' , 'qfx': 'ofx'}
+
+
+
+
+def import_statement(user_id , rows , card=None , category=DEFAULT_CATEGORY , chunk_size=DEFAULT_CHUNK_SIZE , progress=None):
+    # Books the parsed rows to the card (or to the cash when card is None) of the user, chunk_size rows per
+    # database transaction. progress(summary) is called after every chunk. Chunks already booked stay booked
+    # if a later one fails.
+    summary = {'imported': 0 , 'failed': 0 , 'chunks': 0 , 'categories_created': 0 , 'errors': []}
+    categories = {}
+    for existing in Category.objects.filter(user_id=user_id).order_by('-id'):
+        categories[existing.title.lower()] = existing # the oldest of the same title wins
+
+    for chunk in chunks(rows , chunk_size):
+        with db_transaction.atomic():
+            import_chunk(user_id , chunk , card , category , categories , summary)
+        summary['chunks'] += 1
+        if(progress):
+            progress(summary)
+    return summary
+
+
+
+
+def import_chunk(user_id , chunk , card , default_category , categories , summary):
+    def reject(number , error):
+        summary['failed'] += 1
+        if(len(summary['errors']) < MAX_REPORTED_ERRORS):
+            summary['errors'].append({'row': number , 'errors': [error]})
+
+    valid = []
+    for number , row , error in chunk:
+        if(error):
+            reject(number , error)
+        else:
+            valid.append((number , row))
+    if(not valid):
+        return
+
+    titles = {}
+    for number , row in valid:
+        title = row['category'] or default_category
+        if(title.lower() not in categories):
+            titles.setdefault(title.lower() , title)
+    if(titles):
+        Category.objects.bulk_create([Category(user_id=user_id , title=title) for title in titles.values()])
+        for created in Category.objects.filter(user_id=user_id , title__in=titles.values()).order_by('-id'):
+            categories[created.title.lower()] = created
+        summary['categories_created'] += len(titles)
+
+    # the balance the statement is booked to, locked for the chunk and moved once
+    if(card):
+        balance = Card.objects.select_for_update().values_list('balance' , flat=True).get(pk=card.pk)
+        account_currency = card.currency
+    else:
+        balance , account_currency = CustomUser.objects.select_for_update().values_list('cash' , 'currency').get(pk=user_id)
+    start = balance
+
+    transactions = []
+    for number , row in valid:
+        currency = row['currency'] or account_currency
+        amount = to_cents(row['amount'] if(currency == account_currency) else Currency_rate.convertion(row['amount'] , currency , account_currency))
+        delta = amount if(row['type'] == 'Income') else -amount
+        if(balance + delta < 0):
+            reject(number , f'❌ Balance is too low for this expense: {balance} {account_currency}.')
+            continue
+        balance += delta
+        transactions.append(Transaction(user_id=user_id , category=categories[(row['category'] or default_category).lower()] ,
+                                        payment_method='Card' if(card) else 'Cash' ,
+                                        card_number=card.card_number if(card) else None , cvv=card.cvv if(card) else None ,
+                                        expiration_date=card.expiration_date if(card) else None ,
+                                        amount=row['amount'] , currency=currency , type=row['type'] , transaction_date=row['date'] ,
+                                        recurring=False , recurrence_choices='' ,
+                                        message=row['description']))
+
+    Transaction.objects.bulk_create(transactions)
+    if(balance != start):
+        if(card):
+            Card.objects.filter(pk=card.pk).update(balance=F('balance') + (balance - start))
+        else:
+            CustomUser.objects.filter(pk=user_id).update(cash=F('cash') + (balance - start))
+        ledger.record(user_id , card.pk if(card) else ledger.CASH , account_currency , balance - start , 'statement' ,
+                      f'{len(transactions)} statement rows')
+
+    entries = {}
+    for tr in transactions:
+        key = rollups.transaction_key(tr)
+        total , count = entries.get(key , (0 , 0))
+        entries[key] = (total + tr.amount , count + 1)
+    rollups.add_many(entries)
+    if(transactions):
+        DataVersion.bump(user_id)
+    summary['imported'] += len(transactions)
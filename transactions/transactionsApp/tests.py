@@ -1,3 +1,1088 @@
-from django.test import TestCase
+from django.test import TestCase , override_settings
+from django.db import transaction as db_transaction
+from django.db.models import Sum , Count
+from rest_framework.test import APIClient
+from unittest import mock
+from .models import *
+from .views import CardViewSet
+from .seeding import seed , SEED_PREFIX
+from .benchmarking import registered_routes , Scenario , request_format
+from .querybudget import QueryCounter , QueryBudgetExceeded , WriteOnRead
+from .debts import enforce_debt_deadlines , DEBT_TIMEFRAME
+from .exports import export_batches
+from .caching import analytics_cache
+from . import jobs
+from . import ledger
+from . import rollups
+from .billing import bill_subscriptions
+from .projection import build_projection
+from .analytics import build_report
+from .rates import rate_cache , load_rates , ecb_xml_rates , csv_rates
+from .statements import import_statement , csv_rows , ofx_rows
+from django.core.files.uploadedfile import SimpleUploadedFile
+from datetime import date , timedelta
+from . import balances
+import random
+import math
+import base64
+import csv
+import io
+import json
 
-# Create your tests here.
+
+
+@override_settings(QUERY_BUDGET_ENFORCED=True , READ_ONLY_GUARD=True , REPLICA_DATABASE=None) # a replica would not see the data of the test transaction
+class QueryBudgetTests(TestCase):
+    # every endpoint runs for a user with 10 rows and for a user with 1000 rows, within the budget of its action
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(0)
+        seed(users=1 , cards_per_user=1 , transactions_per_user=10)
+        seed(users=1 , cards_per_user=100 , transactions_per_user=1000)
+        cls.small , cls.large = CustomUser.objects.filter(username__startswith=SEED_PREFIX).order_by('id')
+
+
+    def setUp(self):
+        analytics_cache().clear() # the rolled back tests leave results under the same user ids and versions
+
+
+    def query_counts(self , user):
+        scenario = Scenario(user)
+        client = APIClient()
+        counts = {}
+        for name , method , action , basename , kwargs in list(registered_routes()):
+            route = f'{method.upper()} {name}'
+            with db_transaction.atomic():
+                with QueryCounter() as counter:
+                    payload = scenario.payload(basename , action)
+                    response = getattr(client , method)(scenario.path(name , basename , kwargs) , payload , format=request_format(payload))
+                    content = b''.join(response.streaming_content) if(response.streaming) else response.content
+                db_transaction.set_rollback(True)
+            self.assertLess(response.status_code , 400 , f'{route}: {content[:500]}')
+            counts[route] = counter.count
+        return counts
+
+
+    def test_query_count_does_not_grow_with_data(self):
+        small = self.query_counts(self.small)
+        large = self.query_counts(self.large)
+        for route , count in small.items():
+            with self.subTest(route=route):
+                self.assertEqual(large[route] , count)
+
+
+    def test_budget_exceeded_reports_repeated_sql(self):
+        client = APIClient()
+        with mock.patch.dict(CardViewSet.query_budget , {'list': 0}):
+            with self.assertRaises(QueryBudgetExceeded) as raised:
+                client.get(f'/users/{self.large.pk}/cards/')
+        self.assertIn('CardViewSet.list ran' , str(raised.exception))
+
+
+    def test_counter_finds_repeated_statements(self):
+        with QueryCounter() as counter:
+            for card in Card.objects.filter(user=self.large)[:5]:
+                CustomUser.objects.get(pk=card.user_id)
+        self.assertEqual(counter.count , 6)
+        self.assertEqual(counter.duplicates()[0][1] , 5)
+
+
+
+
+@override_settings(REPLICA_DATABASE=None)
+class ConditionalGetTests(TestCase):
+    # list/retrieve answer If-None-Match with a 304 until the user's data changes
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(users=1 , cards_per_user=2 , transactions_per_user=10)
+        cls.user = CustomUser.objects.get(username__startswith=SEED_PREFIX)
+
+
+    def test_not_modified_until_data_changes(self):
+        client = APIClient()
+        url = f'/users/{self.user.pk}/cards/'
+        etag = client.get(url)['ETag']
+
+        with QueryCounter() as counter:
+            response = client.get(url , HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code , 304)
+        self.assertEqual(counter.count , 1) # the DataVersion row only
+
+        card = Card.objects.filter(user=self.user).first()
+        client.patch(f'{url}{card.pk}/' , {'card_type': 'Debit Card'} , format='json')
+        response = client.get(url , HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code , 200)
+        self.assertNotEqual(response['ETag'] , etag)
+
+
+    def test_balance_updates_change_the_version(self):
+        before = DataVersion.objects.get(pk=self.user.pk).version
+        balances.credit_cash(self.user , 10)
+        self.assertEqual(DataVersion.objects.get(pk=self.user.pk).version , before + 1)
+
+
+
+
+@override_settings(REPLICA_DATABASE=None)
+class PaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='pages')
+        category = Category.objects.create(user=cls.user , title='Food')
+        # the later days are inserted first, so the ids do not follow the dates; five rows share every day
+        for day in range(5 , 0 , -1):
+            for _ in range(5):
+                Transaction.objects.create(user=cls.user , category=category , type='Income' , amount=Decimal('1.00') , currency='EUR' ,
+                                           payment_method='Cash' , recurring=False , transaction_date=date(2025 , 1 , day))
+        cls.expected = list(Transaction.objects.filter(user=cls.user).order_by('transaction_date' , 'id').values_list('id' , flat=True))
+        cls.url = f'/users/{cls.user.pk}/transactions/'
+
+
+    def pages(self , url , direction):
+        client = APIClient()
+        pages = []
+        while(url):
+            response = client.get(url)
+            self.assertEqual(response.status_code , 200)
+            pages.append([row['id'] for row in response.json()['results']])
+            url = response.json()[direction]
+        return pages
+
+
+    def test_next_then_previous_return_every_row_once(self):
+        forward = self.pages(f'{self.url}?page_size=4' , 'next')
+        self.assertEqual([len(page) for page in forward] , [4 , 4 , 4 , 4 , 4 , 4 , 1])
+        self.assertEqual(sum(forward , []) , self.expected) # by day, then by id within a day
+
+        last = APIClient().get(f'{self.url}?page_size=4')
+        while(last.json()['next']):
+            last = APIClient().get(last.json()['next'])
+        backward = self.pages(last.json()['previous'] , 'previous')
+        self.assertEqual(sum(reversed(backward) , []) + forward[-1] , self.expected)
+
+
+    def test_tampered_cursor_is_a_bad_request(self):
+        def cursor(value):
+            return base64.urlsafe_b64encode(value.encode()).decode()
+        for value in ['garbage' , cursor('not json') , cursor('{"p":["2025-01-01"],"r":false}') , cursor('{"p":["2025-13-01","1"]}') ,
+                      cursor('{"p":["2025-01-01","99999999999999999999999"]}') , cursor('[1,2]')]:
+            with self.subTest(cursor=value):
+                response = APIClient().get(self.url , {'cursor': value})
+                self.assertEqual(response.status_code , 400)
+                self.assertEqual(response.json() , {'cursor': ['⚠️ Invalid cursor.']})
+
+
+
+
+@override_settings(READ_ONLY_GUARD=True , REPLICA_DATABASE=None)
+class ReadOnlyTests(TestCase):
+    # reading never writes: the debt timeframe is started and enforced by enforce_debt_deadlines
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(users=1 , cards_per_user=1 , transactions_per_user=10)
+        cls.user = CustomUser.objects.get(username__startswith=SEED_PREFIX)
+        cls.card = Card.objects.get(user=cls.user)
+        CustomUser.objects.filter(pk=cls.user.pk).update(debt=1)
+        Card.objects.filter(pk=cls.card.pk).update(balance=100)
+
+
+    def test_debt_deadline_is_enforced_by_the_job(self):
+        client = APIClient()
+        url = f'/users/{self.user.pk}/transactions/'
+        self.assertIn('results' , client.get(url).json())
+        self.assertIsNone(CustomUser.objects.get(pk=self.user.pk).debt_timeframe)
+
+        now = timezone.now()
+        self.assertEqual(enforce_debt_deadlines(now)['notified'] , 1)
+        self.assertIn('will be deactivated' , client.get(url).json())
+
+        # past the deadline and before the next run, the card is announced as pending deactivation, not removed
+        CustomUser.objects.filter(pk=self.user.pk).update(debt_timeframe=now - timedelta(seconds=1))
+        self.assertIn('pending deactivation' , client.get(url).json())
+        self.assertTrue(Card.objects.filter(pk=self.card.pk).exists())
+
+        self.assertEqual(enforce_debt_deadlines(now + DEBT_TIMEFRAME)['deactivated'] , 1)
+        self.assertFalse(Card.objects.filter(pk=self.card.pk).exists())
+
+
+    def test_guard_rejects_writes_on_safe_methods(self):
+        def list_and_write(view , request , *args , **kwargs):
+            Category.objects.create(user=self.user , title='Written on read')
+        with mock.patch.object(CardViewSet , 'list' , list_and_write):
+            with self.assertRaises(WriteOnRead) , db_transaction.atomic():
+                APIClient().get(f'/users/{self.user.pk}/cards/')
+        self.assertFalse(Category.objects.filter(title='Written on read').exists())
+
+
+
+
+class BillingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='billing' , currency='EUR')
+        cls.category = Category.objects.create(user=cls.user , title='Bills')
+        cls.card = Card.objects.create(user=cls.user , balance=Decimal('1000.00') , currency='EUR')
+
+
+    def subscribe(self , recurrence , start , amount='1.00' , end=None):
+        return Transaction.objects.create(user=self.user , category=self.category , payment_method='Card' , type='Expense' , amount=Decimal(amount) ,
+                                          currency='EUR' , recurring=True , recurrence_choices=recurrence , subscription_start_date=start ,
+                                          subscription_next_paid_date=start , subscription_end_date=end , card_number=self.card.card_number ,
+                                          cvv=self.card.cvv , expiration_date=self.card.expiration_date)
+
+
+    def next_paid(self , subscription):
+        return Transaction.objects.get(pk=subscription.pk).subscription_next_paid_date
+
+
+    def balance(self):
+        return Card.objects.get(pk=self.card.pk).balance
+
+
+    def test_missed_periods_are_caught_up(self):
+        today = date(2025 , 3 , 10)
+        subscriptions = {'Daily': (self.subscribe('Daily' , date(2025 , 3 , 1)) , date(2025 , 3 , 11)) , # 10 payments
+                         'Weekly': (self.subscribe('Weekly' , date(2025 , 2 , 10)) , date(2025 , 3 , 17)) , # 5, today included
+                         'Monthly': (self.subscribe('Monthly' , date(2024 , 12 , 10)) , date(2025 , 4 , 10)) , # 4
+                         'Yearly': (self.subscribe('Yearly' , date(2022 , 3 , 11)) , date(2025 , 3 , 11)) , # 3
+                         'ended': (self.subscribe('Weekly' , date(2025 , 2 , 10) , end=date(2025 , 3 , 3)) , date(2025 , 3 , 3))} # 3, never on the end date
+
+        summary = bill_subscriptions(today)
+        self.assertEqual((summary['subscriptions'] , summary['payments'] , summary['declined']) , (5 , 25 , 0))
+        self.assertEqual(self.balance() , Decimal('975.00'))
+        for name , (subscription , next_paid) in subscriptions.items():
+            self.assertEqual(self.next_paid(subscription) , next_paid , name)
+
+        # an ended subscription is not charged again, later runs only charge the periods that came due since
+        summary = bill_subscriptions(date(2025 , 3 , 20))
+        self.assertEqual(summary['payments'] , 10 + 1 + 1) # daily, weekly and the yearly one due on 2025-03-11
+        self.assertEqual(self.next_paid(subscriptions['ended'][0]) , date(2025 , 3 , 3))
+
+
+    def test_end_of_month_is_clipped(self):
+        leap = self.subscribe('Monthly' , date(2024 , 1 , 31))
+        other = self.subscribe('Monthly' , date(2025 , 1 , 31))
+        bill_subscriptions(date(2024 , 4 , 30))
+        days = set(DailyRollup.objects.filter(user=self.user , billed=True).values_list('day' , flat=True))
+        self.assertEqual(days , {date(2024 , 1 , 31) , date(2024 , 2 , 29) , date(2024 , 3 , 31) , date(2024 , 4 , 30)})
+        self.assertEqual(self.next_paid(leap) , date(2024 , 5 , 31))
+
+        bill_subscriptions(date(2025 , 2 , 28))
+        self.assertEqual(self.next_paid(other) , date(2025 , 3 , 31)) # back to the 31st after February
+        self.assertIn(date(2025 , 2 , 28) , DailyRollup.objects.filter(user=self.user , billed=True).values_list('day' , flat=True))
+
+
+    def test_partial_payment_leaves_the_rest_due(self):
+        Card.objects.filter(pk=self.card.pk).update(balance=Decimal('25.00'))
+        subscription = self.subscribe('Monthly' , date(2025 , 1 , 5) , amount='10.00')
+        summary = bill_subscriptions(date(2025 , 4 , 5)) # 4 periods due, the card pays 2
+        self.assertEqual((summary['payments'] , summary['declined']) , (2 , 1))
+        self.assertEqual(self.balance() , Decimal('5.00'))
+        self.assertEqual(self.next_paid(subscription) , date(2025 , 3 , 5))
+        # the unpaid periods stay due on the subscription, they are not turned into debt of the user
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).debt , Decimal('0.00'))
+
+        Card.objects.filter(pk=self.card.pk).update(balance=Decimal('100.00'))
+        summary = bill_subscriptions(date(2025 , 4 , 5))
+        self.assertEqual((summary['payments'] , summary['declined']) , (2 , 0))
+        self.assertEqual((self.balance() , self.next_paid(subscription)) , (Decimal('80.00') , date(2025 , 5 , 5)))
+
+
+    def test_second_run_charges_nothing(self):
+        self.subscribe('Daily' , date(2025 , 3 , 1))
+        self.subscribe('Monthly' , date(2025 , 1 , 31))
+        first = bill_subscriptions(date(2025 , 3 , 10))
+        balance = self.balance()
+        second = bill_subscriptions(date(2025 , 3 , 10))
+        self.assertEqual((first['payments'] , second['payments'] , second['subscriptions']) , (12 , 0 , 0))
+        self.assertEqual(self.balance() , balance)
+        self.assertEqual(LedgerEntry.objects.filter(user=self.user , kind='subscription').count() , 2)
+
+
+    def test_converted_charges_match_the_ledger(self):
+        subscription = self.subscribe('Daily' , date(2025 , 3 , 1))
+        Transaction.objects.filter(pk=subscription.pk).update(currency='USD') # 1 USD are 0.862... EUR, 0.86 per payment
+        bill_subscriptions(date(2025 , 3 , 5))
+        bill_subscriptions(date(2025 , 3 , 10))
+        charged = LedgerEntry.objects.filter(user=self.user , kind='subscription').aggregate(total=Sum('amount'))['total']
+        self.assertEqual(charged , Decimal('-8.60'))
+        self.assertEqual(self.balance() , Decimal('1000.00') + charged)
+
+
+    def test_payments_are_in_the_report(self):
+        self.subscribe('Monthly' , date(2025 , 1 , 5) , amount='10.00')
+        bill_subscriptions(date(2025 , 3 , 10))
+        choose_card = f'{self.card.card_type} - {self.card.card_number}'
+        report = build_report(self.user , {'card': True , 'choose_card': choose_card , 'currency': 'EUR' ,
+                                           'compute_statistics_from': date(2025 , 2 , 1) , 'compute_statistics_to': date(2025 , 3 , 31)})
+        self.assertIn(f"Total expenses with '{choose_card}': 20.00 EUR" , report) # February and March
+        self.assertIn(f"Total expenses subscriptions with '{choose_card}': 20.00 EUR" , report)
+
+
+
+
+@override_settings(REPLICA_DATABASE=None)
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(0)
+        seed(users=1 , cards_per_user=1 , transactions_per_user=25)
+        cls.user = CustomUser.objects.get(username__startswith=SEED_PREFIX)
+
+
+    def test_batches_cover_every_row_once_in_order(self):
+        transactions = Transaction.objects.filter(user=self.user)
+        ids = [row['id'] for rows in export_batches(transactions , chunk_size=4) for row in rows]
+        self.assertEqual(ids , list(transactions.order_by('transaction_date' , 'id').values_list('id' , flat=True)))
+
+
+    def test_filtered_ndjson_and_csv(self):
+        client = APIClient()
+        url = f'/users/{self.user.pk}/transactions/export/'
+        category = Category.objects.filter(user=self.user).first()
+        expected = Transaction.objects.filter(user=self.user , type='Expense' , category=category).count()
+
+        response = client.get(url , {'output': 'ndjson' , 'type': 'Expense' , 'category': category.pk})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'] , 'application/x-ndjson')
+        self.assertEqual(len(lines) , expected)
+        self.assertTrue(all(json.loads(line)['category'] == category.pk for line in lines))
+
+        response = client.get(url)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows) , 25)
+        self.assertEqual(list(rows[0])[:2] , ['id' , 'transaction_date'])
+
+        self.assertEqual(client.get(url , {'category': 0}).status_code , 400)
+
+
+
+
+class CategoryDeleteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(1)
+        seed(users=1 , cards_per_user=3 , transactions_per_user=600 , days=20) # many rollups shared by several categories
+        cls.user = CustomUser.objects.get(username__startswith=SEED_PREFIX)
+
+
+    def rollups(self):
+        return sorted(DailyRollup.objects.filter(user=self.user , billed=False)
+                                         .values_list('day' , 'currency' , 'type' , 'payment_method' , 'card_number' , 'recurring' , 'total' , 'count'))
+
+
+    def test_rollups_match_a_rebuild(self):
+        category = Category.objects.filter(user=self.user).annotate(transactions=Count('transaction')).order_by('-transactions').first()
+        self.assertGreater(category.transactions , 0)
+        response = APIClient().delete(f'/users/{self.user.pk}/categories/{category.pk}/')
+        self.assertEqual(response.status_code , 204)
+
+        after_delete = self.rollups()
+        rollups.rebuild_users([self.user.pk])
+        self.assertEqual(after_delete , self.rollups())
+        self.assertFalse(DailyRollup.objects.filter(user=self.user , count__lte=0).exists())
+
+
+
+
+class StatementImportTests(TestCase):
+    OFX = b'''OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><CURDEF>USD
+<BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105120000<TRNAMT>-12.50<FITID>1<NAME>Grocer</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240131<TRNAMT>1000.00<FITID>2<NAME>Salary<MEMO>January</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>bad<TRNAMT>-1.00<FITID>3</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='importer' , cash=Decimal('10.00') , currency='EUR')
+        Category.objects.create(user=cls.user , title='Food')
+        cls.card = Card.objects.create(user=cls.user , balance=Decimal('0.00') , currency='USD')
+
+
+    def test_csv_import_in_chunks(self):
+        statement = (b'Date,Amount,Category,Description\n'
+                     b'2024-01-01,100.00,Salary,Employer\n'
+                     b'2024-01-02,-20.00,food,Market\n'
+                     b'2024-01-03,abc,Food,\n'
+                     b'02/01/2024,-500.00,Rent,Too much\n'
+                     b'2024-01-04,-5.00,,No category\n')
+        chunks = []
+        summary = import_statement(self.user.pk , csv_rows(io.BytesIO(statement)) , chunk_size=2 ,
+                                   progress=lambda summary: chunks.append(summary['imported']))
+
+        self.assertEqual((summary['imported'] , summary['failed'] , summary['chunks']) , (3 , 2 , 3))
+        self.assertEqual(chunks , [2 , 2 , 3])
+        self.assertEqual([error['row'] for error in summary['errors']] , [4 , 5])
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).cash , Decimal('85.00'))
+        self.assertEqual(sorted(Category.objects.filter(user=self.user).values_list('title' , flat=True)) , ['Food' , 'Imported' , 'Rent' , 'Salary'])
+        self.assertEqual(Transaction.objects.get(user=self.user , message='Market').transaction_date , date(2024 , 1 , 2))
+
+
+    def test_ofx_import_to_card(self):
+        with mock.patch('transactionsApp.statements.READ_SIZE' , 7): # tags and texts split across reads
+            summary = import_statement(self.user.pk , ofx_rows(io.BytesIO(self.OFX)) , card=self.card)
+        self.assertEqual((summary['imported'] , summary['failed']) , (1 , 2)) # the expense comes before the salary
+        self.assertEqual(Card.objects.get(pk=self.card.pk).balance , Decimal('1000.00'))
+        transaction = Transaction.objects.get(user=self.user)
+        self.assertEqual((transaction.card_number , transaction.currency , transaction.message) , (self.card.card_number , 'USD' , 'Salary - January'))
+
+
+    def test_upload(self):
+        statement = SimpleUploadedFile('statement.ofx' , self.OFX)
+        response = APIClient().post(f'/users/{self.user.pk}/transactions/import/' , {'file': statement , 'card': self.card.pk} , format='multipart')
+        self.assertEqual(response.status_code , 207)
+        self.assertEqual(response.json()['imported'] , 1)
+
+
+    def test_imported_transactions_can_be_retrieved(self):
+        import_statement(self.user.pk , csv_rows(io.BytesIO(b'Date,Amount,Description\n2024-01-01,-2.50,Coffee\n')))
+        import_statement(self.user.pk , ofx_rows(io.BytesIO(self.OFX)) , card=self.card)
+        client = APIClient()
+        for transaction in Transaction.objects.filter(user=self.user):
+            response = client.get(f'/users/{self.user.pk}/transactions/{transaction.pk}/')
+            self.assertEqual(response.status_code , 200)
+            self.assertEqual(response.json()['message'] , transaction.message)
+        self.assertEqual(client.get(f'/users/{self.user.pk}/transactions/').status_code , 200)
+
+
+
+
+@override_settings(REPLICA_DATABASE=None)
+class AnalyticsCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(0)
+        seed(users=1 , cards_per_user=2 , transactions_per_user=200)
+        cls.user = CustomUser.objects.get(username__startswith=SEED_PREFIX)
+
+
+    def setUp(self):
+        analytics_cache().clear()
+
+
+    def test_repeated_report_is_served_from_the_cache(self):
+        client = APIClient()
+        url = f'/users/{self.user.pk}/analytics/'
+        report = Scenario(self.user).report()
+
+        with QueryCounter() as miss:
+            first = client.post(url , report , format='json').json()
+        with QueryCounter() as hit:
+            self.assertEqual(client.post(url , report , format='json').json() , first)
+        self.assertFalse(any('dailyrollup' in sql for sql in hit.statements))
+        self.assertLess(hit.count , miss.count)
+
+        balances.credit_cash(self.user , 1000)
+        self.assertNotEqual(client.post(url , report , format='json').json() , first)
+
+
+
+
+def per_card_loop_report(user , data):
+    # the report as the first version of AnalyticsViewSet.create computed it: every transaction of the period
+    # converted on its own, with one lookup of its card
+    currency = data['currency']
+    selected_card = data['choose_card']
+    choose_card = selected_card.strip('-').split()[3]
+    convert = lambda amount , from_currency: amount if(from_currency == currency) else Currency_rate.convertion(amount , from_currency , currency)
+    transactions = Transaction.objects.filter(user=user , transaction_date__gte=data['compute_statistics_from'] ,
+                                              transaction_date__lte=data['compute_statistics_to'])
+    totals = {}
+    def add(name , tr):
+        totals[name] = totals.get(name , 0) + convert(tr.amount , tr.currency)
+
+    for tr in transactions:
+        this_card = Card.objects.filter(user=user , card_number=tr.card_number).first()
+        side = 'income' if(tr.type == 'Income') else 'expense'
+        if(tr.payment_method == 'Cash'):
+            add(f'{side}_cash' , tr)
+        if(tr.payment_method == 'Card' and this_card):
+            add(f'{side}_card' , tr)
+        if(tr.recurring):
+            add(f'{side}_subscriptions' , tr)
+        if(this_card and tr.card_number == choose_card):
+            if(tr.payment_method == 'Card'):
+                add(f'{side}_chosen' , tr)
+            if(tr.recurring):
+                add(f'{side}_chosen_subscriptions' , tr)
+                if(data.get('subscriptions')):
+                    add(f'{side}_chosen_subscriptions' , tr)
+    total = lambda name: f'{totals.get(name , 0):.2f} {currency}'
+
+    total_cash = convert(user.cash , user.currency)
+    total_card_balance = 0
+    balances = []
+    for card in Card.objects.filter(user=user).order_by('id'):
+        total_card_balance += convert(card.balance , card.currency)
+        balances.append(f'{card.card_type} - {card.card_number}  ->  {convert(card.balance , card.currency):.2f} {currency}')
+
+    income , expense = data.get('income_transactions') , data.get('expense_transactions')
+    if(data.get('all_assets')):
+        return [f'Total assets: {total_cash + total_card_balance:.2f} {currency}' , f'Total cash: {total_cash:.2f} {currency}' ,
+                f'Total card balance: {total_card_balance:.2f} {currency}' , balances ,
+                f"Total incomes in cash: {total('income_cash')}" , f"Total incomes in card: {total('income_card')}" ,
+                f"Total expenses in cash: {total('expense_cash')}" , f"Total expenses in card: {total('expense_card')}" ,
+                f"Total incomes subscriptions: {total('income_subscriptions')}" , f"Total expenses subscriptions: {total('expense_subscriptions')}"]
+
+    if(data.get('cash')):
+        message = [f'Total cash: {total_cash:.2f} {currency}']
+        if(income or not expense):
+            message.append(f"Total incomes in cash: {total('income_cash')}")
+        if(expense):
+            message.append(f"Total expenses in cash: {total('expense_cash')}")
+        elif(not income):
+            message.append(f'Total expenses in cash: {0:.2f} {currency}') # the expenses were only summed when asked for
+        return message
+
+    subscriptions = data.get('subscriptions')
+    message = [f'Total card balance: {total_card_balance:.2f} {currency}' , balances]
+    if(income):
+        message.append(f"Total incomes with '{selected_card}': {total('income_chosen')}")
+        if(subscriptions):
+            message.append(f"Total incomes subscriptions with '{selected_card}': {total('income_chosen_subscriptions')}")
+    if(expense):
+        message.append(f"Total expenses with '{selected_card}': {total('expense_chosen')}")
+        if(subscriptions):
+            message.append(f"Total expenses subscriptions with '{selected_card}': {total('expense_chosen_subscriptions')}")
+    elif(subscriptions and not income):
+        message.append(f"Total incomes subscriptions with '{selected_card}': {total('income_chosen_subscriptions')}")
+        message.append(f"Total expenses subscriptions with '{selected_card}': {total('expense_chosen_subscriptions')}")
+    elif(not income and not subscriptions):
+        message.append(f"Total incomes with '{selected_card}': {total('income_chosen')}")
+        message.append(f"Total expenses with '{selected_card}': {total('expense_chosen')}")
+        message.append(f"Total incomes subscriptions with '{selected_card}': {total('income_chosen_subscriptions')}")
+        message.append(f"Total expenses subscriptions with '{selected_card}': {total('expense_chosen_subscriptions')}")
+    return message
+
+
+
+
+@override_settings(REPLICA_DATABASE=None)
+class ReportRegressionTests(TestCase):
+    FROM = date(2024 , 3 , 1)
+    TO = date(2024 , 4 , 30)
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(7)
+        cls.user = CustomUser.objects.create(username='reported' , cash=Decimal('1234.56') , currency='USD')
+        other = CustomUser.objects.create(username='stranger' , currency='EUR')
+        categories = [Category.objects.create(user=cls.user , title=title) for title in ('Food' , 'Salary' , 'Rent')]
+        cls.cards = [Card.objects.create(user=cls.user , card_type=card_type , balance=Decimal(balance) , currency=currency)
+                     for card_type , balance , currency in (('Debit Card' , '2500.10' , 'EUR') , ('Credit Card' , '830.45' , 'USD') ,
+                                                            ('Prepaid Card' , '99.99' , 'GBP'))]
+        foreign_card = Card.objects.create(user=other , balance=Decimal('10.00') , currency='EUR') # not the user's card
+        card_numbers = [card.card_number for card in cls.cards] + [foreign_card.card_number]
+
+        rows = []
+        for position in range(400):
+            method = rng.choice(('Cash' , 'Card'))
+            rows.append(Transaction(user=cls.user , payment_method=method , category=rng.choice(categories) ,
+                                    card_number=rng.choice(card_numbers) if(method == 'Card') else None ,
+                                    amount=Decimal(rng.randint(1 , 50000)) / 100 , currency=rng.choice(('EUR' , 'USD' , 'GBP' , 'JPY')) ,
+                                    type=rng.choice(('Income' , 'Expense')) , recurring=method == 'Card' and rng.random() < 0.3 ,
+                                    recurrence_choices='Monthly' , transaction_date=cls.FROM + timedelta(days=rng.randint(-20 , 80))))
+        Transaction.objects.bulk_create(rows)
+        rollups.rebuild_users([cls.user.pk])
+
+
+    def setUp(self):
+        analytics_cache().clear()
+
+
+    def report(self , **options):
+        return {'currency': 'EUR' , 'choose_card': self.choose(self.cards[0]) , 'compute_statistics_from': str(self.FROM) ,
+                'compute_statistics_to': str(self.TO) , **options}
+
+
+    def choose(self , card):
+        return f'{card.card_type} - {card.card_number}'
+
+
+    def assertSameReport(self , data):
+        response = APIClient().post(f'/users/{self.user.pk}/analytics/' , data , format='json')
+        self.assertEqual(response.status_code , 200 , response.content)
+        self.assertEqual(response.json() , per_card_loop_report(self.user , data) , data)
+
+
+    def test_all_assets(self):
+        for currency in ('EUR' , 'USD' , 'JPY'):
+            self.assertSameReport(self.report(all_assets=True , currency=currency))
+
+
+    def test_cash(self):
+        for currency in ('EUR' , 'GBP'):
+            for income in (False , True):
+                for expense in (False , True):
+                    self.assertSameReport(self.report(cash=True , currency=currency , income_transactions=income , expense_transactions=expense))
+
+
+    def test_every_card(self):
+        for card in self.cards:
+            for currency in ('EUR' , 'USD'):
+                for income in (False , True):
+                    for expense in (False , True):
+                        for subscriptions in (False , True):
+                            self.assertSameReport(self.report(card=True , choose_card=self.choose(card) , currency=currency ,
+                                                              income_transactions=income , expense_transactions=expense ,
+                                                              subscriptions=subscriptions))
+
+
+
+
+@override_settings(REPLICA_DATABASE=None , QUERY_BUDGET_ENFORCED=True , ANALYTICS_JOBS={'WORKERS': 0 , 'PER_USER': 1})
+class AnalyticsJobTests(TestCase):
+    # ?async=true returns the job at once, the report is computed after the commit (in the request with WORKERS 0)
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(0)
+        seed(users=1 , cards_per_user=2 , transactions_per_user=50)
+        cls.user = CustomUser.objects.get(username__startswith=SEED_PREFIX)
+        cls.url = f'/users/{cls.user.pk}/analytics/'
+
+
+    def setUp(self):
+        analytics_cache().clear()
+        self.report = Scenario(self.user).report()
+        Analytics.objects.filter(user=self.user).delete() # the queued job of the scenario
+
+
+    def test_job_computes_the_same_report(self):
+        client = APIClient()
+        report = self.report
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'{self.url}?async=true' , report , format='json')
+        self.assertEqual(response.status_code , 202)
+        job = response.json()['id']
+
+        self.assertEqual(client.get(f'{self.url}{job}/status/').json()['status'] , 'done')
+        result = client.get(f'{self.url}{job}/result/')
+        self.assertEqual(result.status_code , 200)
+        analytics_cache().clear()
+        self.assertEqual(result.json() , client.post(self.url , report , format='json').json())
+        self.assertEqual(client.post(f'{self.url}{job}/cancel/').status_code , 409)
+
+
+    def test_limit_and_cancel(self):
+        client = APIClient()
+        report = self.report
+        with self.captureOnCommitCallbacks() as callbacks:
+            job = client.post(f'{self.url}?async=true' , report , format='json').json()['id']
+        self.assertEqual(client.post(f'{self.url}?async=true' , report , format='json').status_code , 429)
+        self.assertEqual(client.get(f'{self.url}{job}/result/').status_code , 202)
+
+        self.assertEqual(client.post(f'{self.url}{job}/cancel/').json()['status'] , 'cancelled')
+        callbacks[0]() # the worker picks up the cancelled job and drops it
+        self.assertIsNone(Analytics.objects.get(pk=job).result)
+        self.assertEqual(client.get(f'{self.url}{job}/result/').status_code , 409)
+        self.assertEqual(client.post(f'{self.url}?async=true' , report , format='json').status_code , 202)
+
+
+    def test_stale_jobs_expire(self):
+        job = Analytics.objects.create(user=self.user , status='running' , created_at=timezone.now() - timedelta(hours=1) ,
+                                       **self.report)
+        self.assertEqual(jobs.expire_stale(600) , 1)
+        self.assertEqual(Analytics.objects.get(pk=job.pk).status , 'failed')
+
+
+
+
+class BalanceTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='balances' , cash=Decimal('100.00') , currency='EUR')
+        cls.category = Category.objects.create(user=cls.user , title='Food')
+        cls.debt = Category.objects.create(user=cls.user , title='debt')
+        cls.debit = Card.objects.create(user=cls.user , card_type='Debit Card' , balance=Decimal('50.00') , currency='EUR')
+        cls.credit = Card.objects.create(user=cls.user , card_type='Credit Card' , balance=Decimal('5000.00') , currency='EUR')
+
+
+    def post(self , amount , card=None , currency='EUR' , category=None):
+        item = {'category': (category or self.category).pk , 'type': 'Expense' , 'amount': amount , 'currency': currency , 'recurring': False ,
+                'recurrence_choices': 'Daily' , 'payment_method': 'Card' if(card) else 'Cash'}
+        if(card):
+            item.update(card_number=card.card_number , cvv=card.cvv , expiration_date=card.expiration_date)
+        return APIClient().post(f'/users/{self.user.pk}/transactions/' , item , format='json')
+
+
+    def balance(self , card):
+        return Card.objects.get(pk=card.pk).balance
+
+
+    def reloaded(self):
+        return CustomUser.objects.get(pk=self.user.pk)
+
+
+    def test_debit_over_the_balance_is_declined_with_debt(self):
+        response = self.post('60.00' , self.debit)
+        self.assertEqual(response.status_code , 400)
+        self.assertIn('A debt of 60.00 EUR has been imposed' , response.json()[0])
+        self.assertEqual(self.balance(self.debit) , Decimal('50.00'))
+        self.assertEqual(self.reloaded().debt , Decimal('60.00'))
+        self.assertFalse(Transaction.objects.filter(user=self.user).exists())
+
+        self.assertFalse(balances.debit_card(self.debit , Decimal('50.01')))
+        self.assertEqual(self.balance(self.debit) , Decimal('50.00'))
+
+
+    def test_debit_of_the_whole_balance(self):
+        self.assertEqual(self.post('50.00' , self.debit).status_code , 201)
+        self.assertEqual(self.balance(self.debit) , Decimal('0.00'))
+        self.assertEqual(self.reloaded().debt , Decimal('0.00'))
+        self.assertTrue(balances.debit_cash(self.user , Decimal('100.00')))
+        self.assertEqual(self.reloaded().cash , 0)
+
+
+    def test_credit_limit(self):
+        response = self.post(str(CREDIT_LIMIT + 1) , self.credit)
+        self.assertEqual(response.status_code , 400)
+        self.assertIn(f'Credit limit of {CREDIT_LIMIT} EUR exceeded' , response.json()[0])
+        self.assertEqual((self.balance(self.credit) , self.reloaded().debt) , (Decimal('5000.00') , Decimal('0.00')))
+        self.assertEqual(self.post(str(CREDIT_LIMIT) , self.credit).status_code , 201)
+        self.assertEqual(self.balance(self.credit) , Decimal('5000.00') - CREDIT_LIMIT)
+
+
+    def test_cash_expense_compares_the_converted_amount(self):
+        # 110 USD are 94.83 EUR: within the 100 EUR of cash, although 110 > 100
+        self.assertEqual(self.post('110.00' , currency='USD').status_code , 201)
+        self.assertEqual(self.reloaded().cash , Decimal('5.17'))
+        response = self.post('10.00' , currency='USD') # 8.62 EUR
+        self.assertEqual(response.status_code , 400)
+        self.assertEqual(self.reloaded().debt , Decimal('8.62'))
+
+
+    def test_debt_payment_compares_the_converted_amount(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(debt=Decimal('100.00'))
+        # 58.01 USD are 50.01 EUR, more than the 50 EUR of the card
+        response = self.post('58.01' , self.debit , currency='USD' , category=self.debt)
+        self.assertEqual(response.status_code , 400)
+        self.assertIn('Card balance is too low' , response.json()[0])
+        # 55 USD are 47.41 EUR: within the balance, although 55 > 50
+        self.assertEqual(self.post('55.00' , self.debit , currency='USD' , category=self.debt).status_code , 201)
+        self.assertEqual(self.reloaded().debt , Decimal('52.59'))
+
+        # the same for cash: 116.01 USD are 100.01 EUR, more than the 100 EUR of cash, 52.59 EUR are 61.00 USD
+        self.assertEqual(self.post('116.01' , currency='USD' , category=self.debt).status_code , 400)
+        self.assertEqual(self.post('61.00' , currency='USD' , category=self.debt).status_code , 201)
+        self.assertEqual(self.reloaded().debt , Decimal('0.00'))
+
+
+
+
+class CardNumberTests(TestCase):
+
+    def assertValidNumber(self , number):
+        # Luhn: doubling every second digit from the right, the digits add up to a multiple of 10
+        digits = [int(digit) for digit in reversed(number)]
+        total = sum(digits[0::2]) + sum(digit * 2 - 9 if(digit * 2 > 9) else digit * 2 for digit in digits[1::2])
+        self.assertEqual(total % 10 , 0 , number)
+        self.assertEqual((len(number) , number[:2] , number.isdigit()) , (16 , Card_number.PREFIX , True) , number)
+
+
+    def test_numbers_are_valid_and_unique(self):
+        numbers = Card_number.allocate(2000)
+        self.assertEqual(len(set(numbers)) , 2000)
+        for number in numbers:
+            self.assertValidNumber(number)
+
+
+    def setUp(self):
+        # the values cached by a test belong to a sequence row that is rolled back after it
+        self.addCleanup(Card_number.cached.clear)
+
+
+    def test_cards_are_numbered_from_the_cached_block(self):
+        user = CustomUser.objects.create(username='cards')
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Card.objects.create(user=user , balance=Decimal('0.00') , currency='EUR')
+        start = CardNumberSequence.objects.get(name='card_number').next_value - Card_number.BLOCK_SIZE
+        self.assertEqual(first.card_number , Card_number.from_sequence(start))
+
+        with QueryCounter() as counter:
+            cards = [Card.objects.create(user=user , balance=Decimal('0.00') , currency='EUR') for _ in range(5)]
+        self.assertFalse(any('cardnumbersequence' in sql for sql in counter.statements))
+        self.assertFalse(any(sql.startswith('SELECT') and 'transactionsapp_card"' in sql.lower() for sql in counter.statements))
+        self.assertEqual([card.card_number for card in cards] , [Card_number.from_sequence(start + value) for value in range(1 , 6)])
+
+
+    def test_rolled_back_block_is_not_cached(self):
+        try:
+            with db_transaction.atomic():
+                number = Card_number.allocate(1)[0]
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(Card_number.cached , [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Card_number.allocate(1) , [number]) # the sequence was rolled back as well
+        self.assertEqual(len(Card_number.cached) , Card_number.BLOCK_SIZE - 1)
+
+
+    def test_scrambling_is_a_bijection(self):
+        modulus = 10 ** Card_number.BODY_DIGITS
+        self.assertEqual(math.gcd(Card_number.MULTIPLIER , modulus) , 1) # x * MULTIPLIER is invertible modulo 10^13
+        inverse = pow(Card_number.MULTIPLIER , -1 , modulus)
+        values = list(range(0 , 50000)) + list(range(modulus - 50000 , modulus))
+        bodies = [int(Card_number.from_sequence(value)[2:-1]) for value in values]
+        self.assertEqual(len(set(bodies)) , len(values))
+        self.assertEqual([(body - Card_number.OFFSET) * inverse % modulus for body in bodies] , values)
+
+
+
+
+class BulkIngestionTests(TestCase):
+    # the batch applies TransactionSerializer.create's rules in memory (ingestion.BatchState): both paths must agree
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.accounts = {}
+        for name in ('single' , 'bulk'):
+            user = CustomUser.objects.create(username=name , cash=Decimal('100.00') , currency='EUR')
+            food = Category.objects.create(user=user , title='Food')
+            debt = Category.objects.create(user=user , title='debt')
+            debit = Card.objects.create(user=user , card_type='Debit Card' , balance=Decimal('100.00') , currency='EUR')
+            credit = Card.objects.create(user=user , card_type='Credit Card' , balance=Decimal('2000.00') , currency='USD')
+            cls.accounts[name] = (user , food , debt , debit , credit)
+
+
+    def items(self , name):
+        user , food , debt , debit , credit = self.accounts[name]
+        def card(card):
+            return {'payment_method': 'Card' , 'card_number': card.card_number , 'cvv': card.cvv , 'expiration_date': card.expiration_date}
+        cash = {'payment_method': 'Cash'}
+        item = {'category': food.pk , 'currency': 'EUR' , 'recurring': False , 'recurrence_choices': 'Daily'}
+        return [dict(item , type='Income' , amount='20.00' , **cash) ,
+                dict(item , type='Expense' , amount='30.00' , **card(debit)) ,
+                dict(item , type='Expense' , amount='80.00' , **card(debit)) , # declined, debt of 80
+                dict(item , type='Expense' , amount='10.00' , **cash) , # the credit card covers the debt
+                dict(item , type='Expense' , amount='50.00' , category=debt.pk , **cash) ,
+                dict(item , type='Expense' , amount='40.00' , category=debt.pk , **card(debit)) , # more than the debt
+                dict(item , type='Expense' , amount='30.00' , category=debt.pk , **card(debit)) ,
+                dict(item , type='Expense' , amount='1500.00' , currency='USD' , **card(credit)) , # credit limit
+                dict(item , type='Expense' , amount='130.00' , currency='USD' , **cash) , # 112.07 EUR, less than the cash
+                dict(item , type='Expense' , amount='20.00' , **cash) , # declined, debt of 20
+                dict(item , type='Expense' , amount='5.00' , **dict(card(debit) , card_number='4200000000000000')) ,
+                dict(item , type='Income' , amount='10.00' , currency='GBP' , **card(debit))]
+
+
+    def state(self , name):
+        user , food , debt , debit , credit = self.accounts[name]
+        user = CustomUser.objects.get(pk=user.pk)
+        return (user.cash , user.debt , list(Card.objects.filter(user=user).order_by('id').values_list('balance' , flat=True)))
+
+
+    def test_same_results_as_single_posts(self):
+        client = APIClient()
+        single = []
+        for item in self.items('single'):
+            response = client.post(f"/users/{self.accounts['single'][0].pk}/transactions/" , item , format='json')
+            single.append(('created' , response.json()['message']) if(response.status_code == 201) else ('error' , response.json()))
+
+        response = client.post(f"/users/{self.accounts['bulk'][0].pk}/transactions/bulk/" , self.items('bulk') , format='json')
+        self.assertEqual(response.status_code , 207)
+        bulk = [(result['status'] , result['message'] if(result['status'] == 'created') else result['errors']) for result in response.json()['results']]
+
+        self.assertEqual(bulk , single)
+        self.assertEqual([status for status , message in bulk] , ['created' , 'created' , 'error' , 'error' , 'created' , 'error' , 'created' ,
+                                                                   'error' , 'created' , 'error' , 'error' , 'created'])
+        self.assertEqual(self.state('bulk') , self.state('single'))
+        # debt payments lower the debt, not the balance they are paid from
+        self.assertEqual(self.state('bulk') , (Decimal('7.93') , Decimal('20.00') , [Decimal('81.76') , Decimal('2000.00')]))
+
+
+    def test_declined_batch_bumps_the_version(self):
+        user = self.accounts['bulk'][0]
+        CustomUser.objects.filter(pk=user.pk).update(cash=0)
+        version = DataVersion.objects.get(user=user).version
+        item = {'category': self.accounts['bulk'][1].pk , 'currency': 'EUR' , 'recurring': False , 'recurrence_choices': 'Daily' ,
+                'payment_method': 'Cash' , 'type': 'Expense' , 'amount': '10.00'}
+        response = APIClient().post(f'/users/{user.pk}/transactions/bulk/' , [item] , format='json')
+        self.assertEqual((response.status_code , response.json()['failed']) , (400 , 1))
+        self.assertEqual(CustomUser.objects.get(pk=user.pk).debt , Decimal('10.00'))
+        self.assertGreater(DataVersion.objects.get(user=user).version , version)
+
+
+
+
+class LedgerTests(TestCase):
+    # every balance mutation books a ledger entry, the entries of an account add up to its balance
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='ledger' , cash=Decimal('100.00') , currency='EUR')
+        cls.food = Category.objects.create(user=cls.user , title='Food')
+        Category.objects.create(user=cls.user , title='debt')
+        cls.card = Card.objects.create(user=cls.user , balance=Decimal('50.00') , currency='USD')
+
+
+    def assertLedgerMatchesBalances(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        accounts = {ledger.CASH: user.cash}
+        accounts.update(Card.objects.filter(user=user).values_list('id' , 'balance'))
+        for account , balance in accounts.items():
+            total = LedgerEntry.objects.filter(user=user , account=account).aggregate(total=Sum('amount'))['total']
+            self.assertEqual(total , balance , f'account {account}')
+
+
+    def test_every_mutation_is_booked(self):
+        client = APIClient()
+        card = {'card_number': self.card.card_number , 'cvv': self.card.cvv , 'expiration_date': self.card.expiration_date}
+        transaction = {'category': self.food.pk , 'amount': '10.00' , 'currency': 'EUR' , 'recurring': False , 'recurrence_choices': 'Daily'}
+        url = f'/users/{self.user.pk}'
+
+        client.post(f'{url}/transactions/' , dict(transaction , payment_method='Cash' , type='Expense') , format='json')
+        client.post(f'{url}/transactions/' , dict(transaction , payment_method='Card' , type='Income' , **card) , format='json')
+        client.post(f'{url}/transactions/bulk/' , [dict(transaction , payment_method='Cash' , type='Income' , amount='5.00') ,
+                                                   dict(transaction , payment_method='Card' , type='Expense' , amount='3.00' , **card)] , format='json')
+        client.patch(f'{url}/cards/{self.card.pk}/' , {'balance': '80.00'} , format='json')
+        client.put(f'{url}/' , {'username': 'ledger' , 'cash': str(CustomUser.objects.get(pk=self.user.pk).cash) , 'debt': '0.00' ,
+                                'currency': 'USD' , 'convert_currency': True} , format='json')
+
+        today = timezone.localdate()
+        Transaction.objects.create(user=self.user , category=self.food , payment_method='Card' , amount=Decimal('1.00') , currency='USD' ,
+                                   type='Expense' , recurring=True , recurrence_choices='Weekly' , subscription_start_date=today - timedelta(days=10) ,
+                                   subscription_next_paid_date=today - timedelta(days=10) , **card)
+        bill_subscriptions(today)
+        import_statement(self.user.pk , csv_rows(io.BytesIO(b'date,amount\n2024-01-01,7.50\n')))
+
+        kinds = set(LedgerEntry.objects.filter(user=self.user).values_list('kind' , flat=True))
+        self.assertEqual(kinds , {'opening' , 'transaction' , 'adjustment' , 'conversion' , 'subscription' , 'statement'})
+        self.assertLedgerMatchesBalances()
+
+
+    def test_history_reads_checkpoints(self):
+        LedgerEntry.objects.filter(user=self.user).delete()
+        today = timezone.localdate()
+        for days_ago , amount in [(10 , '100.00') , (7 , '-30.00') , (7 , '5.00') , (3 , '-20.00') , (0 , '1.00')]:
+            LedgerEntry.objects.create(user=self.user , account=ledger.CASH , currency='EUR' , amount=Decimal(amount) , kind='transaction' ,
+                                       booked_on=today - timedelta(days=days_ago))
+        expected = [Decimal(balance) for balance in ['0'] * 2 + ['100'] * 3 + ['75'] * 4 + ['55'] * 3 + ['56']]
+
+        def history():
+            return [day['balance'] for day in ledger.balance_history(self.user.pk , ledger.CASH , today - timedelta(days=12) , today)]
+
+        self.assertEqual(history() , expected) # no checkpoints yet: the whole ledger is the tail
+        self.assertEqual(ledger.checkpoint_balances(today - timedelta(days=5))['checkpoints'] , 2)
+        self.assertEqual(history() , expected)
+        self.assertEqual(ledger.checkpoint_balances()['checkpoints'] , 1)
+        self.assertEqual(ledger.checkpoint_balances()['checkpoints'] , 0)
+        self.assertEqual(history() , expected)
+        self.assertEqual(BalanceCheckpoint.objects.get(user=self.user , latest=True).balance , Decimal('55.00'))
+
+        with QueryCounter() as counter:
+            self.assertEqual(ledger.balance_on(self.user.pk , ledger.CASH , today - timedelta(days=4))['balance'] , Decimal('75.00'))
+        self.assertEqual(counter.count , 3) # checkpoints of the day, the checkpoint before it, the tail
+
+        response = APIClient().get(f'/users/{self.user.pk}/balance/' , {'on': today.isoformat()})
+        self.assertEqual(response.json() , {'day': today.isoformat() , 'balance': '56.00' , 'currency': 'EUR'})
+
+
+
+
+class ProjectionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='projection' , currency='EUR')
+        category = Category.objects.create(user=cls.user , title='Bills')
+        card = Card.objects.create(user=cls.user , balance=Decimal('0.00') , currency='EUR')
+        subscription = {'user': cls.user , 'category': category , 'payment_method': 'Card' , 'recurring': True , 'card_number': card.card_number ,
+                        'cvv': card.cvv , 'expiration_date': card.expiration_date}
+        for type , amount , currency , recurrence , next_paid , end in [
+                ('Expense' , '10.00' , 'EUR' , 'Monthly' , date(2025 , 1 , 31) , None) ,
+                ('Income' , '7.00' , 'EUR' , 'Weekly' , date(2025 , 1 , 13) , date(2025 , 2 , 10)) , # overdue, never paid on its end date
+                ('Expense' , '116.00' , 'USD' , 'Yearly' , date(2025 , 3 , 1) , None)]:
+            Transaction.objects.create(type=type , amount=Decimal(amount) , currency=currency , recurrence_choices=recurrence ,
+                                       subscription_start_date=next_paid , subscription_next_paid_date=next_paid , subscription_end_date=end ,
+                                       **subscription)
+        Transaction.objects.create(**dict(subscription , payment_method='Cash') , type='Expense' , amount=Decimal('1.00') , currency='EUR' ,
+                                   recurrence_choices='Daily' , subscription_next_paid_date=date(2025 , 1 , 15)) # never charged
+
+
+    def test_months_are_counted_arithmetically(self):
+        projection = build_projection(self.user.pk , months=6 , currency='EUR' , today=date(2025 , 1 , 15))
+        months = [(month['month'] , month['income'] , month['expense'] , month['payments']) for month in projection['months']]
+        self.assertEqual(months , [('2025-01' , '21.00' , '10.00' , 4) , ('2025-02' , '7.00' , '10.00' , 2) , ('2025-03' , '0.00' , '110.00' , 2) ,
+                                   ('2025-04' , '0.00' , '10.00' , 1) , ('2025-05' , '0.00' , '10.00' , 1) , ('2025-06' , '0.00' , '10.00' , 1)])
+        self.assertEqual((projection['subscriptions'] , projection['to']) , (3 , '2025-06-30'))
+
+
+    def test_endpoint(self):
+        response = APIClient().get(f'/users/{self.user.pk}/analytics/projection/' , {'months': 3 , 'currency': 'USD'})
+        self.assertEqual(response.status_code , 200)
+        self.assertEqual(len(response.json()['months']) , 3)
+        self.assertEqual(APIClient().get(f'/users/{self.user.pk}/analytics/projection/' , {'months': 0}).status_code , 400)
+
+
+
+
+
+
+
+class ExchangeRateTests(TestCase):
+    XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01" xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref">
+  <Cube>
+    <Cube time="2024-01-04"><Cube currency="USD" rate="1.2000"/><Cube currency="BGN" rate="1.9558"/></Cube>
+    <Cube time="2024-01-02"><Cube currency="USD" rate="1.1000"/><Cube currency="GBP" rate="0.8700"/></Cube>
+  </Cube>
+</gesmes:Envelope>'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='rates' , currency='EUR')
+        category = Category.objects.create(user=cls.user , title='Travel')
+        for day , amount in [(date(2024 , 1 , 2) , '110.00') , (date(2024 , 1 , 4) , '120.00')]:
+            Transaction.objects.create(user=cls.user , category=category , type='Expense' , amount=Decimal(amount) , currency='USD' ,
+                                       payment_method='Cash' , recurring=False , transaction_date=day)
+
+
+    def setUp(self):
+        rate_cache().expire()
+        self.addCleanup(rate_cache().expire) # the rates of the rolled back test stay in memory otherwise
+
+
+    def test_rate_of_a_day_is_the_last_published(self):
+        summary = load_rates(ecb_xml_rates(io.BytesIO(self.XML)) , chunk_size=2)
+        self.assertEqual((summary['rates'] , summary['skipped'] , summary['first'] , summary['last']) , (3 , 1 , date(2024 , 1 , 2) , date(2024 , 1 , 4)))
+
+        rates = rate_cache()
+        self.assertEqual(rates.rate('USD' , date(2024 , 1 , 3)) , Decimal('1.1')) # no rate on that day
+        self.assertEqual(rates.rate('USD' , date(2023 , 12 , 1)) , Decimal('1.1')) # before the first rate
+        self.assertEqual(rates.rate('USD') , Decimal('1.2'))
+        self.assertEqual(rates.rate('CHF' , date(2024 , 1 , 3)) , Currency_rate.currency_rates['CHF']) # no rates loaded
+        self.assertEqual(Currency_rate.convertion(Decimal('110') , 'USD' , 'GBP' , on=date(2024 , 1 , 2)) , Decimal('87'))
+
+        # a second file replaces the rates of the same days
+        ecb_csv = b'Date,USD,JPY,GBP,\n2024-01-04,1.2500,N/A,0.8600,\n'
+        self.assertEqual(load_rates(csv_rates(io.BytesIO(ecb_csv)))['rates'] , 2)
+        self.assertEqual(load_rates(csv_rates(io.BytesIO(b'date,currency,rate\n2024-01-05,USD,1.3\n')))['rates'] , 1)
+        self.assertEqual([rates.rate('USD' , date(2024 , 1 , 4)) , rates.rate('USD')] , [Decimal('1.25') , Decimal('1.3')])
+        self.assertEqual(ExchangeRate.objects.count() , 5)
+
+
+    def test_series_at_the_rates_of_each_day(self):
+        load_rates(ecb_xml_rates(io.BytesIO(self.XML)))
+        url = f'/users/{self.user.pk}/analytics/series/'
+        params = {'compute_statistics_from': '2024-01-01' , 'compute_statistics_to': '2024-01-31' , 'currency': 'EUR'}
+        self.assertEqual(APIClient().get(url , params).json()['series'][0]['expense'] , '191.67') # today's rate, 1.20
+        self.assertEqual(APIClient().get(url , {**params , 'historical_rates': 'true'}).json()['series'][0]['expense'] , '200.00')
+
+        # new rates change the cache key of the results
+        load_rates(csv_rates(io.BytesIO(b'date,currency,rate\n2024-01-05,USD,2.2\n')))
+        self.assertEqual(APIClient().get(url , params).json()['series'][0]['expense'] , '104.55')
@@ -0,0 +1,86 @@
+from .models import *
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+from rest_framework import status
+
+
+
+# The data version of a user grows with every change of the user's cards, categories, transactions and balances.
+# Model saves bump it through the signals below; QuerySet.update, the bulk paths and the deletes call
+# DataVersion.bump. There are no post_delete receivers: they would stop Django from fast-deleting the cards and
+# transactions of a deleted user (one query per row instead of one per table).
+
+
+
+@receiver(post_save , sender=CustomUser)
+def user_saved(sender , instance , created , raw=False , **kwargs):
+    if(raw):
+        return
+    if(created):
+        DataVersion.objects.create(user=instance , valid_until=instance.debt_timeframe)
+    else:
+        DataVersion.objects.filter(user_id=instance.pk).update(version=F('version') + 1 , valid_until=instance.debt_timeframe)
+
+
+
+@receiver(post_save , sender=Card)
+@receiver(post_save , sender=Category)
+@receiver(post_save , sender=Transaction)
+def user_data_changed(sender , instance , raw=False , **kwargs):
+    if(not raw):
+        DataVersion.bump(instance.user_id)
+
+
+
+
+
+class NotModified(Exception):
+    pass
+
+
+
+
+class ConditionalGetMixin:
+    # ETag on list/retrieve from the data version of the user of the URL. A matching If-None-Match gets a 304
+    # after one primary-key lookup of DataVersion, before the view touches any other table.
+    etag_actions = ('list' , 'retrieve')
+    version_kwarg = 'user_pk'
+
+
+    def current_etag(self , request):
+        user_id = str(self.kwargs.get(self.version_kwarg))
+        if(not user_id.isdigit()):
+            return None
+        row = DataVersion.objects.filter(user_id=user_id).values('version' , 'valid_until').first()
+        if(row is None or (row['valid_until'] and timezone.now() >= row['valid_until'])):
+            return None
+        # the representation also depends on the negotiated renderer (JSON or the browsable API)
+        return f'W/"{user_id}.{row["version"]}.{request.accepted_renderer.format}"'
+
+
+    def initial(self , request , *args , **kwargs):
+        super().initial(request , *args , **kwargs)
+        self.etag = None
+        if(request.method not in ('GET' , 'HEAD') or self.action not in self.etag_actions):
+            return
+        self.etag = self.current_etag(request)
+        if(self.etag):
+            tags = [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match' , ''))]
+            if('*' in tags or self.etag.removeprefix('W/') in tags):
+                raise NotModified()
+
+
+    def handle_exception(self , exc):
+        if(isinstance(exc , NotModified)):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+
+    def finalize_response(self , request , response , *args , **kwargs):
+        response = super().finalize_response(request , response , *args , **kwargs)
+        if(getattr(self , 'etag' , None) and response.status_code in (200 , 304)):
+            response['ETag'] = self.etag
+        return response
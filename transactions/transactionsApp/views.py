@@ -1,65 +1,96 @@
 from .serializers import *
 from .models import *
+from .analytics import build_report , build_series , report_params
+from .caching import cached_result
+from . import jobs
+from .insights import build_insights
+from .projection import build_projection
+from .pagination import TransactionPagination
+from . import rollups
+from . import ledger
+from .ingestion import ingest , MAX_ITEMS
+from .exports import EXPORTERS , EXPORT_CONTENT_TYPES
+from .statements import PARSERS , import_statement
+from .context import UserContextMixin
+from .querybudget import QueryBudgetMixin , ReadOnlyGuardMixin
+from .db_routing import ReplicaReadMixin , use_replica
+from .versioning import ConditionalGetMixin
+from django.db import transaction as db_transaction , router
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+import copy
 from rest_framework import viewsets
 from rest_framework.response import Response
-from dateutil.relativedelta import relativedelta
-from django.utils import timezone
+from rest_framework.decorators import action
+from rest_framework import status , exceptions
+
+
 
 
+def balance_response(request , user_id , account):
+    # the balance history of an account from the ledger, one checkpoint and the entries after it (ledger.py)
+    serializer = BalanceHistorySerializer(data = request.query_params)
+    serializer.is_valid(raise_exception = True)
+    data = serializer.validated_data
 
+    history = ledger.balance_history(user_id , account , data['date_from'] , data['date_to'])
+    if(data.get('on')):
+        return Response(BalanceSerializer(history[0]).data)
+    return Response(BalanceSerializer(history , many=True).data)
 
-class CustomUserViewSet(viewsets.ModelViewSet):
+
+
+
+class CustomUserViewSet(QueryBudgetMixin , ReadOnlyGuardMixin , ConditionalGetMixin , ReplicaReadMixin , viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
+    pin_kwarg = 'pk'
+    version_kwarg = 'pk'
+    query_budget = {'list': 1 , 'retrieve': 2 , 'create': 3 , 'update': 5 , 'partial_update': 5 , 'destroy': 15 , 'balance': 4}
+
+
+    @action(detail=True , methods=['get'])
+    def balance(self , request , *args , **kwargs): # cash at the end of every day, e.g. ?date_from=2025-01-01&date_to=2025-01-31, or of one day with ?on=2025-01-31
+        user = self.get_object()
+        return balance_response(request , user.pk , ledger.CASH)
     
 
 
 
 
 
-class CardViewSet(viewsets.ModelViewSet):
+class CardViewSet(QueryBudgetMixin , ReadOnlyGuardMixin , ConditionalGetMixin , ReplicaReadMixin , viewsets.ModelViewSet):
     serializer_class = CardSerializer
+    query_budget = {'list': 2 , 'retrieve': 2 , 'create': 7 , 'update': 4 , 'partial_update': 4 , 'destroy': 3 , 'bulk_issue': None , 'balance': 4}
 
     def get_queryset(self):
         user_id = self.kwargs.get('user_pk')
-        return Card.objects.filter(user_id=user_id)
+        return Card.objects.filter(user_id=user_id).select_related('user') # CardSerializer shows the username
 
     def perform_create(self , serializer):
         serializer.save(user_id=self.kwargs["user_pk"])
 
+    def perform_destroy(self , instance):
+        instance.delete()
+        DataVersion.bump(instance.user_id)
+
+
+    @action(detail=False , methods=['post'] , url_path='bulk')
+    def bulk_issue(self , request , *args , **kwargs): # issue many cards to this user (or to a list of users) at once
+        serializer = CardIssueSerializer(data=request.data , context={'user_id': int(self.kwargs['user_pk'])})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        with db_transaction.atomic():
+            cards = Card.bulk_issue(data['users'] , data['count'] , data['card_type'] , data['balance'] , data['currency'])
+            ledger.openings(cards=cards)
+        return Response({'created': len(cards) , 'users': len(data['users'])} , status=status.HTTP_201_CREATED)
 
-    def list(self , request , *args , **kwargs):
-        transaction = Transaction.objects.filter(user_id=self.kwargs['user_pk'] , payment_method='Card' , recurring=True)
-
-        for tr in transaction:
-            card = Card.objects.filter(user_id=self.kwargs['user_pk'] , card_number=tr.card_number , 
-                                       cvv=tr.cvv , expiration_date=tr.expiration_date).first()
-
-            if(timezone.now().date() == tr.subscription_next_paid_date and tr.subscription_next_paid_date != tr.subscription_end_date):
-                delta = relativedelta(days=1)
-                if(tr.recurrence_choices == 'Weekly'):
-                    delta = relativedelta(weeks=1)
-                elif(tr.recurrence_choices == 'Monthly'):
-                    delta = relativedelta(months=1)
-                elif(tr.recurrence_choices == 'Yearly'):
-                    delta = relativedelta(years=1)
-
-                if(tr.type == 'Expense'):
-                    if(tr.amount <= card.balance):
-                        card.balance -= tr.amount if(card.currency == tr.currency) else Currency_rate.convertion(tr.amount , tr.currency , card.currency)
-                        card.save()
-                        #tr.message = f'✅ Subsciption transaction for {tr.subscription_next_paid_date} completed successfully.'
-                    else:
-                        raise serializers.ValidationError(f'❌ Transaction declined: Card balance is too low.')
-                
-                elif(tr.type == 'Income'):
-                    card.balance += tr.amount if(card.currency == tr.currency) else Currency_rate.convertion(tr.amount , tr.currency , card.currency)
-                    card.save()
-                    #tr.message = f'✅ Subsciption transaction for {tr.subscription_next_paid_date} completed successfully.'
 
-                tr.subscription_next_paid_date += delta
-                tr.save()
-        return super().list(request , *args , **kwargs)
+    @action(detail=True , methods=['get'])
+    def balance(self , request , *args , **kwargs): # card balance at the end of every day, or of one day with ?on=2025-01-31
+        card = self.get_object()
+        return balance_response(request , card.user_id , card.pk)
 
 
 
@@ -67,21 +98,40 @@ class CardViewSet(viewsets.ModelViewSet):
 
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(QueryBudgetMixin , ReadOnlyGuardMixin , ConditionalGetMixin , ReplicaReadMixin , UserContextMixin , viewsets.ModelViewSet):
     serializer_class = CategorySerializer
+    replica_actions = ('list' , 'retrieve' , 'insights')
+    query_budget = {'list': 3 , 'retrieve': 3 , 'create': 4 , 'update': 5 , 'partial_update': 5 , 'destroy': 7 , 'insights': 4}
 
     def get_queryset(self):
         user_id = self.kwargs.get('user_pk')
         return Category.objects.filter(user_id=user_id)
 
-    def get_serializer_context(self): # collects user_id from URL (/users/ID/), stores the ID to context['user'] and this info goes to serializer
+    def get_serializer_context(self): # collects user_id from URL (/users/ID/), stores the user to context['user'] and this info goes to serializer
         context = super().get_serializer_context()
-        context['user'] = CustomUser.objects.get(id = self.kwargs['user_pk'])
+        context['user'] = context['user_context'].user
         return context
 
     def perform_create(self , serializer):
         serializer.save(user_id = self.kwargs["user_pk"])
 
+    def perform_destroy(self , instance):
+        # the transactions of the category are deleted with it
+        with db_transaction.atomic():
+            rollups.unrecord_category(instance)
+            instance.delete()
+            DataVersion.bump(instance.user_id)
+
+
+    @action(detail=False , methods=['get'])
+    def insights(self , request , *args , **kwargs): # categories ranked by spend with their share, median and p90 transaction size (this month by default)
+        serializer = CategoryInsightsSerializer(data = request.query_params)
+        serializer.is_valid(raise_exception = True)
+        data = dict(serializer.validated_data)
+
+        user = self.get_user_context().user
+        data.setdefault('currency' , user.currency)
+        return Response(cached_result('insights' , user.pk , data , lambda: build_insights(user.pk , **data)))
 
 
 
@@ -89,8 +139,14 @@ class CategoryViewSet(viewsets.ModelViewSet):
 
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+
+class TransactionViewSet(QueryBudgetMixin , ReadOnlyGuardMixin , ConditionalGetMixin , ReplicaReadMixin , UserContextMixin , viewsets.ModelViewSet):
     serializer_class = TransactionSerializer
+    replica_actions = ('list' , 'retrieve' , 'export')
+    # create: the debt payment branch is the most expensive one, export: the rows are read while streaming, after the view
+    query_budget = {'list': 3 , 'retrieve': 3 , 'create': 13 , 'update': 8 , 'partial_update': 8 , 'destroy': 4 , 'bulk': None ,
+                    'export': 2 , 'import_statement': None}
+    pagination_class = TransactionPagination
 
     def get_queryset(self):
         user_id = self.kwargs.get('user_pk')
@@ -107,7 +163,7 @@ class TransactionViewSet(viewsets.ModelViewSet):
             serializer.fields['category'].queryset = Category.objects.filter(user_id=user_pk)
                 
             # show the payment methods of the specific user only
-            if(Card.objects.filter(user_id=user_pk)):
+            if(self.get_user_context().has_cards()):
                 serializer.fields['payment_method'].choices = [('Cash','Cash') , ('Card' , 'Card')]
             else:
                 serializer.fields['payment_method'].choices = [('Cash','Cash')]
@@ -118,36 +174,95 @@ class TransactionViewSet(viewsets.ModelViewSet):
 
 
     def perform_create(self, serializer):
-        user = CustomUser.objects.get(pk=self.kwargs.get('user_pk'))
-        serializer.save(user=user)
+        serializer.save(user=self.get_user_context().user)
+
+    @action(detail=False , methods=['post'] , url_path='bulk')
+    def bulk(self , request , *args , **kwargs): # post a list of transactions, they are validated and applied as one batch
+        items = request.data
+        if(not isinstance(items , list) or not items):
+            raise serializers.ValidationError('⚠️ Provide a non-empty list of transactions.')
+        if(len(items) > MAX_ITEMS):
+            raise serializers.ValidationError(f'⚠️ At most {MAX_ITEMS} transactions can be posted at once.')
+
+        results = ingest(self.kwargs['user_pk'] , items)
+        created = sum(1 for result in results if(result['status'] == 'created'))
+        response = {'created': created , 'failed': len(results) - created , 'results': results}
+        if(created == 0):
+            return Response(response , status=status.HTTP_400_BAD_REQUEST)
+        return Response(response , status=status.HTTP_201_CREATED if(created == len(results)) else status.HTTP_207_MULTI_STATUS)
+
+
+    @action(detail=False , methods=['post'] , url_path='import')
+    def import_statement(self , request , *args , **kwargs): # upload a CSV or OFX bank statement (multipart, field 'file'), booked in chunks
+        serializer = StatementImportSerializer(data = request.data , context = self.get_serializer_context())
+        serializer.is_valid(raise_exception = True)
+        data = serializer.validated_data
+
+        user = self.get_user_context().user
+        rows = PARSERS[data['file_format']](data['file'])
+        summary = import_statement(user.pk , rows , card=data.get('card') , category=data['category'] , chunk_size=data['chunk_size'])
+        if(summary['imported'] == 0):
+            return Response(summary , status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary , status=status.HTTP_201_CREATED if(summary['failed'] == 0) else status.HTTP_207_MULTI_STATUS)
+
+
+    @action(detail=False , methods=['get'])
+    def export(self , request , *args , **kwargs): # full history streamed as CSV or NDJSON, e.g. ?output=ndjson&date_from=2025-01-01&date_to=2025-12-31&type=Expense&category=3
+        serializer = TransactionExportSerializer(data = request.query_params , context = self.get_serializer_context())
+        serializer.is_valid(raise_exception = True)
+        data = serializer.validated_data
+
+        user = self.get_user_context().user
+        # the stream is read after the view returns, outside the replica routing of the request
+        transactions = Transaction.objects.using(router.db_for_read(Transaction)).filter(user_id=user.pk)
+        if(data.get('date_from')):
+            transactions = transactions.filter(transaction_date__gte = data.get('date_from'))
+        if(data.get('date_to')):
+            transactions = transactions.filter(transaction_date__lte = data.get('date_to'))
+        if(data.get('type')):
+            transactions = transactions.filter(type = data.get('type'))
+        if(data.get('category') is not None):
+            transactions = transactions.filter(category_id = data.get('category'))
+
+        output = data['output']
+        response = StreamingHttpResponse(EXPORTERS[output](transactions) , content_type=EXPORT_CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="transactions-{user.pk}-{timezone.now().date().isoformat()}.{output}"'
+        return response
+
+
+    def perform_update(self , serializer):
+        old = copy.copy(serializer.instance)
+        with db_transaction.atomic():
+            rollups.unrecord(old)
+            rollups.record(serializer.save())
+
+    def perform_destroy(self , instance):
+        with db_transaction.atomic():
+            rollups.unrecord(instance)
+            instance.delete()
+            DataVersion.bump(instance.user_id) # no post_delete receiver for transactions, see versioning.py
 
 
 
 
     def list(self , request , *args , **kwargs):
         # If user has a card with balance more than his/her debt, then throw a notification to the user that he/she has a card 
-        # with which he/she can pay the debt. The timeframe for the user to pay is (for this example) 5 minutes. If timeframe is passed,
-        # then the card that was found which can pay the debt will be deactivated,
-
-        user = CustomUser.objects.get(pk=self.kwargs['user_pk'])
-        if(user.debt > 0):
-            card = Card.objects.filter(user=user , balance__gte=user.debt).first()
-            if(card):
-                if(not user.debt_timeframe):
-                    user.debt_timeframe = timezone.now() + relativedelta(minutes=5)
-                    user.save()
-
-                else:
-                    if(timezone.now() < user.debt_timeframe):
-                        return Response(f'⚠️ A card was found that can cover your debt. It will be deactivated at {user.debt_timeframe.strftime("%d-%m-%Y, %H:%M:%S")}')
-                
-                    card.delete()
-                    user.debt_timeframe = None
-                    user.save()
-                    return Response(f'❌ Card \'{str('*')*12}{card.card_number[12:]}\' deactivated. Debt was not settled within the required timeframe.')
-
-        
-        return super().list(request , *args , **kwargs)
+        # with which he/she can pay the debt. The timeframe is started and the card deactivated by the enforce_debts command
+        # (see debts.py), listing only reads.
+
+        user = self.get_user_context().user
+        if(user.debt > 0 and user.debt_timeframe and self.get_user_context().card_covering(user.debt)):
+            deadline = user.debt_timeframe.strftime("%d-%m-%Y, %H:%M:%S")
+            if(timezone.now() >= user.debt_timeframe):
+                # the deadline has passed, the card goes at the next run of the command
+                return Response(f'❌ Your debt is overdue since {deadline}. The card that can cover it is pending deactivation.')
+            return Response(f'⚠️ A card was found that can cover your debt. It will be deactivated at {deadline}')
+
+
+        # read path: plain rows instead of model instances and the per-row serializer machinery
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset.values(*TransactionRowSerializer.columns(*[field.lstrip('-') for field in self.paginator.ordering])))
+        return self.get_paginated_response(TransactionRowSerializer().serialize(page))
     
 
 
@@ -157,168 +272,82 @@ class TransactionViewSet(viewsets.ModelViewSet):
 
 
 
-class AnalyticsViewSet(viewsets.ModelViewSet):
+class AnalyticsViewSet(QueryBudgetMixin , ReadOnlyGuardMixin , ReplicaReadMixin , UserContextMixin , viewsets.ModelViewSet):
     serializer_class = AnalyticsSerializer
+    replica_actions = ('list' , 'retrieve' , 'create' , 'series' , 'projection') # create only computes the report
+    # create: ?async=true locks the user and counts the jobs in progress before it creates one
+    query_budget = {'list': 2 , 'retrieve': 2 , 'create': 7 , 'update': 3 , 'partial_update': 3 , 'destroy': 2 , 'series': 3 , 'projection': 3 ,
+                    'job_status': 1 , 'job_result': 1 , 'cancel': 2}
 
     def get_queryset(self , *args , **kwargs):
         user_id = self.kwargs.get('user_pk')
         return Analytics.objects.filter(user_id = user_id)
     
     
-    def get_serializer(self , *args , **kwargs):
-        kwargs['user_id'] = self.kwargs.get('user_pk')
-        return super().get_serializer(*args, **kwargs)
-    
-    
-
     def create(self , request , *args , **kwargs):
-        user_id = self.kwargs.get('user_pk')
-        serializer = AnalyticsSerializer(data = request.data , user_id = user_id)
+        serializer = self.get_serializer(data = request.data)
         serializer.is_valid(raise_exception = True)
         data = serializer.validated_data
 
-        user = CustomUser.objects.filter(id=user_id).first()
-        all_assets = data.get('all_assets')
-        cash = data.get('cash')
-        card = data.get('card')
-        income_transactions = data.get('income_transactions')
-        expense_transactions = data.get('expense_transactions')
-        subscriptions = data.get('subscriptions')
-        currency = data.get('currency')
-        compute_statistics_from = data.get('compute_statistics_from')
-        compute_statistics_to = data.get('compute_statistics_to')
-        choose_card = str(data.get('choose_card')).strip('-').split()[3]
-        selected_card = data.get('choose_card')
-        message = []
-        cards_balances = []
-        transactions = Transaction.objects.filter(user=user ,
-                                                  transaction_date__gte = compute_statistics_from ,
-                                                  transaction_date__lte = compute_statistics_to
-                                                  )
-        
-        
+        if(request.query_params.get('async') in ('1' , 'true')): # computed in the background, see jobs.py
+            use_replica.set(False) # the job is counted and written on the primary
+            try:
+                job = jobs.enqueue(int(self.kwargs['user_pk']) , data)
+            except jobs.JobLimitExceeded as error:
+                return Response(str(error) , status=status.HTTP_429_TOO_MANY_REQUESTS)
+            return Response(jobs.job_status(job) , status=status.HTTP_202_ACCEPTED)
+
+        context = self.get_user_context()
+        message = cached_result('report' , self.kwargs['user_pk'] , report_params(data) , lambda: build_report(context.user , data , cards=context.cards))
+        return Response(message)
+
+
+    def get_job(self):
+        job = self.get_object()
+        if(not job.status):
+            raise exceptions.NotFound('⚠️ This analytics entry is not a report job.')
+        return job
 
-        if(all_assets):
-            total_cash = user.cash if(user.currency == currency) else Currency_rate.convertion(user.cash , user.currency , currency)
-            total_card_balance = 0
-            for card in Card.objects.filter(user_id=user_id):
-                total_card_balance += (card.balance if(card.currency == currency) else Currency_rate.convertion(card.balance , card.currency , currency))
-                card_balance = (card.balance if(card.currency == currency) else Currency_rate.convertion(card.balance , card.currency , currency))
-                cards_balances.append(f'{card.card_type} - {card.card_number}  ->  {card_balance:.2f} {currency}')
-            message.append( f'Total assets: {total_cash + total_card_balance:.2f} {currency}' )
-            message.append('Total cash: ' f'{total_cash:.2f} {currency}')
-            message.append('Total card balance: ' f'{total_card_balance:.2f} {currency}')
-            message.append(cards_balances)
-
-            total_income_cash = 0
-            total_income_card = 0
-            total_expenses_cash = 0
-            total_expenses_card = 0
-            total_incomes_subscriptions = 0
-            total_expenses_subscriptions = 0
-
-            for tr in transactions:
-                this_card = Card.objects.filter(user=user , card_number=tr.card_number).first()
-                if(tr.type == 'Income'):
-                    if(tr.payment_method == 'Cash'):
-                        total_income_cash += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-                    if(tr.payment_method == 'Card' and this_card):
-                        total_income_card += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-                    if(tr.recurring):
-                        total_incomes_subscriptions += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-
-                if(tr.type == 'Expense'):
-                    if(tr.payment_method == 'Cash'):
-                        total_expenses_cash += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-                    if(tr.payment_method == 'Card' and this_card):
-                        total_expenses_card += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-                    if(tr.recurring):
-                        total_expenses_subscriptions += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-
-            message.append(f'Total incomes in cash: {total_income_cash:.2f} {currency}')
-            message.append(f'Total incomes in card: {total_income_card:.2f} {currency}')
-            message.append(f'Total expenses in cash: {total_expenses_cash:.2f} {currency}')
-            message.append(f'Total expenses in card: {total_expenses_card:.2f} {currency}')
-            message.append(f'Total incomes subscriptions: {total_incomes_subscriptions:.2f} {currency}')
-            message.append(f'Total expenses subscriptions: {total_expenses_subscriptions:.2f} {currency}')
-
-
-
-        elif(cash):
-            total_cash = user.cash if(user.currency == currency) else Currency_rate.convertion(user.cash , user.currency , currency)
-            message.append('Total cash: ' f'{total_cash:.2f} {currency}')
-
-            total_income_cash = 0
-            total_expense_cash = 0
-            for tr in transactions:
-                if(tr.type == 'Income' and tr.payment_method == 'Cash'):
-                    total_income_cash += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-
-                elif(tr.type == 'Expense' and tr.payment_method == 'Cash' and expense_transactions):
-                    total_expense_cash += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-
-            if(income_transactions):
-                message.append(f'Total incomes in cash: {total_income_cash:.2f} {currency}')
-
-            if(expense_transactions):
-                message.append(f'Total expenses in cash: {total_expense_cash:.2f} {currency}')
-            
-            elif(not income_transactions and not expense_transactions):
-                message.append(f'Total incomes in cash: {total_income_cash:.2f} {currency}')
-                message.append(f'Total expenses in cash: {total_expense_cash:.2f} {currency}')
-        
 
-        elif(card):
-            total_card_balance = 0
-            for card in Card.objects.filter(user_id=user_id):
-                total_card_balance += (card.balance if(card.currency == currency) else Currency_rate.convertion(card.balance , card.currency , currency))
-                card_balance = (card.balance if(card.currency == currency) else Currency_rate.convertion(card.balance , card.currency , currency))
-                cards_balances.append(f'{card.card_type} - {card.card_number}  ->  {card_balance:.2f} {currency}')
-            message.append('Total card balance: ' f'{total_card_balance:.2f} {currency}')
-            message.append(cards_balances)
-
-            total_income_card = 0
-            total_expenses_card = 0
-            total_incomes_subscriptions = 0
-            total_expenses_subscriptions = 0
-
-            for tr in transactions:
-                chosen_card = Card.objects.filter(user=user , card_number=tr.card_number).first()
-                if(chosen_card and tr.card_number == choose_card):
-                    if(tr.type == 'Income'):
-                        if(tr.payment_method == 'Card'):
-                            total_income_card += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-                        if(tr.recurring):
-                            total_incomes_subscriptions += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-
-                    if(tr.type == 'Expense'):
-                        if(tr.payment_method == 'Card'):
-                            total_expenses_card += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-                        if(tr.recurring):
-                            total_expenses_subscriptions += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-                    
-                    if(subscriptions):
-                        if(tr.recurring):
-                            if(tr.type == 'Income'):
-                                total_incomes_subscriptions += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-                            if(tr.type == 'Expense'):
-                                total_expenses_subscriptions += (tr.amount if(tr.currency == currency) else Currency_rate.convertion(tr.amount , tr.currency , currency))
-
-            if(income_transactions):
-                message.append(f'Total incomes with \'{selected_card}\': {total_income_card:.2f} {currency}')
-                if(subscriptions):
-                    message.append(f'Total incomes subscriptions with \'{selected_card}\': {total_incomes_subscriptions:.2f} {currency}')
-            if(expense_transactions):
-                message.append(f'Total expenses with \'{selected_card}\': {total_expenses_card:.2f} {currency}')
-                if(subscriptions):
-                    message.append(f'Total expenses subscriptions with \'{selected_card}\': {total_expenses_subscriptions:.2f} {currency}')
-            elif(subscriptions and not income_transactions and not expense_transactions):
-                message.append(f'Total incomes subscriptions with \'{selected_card}\': {total_incomes_subscriptions:.2f} {currency}')
-                message.append(f'Total expenses subscriptions with \'{selected_card}\': {total_expenses_subscriptions:.2f} {currency}')
-            elif(not income_transactions and not expense_transactions and not subscriptions):
-                message.append(f'Total incomes with \'{selected_card}\': {total_income_card:.2f} {currency}')
-                message.append(f'Total expenses with \'{selected_card}\': {total_expenses_card:.2f} {currency}')
-                message.append(f'Total incomes subscriptions with \'{selected_card}\': {total_incomes_subscriptions:.2f} {currency}')
-                message.append(f'Total expenses subscriptions with \'{selected_card}\': {total_expenses_subscriptions:.2f} {currency}')
-
-        return Response(message)
\ No newline at end of file
+    @action(detail=True , methods=['get'] , url_path='status')
+    def job_status(self , request , *args , **kwargs): # state of a report created with ?async=true
+        return Response(jobs.job_status(self.get_job()))
+
+
+    @action(detail=True , methods=['get'] , url_path='result')
+    def job_result(self , request , *args , **kwargs): # the report once it is done, 202 while it is queued or running
+        job = self.get_job()
+        if(job.status == 'done'):
+            return Response(job.result)
+        return Response(jobs.job_status(job) , status=status.HTTP_202_ACCEPTED if(job.status in jobs.ACTIVE) else status.HTTP_409_CONFLICT)
+
+
+    @action(detail=True , methods=['post'])
+    def cancel(self , request , *args , **kwargs):
+        job = self.get_job()
+        job.finished_at = jobs.cancel(job.pk)
+        if(job.finished_at is None):
+            return Response(f'⚠️ The report is already {job.status}.' , status=status.HTTP_409_CONFLICT)
+        job.status = 'cancelled'
+        return Response(jobs.job_status(job))
+
+
+
+    @action(detail=False , methods=['get'])
+    def series(self , request , *args , **kwargs): # income and expense per day, week or month as JSON, e.g. ?bucket=month&compute_statistics_from=2025-01-01&compute_statistics_to=2025-12-31
+        serializer = AnalyticsSeriesSerializer(data = request.query_params)
+        serializer.is_valid(raise_exception = True)
+
+        user = self.get_user_context().user
+        data = serializer.validated_data
+        return Response(cached_result('series' , user.pk , data , lambda: build_series(user.pk , **data)))
+
+
+    @action(detail=False , methods=['get'])
+    def projection(self , request , *args , **kwargs): # income and expense of the subscriptions per month ahead, e.g. ?months=12&currency=EUR
+        serializer = AnalyticsProjectionSerializer(data = request.query_params)
+        serializer.is_valid(raise_exception = True)
+
+        user = self.get_user_context().user
+        data = serializer.validated_data
+        return Response(cached_result('projection' , user.pk , data , lambda: build_projection(user.pk , **data)))